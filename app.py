@@ -1,111 +1,51 @@
 # app.py
-import io
-from typing import Optional, List, Dict
+from contextlib import contextmanager
 
-import requests
-import numpy as np
 import pandas as pd
 import plotly.express as px
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# ReportLab (PDF)
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import cm
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Image,
-    Table, TableStyle, PageBreak
+from core import (
+    APP_REPO, MESES_LARGO, METRICAS, DatosInvalidos, CACHE_DATASETS, RENDIMIENTO,
+    fmt_fecha_es, obtener_dataset, registro_apps, memoria_objetos, rango_inteligente, calcular_kpis, texto_resumen, tabla_por_periodo,
+)
+from report import (
+    LOGO_URL, PDF_FILAS_TABLA, RASTERIZADOR, COLA_REPORTES, FORMATOS_EXPORTACION, figura_evolucion,
+    generar_reporte_pdf, exportar, es_serie_larga, presupuesto_puntos,
 )
-from reportlab.lib.utils import ImageReader
 
 # =========================
 # Configuración general
 # =========================
+# Copy-on-Write en todo el proceso del servidor: el dataset se comparte entre sesiones y
+# lo que cada una deriva de él (slice, columnas, ds.vista()) no copia datos hasta escribirse.
+pd.set_option("mode.copy_on_write", True)
 st.set_page_config(page_title="Dashboard Evolucion de APP Heaven", page_icon="📊", layout="wide")
-
-# Logo e imagen del repo (se usa en portada e imagen destacada del PDF)
-LOGO_URL = "https://raw.githubusercontent.com/ale1795/HeavenAPP/main/HVN%20central%20blanco.png"
-
-MESES_LARGO = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
-MESES_ABR   = ["ene","feb","mar","abr","may","jun","jul","ago","sep","oct","nov","dic"]
-
-def fmt_fecha_es(ts, abr=True):
-    if pd.isna(ts): return ""
-    d = int(ts.day); m = int(ts.month); y = int(ts.year)
-    mes = (MESES_ABR if abr else MESES_LARGO)[m-1]
-    return f"{d:02d} {mes.capitalize()} {y}"
+RENDIMIENTO.inicio_rerun()
 
 st.markdown("<h1 style='text-align:center'>📊 Dashboard Evolucion de APP Heaven</h1>", unsafe_allow_html=True)
 st.markdown(f"<div style='text-align:center;margin-bottom:6px'><img src='{LOGO_URL}' width='120' /></div>", unsafe_allow_html=True)
 st.caption("Monitoreo de Impresiones, Descargas y Lanzamientos con comparativos vs. período anterior y YoY.")
 st.divider()
 
-# =========================
-# Carga y normalización
-# =========================
-@st.cache_data
-def leer_csv(path):
-    return pd.read_csv(path, sep=None, engine="python")
-
-def cargar_metricas(path_or_buffer, nombre_metrica):
-    raw = leer_csv(path_or_buffer)
-    cols_lower = {c.lower(): c for c in raw.columns}
-    if "date" not in cols_lower or "total" not in cols_lower:
-        st.error(f"El archivo debe tener columnas 'date' y 'total'. Trae: {list(raw.columns)}")
-        st.stop()
-
-    df = raw.rename(columns={cols_lower["date"]: "Fecha", cols_lower["total"]: nombre_metrica}).copy()
-    df["Fecha"] = pd.to_datetime(df["Fecha"], errors="coerce")
-    df = df.dropna(subset=["Fecha"])
-    df[nombre_metrica] = pd.to_numeric(df[nombre_metrica], errors="coerce").fillna(0)
-
-    df["Año"]    = df["Fecha"].dt.year
-    df["MesNum"] = df["Fecha"].dt.month
-    df["Semana"] = df["Fecha"].dt.isocalendar().week.astype(int)
-    df["Sem_ini"] = df["Fecha"] - pd.to_timedelta(df["Fecha"].dt.weekday, unit="D")
-    df["Sem_fin"] = df["Sem_ini"] + pd.Timedelta(days=6)
-
-    df["Etiqueta_dia"] = df["Fecha"].apply(lambda x: fmt_fecha_es(x, True))
-    df["Etiqueta_mes"] = df["MesNum"].map(lambda m: MESES_LARGO[m-1]) + " " + df["Año"].astype(str)
-    df["Etiqueta_año"] = df["Año"].astype(str)
-    df["Etiqueta_sem"] = ("Sem " + df["Semana"].astype(str) + " (" +
-                          df["Sem_ini"].apply(lambda x: fmt_fecha_es(x, True)) + " – " +
-                          df["Sem_fin"].apply(lambda x: fmt_fecha_es(x, True)) + ")")
-
-    df_total = df[["Fecha", nombre_metrica, "Año","MesNum","Semana",
-                   "Etiqueta_dia","Etiqueta_mes","Etiqueta_año","Etiqueta_sem"]]
-
-    # Plataformas opcionales
-    plat_cols = [c for c in raw.columns if c not in [cols_lower["date"], cols_lower["total"]]]
-    df_plat = None
-    if plat_cols:
-        dfp = raw[[cols_lower["date"]] + plat_cols].copy()
-        dfp["Fecha"] = pd.to_datetime(dfp[cols_lower["date"]], errors="coerce")
-        dfp = dfp.dropna(subset=["Fecha"]).drop(columns=[cols_lower["date"]])
-        def pretty(c):
-            m = {"ios":"iOS","android":"Android","apple_tv":"Apple TV","roku":"Roku","fire_tv":"Fire TV",
-                 "google_tv":"Google TV","car_play":"CarPlay","android_auto":"Android Auto"}
-            key = c.strip().lower()
-            return m.get(key, c.replace("_"," ").title())
-        dfp = dfp.rename(columns={c: pretty(c) for c in plat_cols})
-        for c in dfp.columns:
-            if c != "Fecha":
-                dfp[c] = pd.to_numeric(dfp[c], errors="coerce").fillna(0)
-        df_plat = dfp
-
-    return df_total, df_plat
-
 # =========================
 # Origen de datos
 # =========================
 st.sidebar.header("Origen de datos")
 origen = st.sidebar.radio("Selecciona cómo cargar los datos", ["Archivos del repositorio", "Subir archivos CSV"])
 
+app_sel, varias_apps = None, False
 if origen == "Archivos del repositorio":
-    imp_tot, imp_plat = cargar_metricas("impressions-year.csv", "Impresiones")
-    dwn_tot, dwn_plat = cargar_metricas("app-downloads-year.csv", "Descargas")
-    lnc_tot, lnc_plat = cargar_metricas("app-launches-year.csv", "Lanzamientos")
+    try:
+        apps = registro_apps()
+    except DatosInvalidos as e:
+        st.error(str(e)); st.stop()
+    app_sel = APP_REPO
+    varias_apps = len(apps) > 1
+    if varias_apps:
+        app_sel = st.sidebar.selectbox("App", list(apps), help="Las apps en memoria cambian sin releer sus CSV.")
+    fuentes = apps[app_sel]
 else:
     st.sidebar.caption("Sube los tres CSV (con columnas `date` y `total`):")
     up_imp = st.sidebar.file_uploader("Impresiones", type=["csv"])
@@ -113,20 +53,21 @@ else:
     up_lnc = st.sidebar.file_uploader("Lanzamientos", type=["csv"])
     if not (up_imp and up_dwn and up_lnc):
         st.info("Sube los tres CSV para continuar."); st.stop()
-    imp_tot, imp_plat = cargar_metricas(up_imp, "Impresiones")
-    dwn_tot, dwn_plat = cargar_metricas(up_dwn, "Descargas")
-    lnc_tot, lnc_plat = cargar_metricas(up_lnc, "Lanzamientos")
-
-df_all = (imp_tot.merge(dwn_tot, on=["Fecha","Año","MesNum","Semana","Etiqueta_dia","Etiqueta_mes","Etiqueta_año","Etiqueta_sem"], how="outer")
-                 .merge(lnc_tot, on=["Fecha","Año","MesNum","Semana","Etiqueta_dia","Etiqueta_mes","Etiqueta_año","Etiqueta_sem"], how="outer")
-                 .fillna(0).sort_values("Fecha"))
-for c in ["Impresiones","Descargas","Lanzamientos"]:
-    df_all[c] = pd.to_numeric(df_all[c], errors="coerce").fillna(0)
+    fuentes = {"Impresiones": up_imp, "Descargas": up_dwn, "Lanzamientos": up_lnc}
+
+try:
+    with RENDIMIENTO.etapa("dataset"):
+        ds = obtener_dataset(fuentes, app_sel)
+except (DatosInvalidos, FileNotFoundError) as e:
+    st.error(str(e)); st.stop()
+df_all = ds.vista()   # sin copia: el dataset se comparte entre sesiones
+st.sidebar.caption(f"Caché de datos: {CACHE_DATASETS.aciertos} aciertos · {CACHE_DATASETS.fallos} fallos"
+                   + (f" · en memoria: {', '.join(CACHE_DATASETS.residentes())}" if varias_apps else ""))
 if df_all.empty:
     st.warning("No hay datos."); st.stop()
 
-data_min = df_all["Fecha"].min().date()
-data_max = df_all["Fecha"].max().date()
+data_min = ds.data_min
+data_max = ds.data_max
 st.info(f"📅 Datos disponibles: **{data_min}** → **{data_max}**")
 
 # =========================
@@ -135,48 +76,41 @@ st.info(f"📅 Datos disponibles: **{data_min}** → **{data_max}**")
 col_gran, col_anio, col_mes, col_sem, col_dia = st.columns([1.2, 1, 1, 1, 1.3], vertical_alignment="bottom")
 with col_gran:
     gran = st.radio("Granularidad", ["Día","Semana","Mes","Año"], horizontal=True)
+filtros = ds.filtros   # opciones de los selectores precalculadas por dataset
 with col_anio:
-    años = sorted(df_all["Año"].unique())
+    años = filtros.anios
     anio_sel = st.selectbox("Año", años, index=len(años)-1)
 with col_mes:
     mes_opc = ["Todos"] + MESES_LARGO
     mes_sel = st.selectbox("Mes", mes_opc, index=0)
 with col_sem:
-    sem_disp = sorted(df_all[df_all["Año"]==anio_sel]["Semana"].unique())
-    sem_sel = st.selectbox("Semana (opcional)", ["Todas"] + list(map(int, sem_disp)), index=0)
+    sem_sel = st.selectbox("Semana (opcional)", ["Todas"] + list(filtros.semanas[anio_sel]), index=0)
 with col_dia:
-    dias_anio = df_all[df_all["Año"]==anio_sel]["Fecha"].dt.date.unique()
-    dia_sel = st.selectbox("Día (opcional)", ["Ninguno"] + sorted(map(str, dias_anio)), index=0)
+    dia_sel = st.selectbox("Día (opcional)", ["Ninguno"] + filtros.dias[anio_sel], index=0)
 
 # Sidebar: modo guía y comparación YoY
 st.sidebar.markdown("---")
 modo_guia = st.sidebar.toggle("🧭 Modo guía", value=False, help="Muestra consejos y explicación paso a paso.")
 cmp_yoy   = st.sidebar.toggle("📊 Comparar YoY (mismo período año anterior)", value=False)
-
-# Rango INTELIGENTE (prioridad: Día > Semana > Mes > Año)
-if dia_sel != "Ninguno":
-    ini_r = fin_r = pd.to_datetime(dia_sel).date()
-elif sem_sel != "Todas":
-    sem_ini = pd.to_datetime(f"{anio_sel}-W{int(sem_sel):02d}-1")
-    sem_fin = sem_ini + pd.Timedelta(days=6)
-    ini_r, fin_r = sem_ini.date(), sem_fin.date()
-elif mes_sel != "Todos":
-    mes_num = MESES_LARGO.index(mes_sel) + 1
-    ini_r = pd.Timestamp(anio_sel, mes_num, 1).date()
-    fin_r = (pd.Timestamp(anio_sel, mes_num, 1) + pd.offsets.MonthEnd(1)).date()
-else:
-    ini_r = pd.Timestamp(anio_sel, 1, 1).date()
-    fin_r = pd.Timestamp(anio_sel, 12, 31).date()
-
-# Limitar al rango real de datos
-ini_r = max(ini_r, data_min)
-fin_r = min(fin_r, data_max)
+ver_rend  = st.sidebar.toggle("⏱️ Rendimiento", value=False, help="Latencia por etapa de este rerun y promedios del servidor.")
+panel_rend = st.sidebar.container()
+
+# Rango INTELIGENTE (prioridad: Día > Semana > Mes > Año), limitado al rango real de datos
+ini_r, fin_r = rango_inteligente(
+    anio_sel,
+    mes=MESES_LARGO.index(mes_sel) + 1 if mes_sel != "Todos" else None,
+    semana=sem_sel if sem_sel != "Todas" else None,
+    dia=dia_sel if dia_sel != "Ninguno" else None,
+    data_min=data_min, data_max=data_max, filtros=filtros,
+)
 st.caption(f"**Rango de fechas:** {ini_r} – {fin_r}")
 
-df = df_all[(df_all["Fecha"] >= pd.to_datetime(ini_r)) & (df_all["Fecha"] <= pd.to_datetime(fin_r))]
-if df.empty:
+with RENDIMIENTO.etapa("kpis"):
+    k = calcular_kpis(ds, ini_r, fin_r, gran, cmp_yoy)
+if k["filas"] == 0:
     st.warning("No hay datos en el rango seleccionado."); st.stop()
 
+
 # =========================
 # Glosario simple
 # =========================
@@ -189,103 +123,13 @@ with st.expander("ℹ️ ¿Qué significan estas métricas?"):
 **🧭 Uso por instalación**: Lanzamientos ÷ Descargas (aperturas promedio por instalación).
 """)
 
-# =========================
-# Agregación
-# =========================
-def agregar(df_local, nivel, cols):
-    if nivel == "Día":
-        by, lab = ["Año","MesNum","Fecha","Etiqueta_dia"], "Etiqueta_dia"
-    elif nivel == "Semana":
-        by, lab = ["Año","Semana","Etiqueta_sem"], "Etiqueta_sem"
-    elif nivel == "Mes":
-        by, lab = ["Año","MesNum","Etiqueta_mes"], "Etiqueta_mes"
-    else:
-        by, lab = ["Año","Etiqueta_año"], "Etiqueta_año"
-    g = df_local.groupby(by, dropna=False)[cols].sum().reset_index().rename(columns={lab:"Etiqueta"})
-    g = g.sort_values([c for c in ["Año","MesNum","Semana","Fecha"] if c in g.columns])
-    g["Etiqueta"] = g["Etiqueta"].astype(str)
-    return g
-
-metricas = ["Impresiones","Descargas","Lanzamientos"]
-agg = agregar(df, gran, metricas)
-
-# =========================
-# Helpers comparativas
-# =========================
-def periodo_anterior(ini: pd.Timestamp, fin: pd.Timestamp, gran: str):
-    if gran == "Año":
-        return pd.Timestamp(ini.year-1, 1, 1), pd.Timestamp(ini.year-1, 12, 31)
-    if gran == "Mes":
-        ini_prev = (pd.Timestamp(ini.year, ini.month, 1) - pd.offsets.MonthBegin(1))
-        fin_prev = ini_prev + pd.offsets.MonthEnd(1)
-        return ini_prev, fin_prev
-    if gran == "Semana":
-        dur = fin - ini
-        return ini - pd.Timedelta(weeks=1), (ini - pd.Timedelta(weeks=1)) + dur
-    dur = fin - ini
-    return ini - dur - pd.Timedelta(days=1), fin - dur - pd.Timedelta(days=1)
-
-def periodo_yoy(ini: pd.Timestamp, fin: pd.Timestamp):
-    return pd.Timestamp(ini.year-1, ini.month, ini.day), pd.Timestamp(fin.year-1, fin.month, fin.day)
-
-def pct(a,b):
-    if b in (0, np.nan) or pd.isna(b): return np.nan
-    return (a - b) / b * 100.0
-
-def sumar_rango(df_base, ini, fin):
-    d = df_base[(df_base["Fecha"]>=pd.to_datetime(ini)) & (df_base["Fecha"]<=pd.to_datetime(fin))]
-    if d.empty: 
-        return {"Impresiones":0, "Descargas":0, "Lanzamientos":0}, np.nan, np.nan
-    imp = int(d["Impresiones"].sum()); dwn = int(d["Descargas"].sum()); lnc = int(d["Lanzamientos"].sum())
-    conv = (dwn/imp*100) if imp>0 else np.nan
-    uso  = (lnc/dwn) if dwn>0 else np.nan
-    return {"Impresiones":imp, "Descargas":dwn, "Lanzamientos":lnc}, conv, uso
-
-# Período actual
-tot_imp = int(df["Impresiones"].sum())
-tot_dwn = int(df["Descargas"].sum())
-tot_lnc = int(df["Lanzamientos"].sum())
-conv = (tot_dwn/tot_imp*100) if tot_imp>0 else 0
-uso  = (tot_lnc/tot_dwn) if tot_dwn>0 else 0
-
-# Período anterior
-ini_prev, fin_prev = periodo_anterior(pd.to_datetime(ini_r), pd.to_datetime(fin_r), gran)
-ini_prev = max(ini_prev.date(), data_min); fin_prev = min(fin_prev.date(), data_max)
-sum_prev, conv_prev, uso_prev = sumar_rango(df_all, ini_prev, fin_prev)
-
-delta_imp = pct(tot_imp, sum_prev["Impresiones"])
-delta_dwn = pct(tot_dwn, sum_prev["Descargas"])
-delta_lnc = pct(tot_lnc, sum_prev["Lanzamientos"])
-delta_conv = pct(conv, conv_prev) if pd.notna(conv_prev) else np.nan
-delta_uso  = pct(uso,  uso_prev)  if pd.notna(uso_prev)  else np.nan
-
-# Período YoY (opcional) — armado general para PDF
-yoy_block = None
-if cmp_yoy:
-    ini_yoy, fin_yoy = periodo_yoy(pd.to_datetime(ini_r), pd.to_datetime(fin_r))
-    ini_yoy = max(ini_yoy.date(), data_min); fin_yoy = min(fin_yoy.date(), data_max)
-    sum_yoy, conv_yoy, uso_yoy = sumar_rango(df_all, ini_yoy, fin_yoy)
-
-    delta_imp_yoy = pct(tot_imp, sum_yoy["Impresiones"])
-    delta_dwn_yoy = pct(tot_dwn, sum_yoy["Descargas"])
-    delta_lnc_yoy = pct(tot_lnc, sum_yoy["Lanzamientos"])
-    delta_conv_yoy = pct(conv, conv_yoy) if pd.notna(conv_yoy) else np.nan
-    delta_uso_yoy  = pct(uso,  uso_yoy)  if pd.notna(uso_yoy)  else np.nan
-
-    yoy_block = {
-        "RangoYoY": (ini_yoy, fin_yoy),
-        "Filas": [
-            ("Impresiones",        tot_imp, sum_yoy["Impresiones"], delta_imp_yoy),
-            ("Descargas",          tot_dwn, sum_yoy["Descargas"],   delta_dwn_yoy),
-            ("Lanzamientos",       tot_lnc, sum_yoy["Lanzamientos"],delta_lnc_yoy),
-            ("Conversión (%)",     conv,    conv_yoy if pd.notna(conv_yoy) else 0, delta_conv_yoy),
-            ("Uso/instalación",    uso,     uso_yoy if pd.notna(uso_yoy) else 0,   delta_uso_yoy),
-        ]
-    }
-
 # =========================
 # KPIs + resumen
 # =========================
+tot_imp, tot_dwn, tot_lnc = k["tot"]["Impresiones"], k["tot"]["Descargas"], k["tot"]["Lanzamientos"]
+conv, uso = k["conv"], k["uso"]
+delta_imp, delta_dwn, delta_lnc, delta_conv, delta_uso = (k["deltas"][c] for c in ["imp","dwn","lnc","conv","uso"])
+
 c1,c2,c3,c4,c5 = st.columns(5)
 c1.metric("👀 Impresiones (período)", f"{tot_imp:,}", delta=f"{delta_imp:+.1f}%" if pd.notna(delta_imp) else "–", help="Oportunidades de instalación")
 c2.metric("📥 Descargas (período)",  f"{tot_dwn:,}", delta=f"{delta_dwn:+.1f}%" if pd.notna(delta_dwn) else "–", help="Instalaciones")
@@ -293,375 +137,219 @@ c3.metric("🚀 Lanzamientos (per.)",  f"{tot_lnc:,}", delta=f"{delta_lnc:+.1f}%
 c4.metric("📈 Conversión",           f"{conv:,.2f}%", delta=f"{delta_conv:+.1f}%" if pd.notna(delta_conv) else "–", help="Descargas ÷ Impresiones × 100")
 c5.metric("🧭 Uso por instalación",  f"{uso:,.2f}",  delta=f"{delta_uso:+.1f}%"  if pd.notna(delta_uso)  else "–", help="Lanzamientos ÷ Descargas")
 
-def chip(valor):
-    if pd.isna(valor): return "—"
-    return ("🟢 +" if valor >= 0 else "🔴 ") + f"{valor:.1f}%"
-
-resumen = (
-    f"**Resumen:** Impresiones {chip(delta_imp)}, Descargas {chip(delta_dwn)}, "
-    f"Lanzamientos {chip(delta_lnc)}, Conversión {chip(delta_conv)}, Uso/instalación {chip(delta_uso)} "
-    f"vs. período anterior ({fmt_fecha_es(pd.to_datetime(ini_prev))} – {fmt_fecha_es(pd.to_datetime(fin_prev))})."
-)
-if yoy_block:
-    ini_yoy, fin_yoy = yoy_block["RangoYoY"]
-    di = yoy_block["Filas"][0][3]; dd = yoy_block["Filas"][1][3]; dl = yoy_block["Filas"][2][3]
-    dc = yoy_block["Filas"][3][3]; du = yoy_block["Filas"][4][3]
-    resumen += (
-        f"  |  **YoY:** Imp {chip(di)}, Desc {chip(dd)}, Lanz {chip(dl)}, "
-        f"Conv {chip(dc)}, Uso {chip(du)} vs. {fmt_fecha_es(pd.to_datetime(ini_yoy))} – {fmt_fecha_es(pd.to_datetime(fin_yoy))}."
-    )
+resumen = texto_resumen(k)
 st.info(resumen)
 
 st.caption(
-    f"**Período:** {fmt_fecha_es(df['Fecha'].min())} – {fmt_fecha_es(df['Fecha'].max())} | "
+    f"**Período:** {fmt_fecha_es(k['fecha_min'])} – {fmt_fecha_es(k['fecha_max'])} | "
     f"**Granularidad:** {gran}"
 )
 
 # =========================
-# Tabs
+# Tabs (fragmentos)
 # =========================
-tab1, tab2, tab3, tab4 = st.tabs(["📊 Visualización", "🧩 Por plataforma", "📄 Reporte (Excel)", "🖨️ Reporte PDF"])
-
-with tab1:
-    st.subheader(f"Evolución por {gran.lower()}")
-    if gran in ["Día","Semana"]:
-        fig = px.line(agg, x="Etiqueta", y=metricas, markers=True)
-    else:
-        fig = px.bar(agg, x="Etiqueta", y=metricas, barmode="group")
-    fig.update_xaxes(type="category")
-    fig.update_layout(xaxis_title="", legend_title="", hovermode="x unified")
-    st.plotly_chart(fig, use_container_width=True)
-
-    if modo_guia:
-        with st.expander("Cómo leer este gráfico"):
-            st.markdown(f"""
+# Cada pestaña es un fragmento: un cambio en sus propios widgets vuelve a correr solo esa
+# pestaña, con el dataset, rango, granularidad y KPIs del último rerun completo (van como
+# argumentos). Los filtros superiores y la barra lateral siguen provocando un rerun completo.
+# El rerun parcial se mide aparte (RENDIMIENTO.fragmentos) para compararlo con el completo.
+# Los botones de descarga van fuera de los fragmentos (ver panel_trabajo), y streamlit>=1.37
+# no suelta los archivos de la sesión en un rerun parcial: una descarga ya mostrada en otra
+# pestaña sigue viva aunque se toque un widget de esta.
+@contextmanager
+def rerun_parcial(nombre):
+    ctx = get_script_run_ctx()
+    if not (ctx and ctx.fragment_ids_this_run):
+        yield   # dentro de un rerun completo: sus etapas cuentan en ese rerun
+        return
+    RENDIMIENTO.inicio_rerun()
+    try:
+        yield
+    finally:
+        RENDIMIENTO.fin_rerun(sesion=ctx.session_id, fragmento=nombre)
+
+@st.fragment
+def tab_visualizacion(ds, gran, ini_r, fin_r, modo_guia):
+    with rerun_parcial("visualizacion"):
+        st.subheader(f"Evolución por {gran.lower()}")
+        with RENDIMIENTO.etapa("agregacion"):
+            agg = ds.cubo.rango(gran, ini_r, fin_r)
+        puntos_max = None
+        if es_serie_larga(agg, gran):
+            # Serie diaria larga: eje de fechas, reducción LTTB y WebGL (ver report.figura_serie_larga)
+            completa = st.toggle("Serie completa", value=False,
+                                 help="Envía todos los días al navegador en vez de una versión reducida que conserva la forma.")
+            puntos_max = None if completa else presupuesto_puntos()
+            if puntos_max and len(agg) > puntos_max:
+                st.caption(f"Mostrando {puntos_max:,} de {len(agg):,} puntos por serie (reducción LTTB).")
+        with RENDIMIENTO.etapa("plotly", filas=len(agg)):
+            fig = figura_evolucion(agg, gran, puntos_max=puntos_max)
+            fig.update_layout(hovermode="x unified")
+            st.plotly_chart(fig, use_container_width=True)
+
+        if modo_guia:
+            with st.expander("Cómo leer este gráfico"):
+                st.markdown(f"""
 - El eje **X** muestra períodos por **{gran.lower()}** (cámbialo arriba).
 - Las series comparan **Impresiones**, **Descargas** y **Lanzamientos**.
 - Revisa los **KPIs**: variación vs. período anterior y (si activas) **YoY**.
 - Para ver un mes o semana específica, usa los selectores de arriba.
 """)
-        st.success("Consejo: en **Por plataforma** ves si el cambio viene de iOS, Android u otra plataforma.")
+            st.success("Consejo: en **Por plataforma** ves si el cambio viene de iOS, Android u otra plataforma.")
+    return agg
+
+@st.fragment
+def tab_plataformas(ds, gran, ini_r, fin_r):
+    with rerun_parcial("plataformas"):
+        st.subheader("Segmentación por plataforma")
+        met_seg = st.selectbox("Métrica para segmentar", METRICAS, index=1)
+        cubo_plat = ds.plataformas
+        if met_seg not in cubo_plat.metricas:
+            st.info("Tus CSV no traen columnas por plataforma.")
+            return None
+        num_cols = cubo_plat.columnas(met_seg)
+        with RENDIMIENTO.etapa("agregacion"):
+            agg_plat = cubo_plat.rango(met_seg, gran, ini_r, fin_r)
+
+        with RENDIMIENTO.etapa("plotly", filas=len(agg_plat)):
+            fig_stack = px.bar(agg_plat, x="Etiqueta", y=num_cols, barmode="stack", title=f"{met_seg} por {gran.lower()} (apilado)")
+            fig_stack.update_xaxes(type="category")
+            fig_stack.update_layout(xaxis_title="", legend_title="")
+            st.plotly_chart(fig_stack, use_container_width=True)
+
+            ultimo = cubo_plat.ultimo(met_seg, gran, ini_r, fin_r)
+            if ultimo is not None:
+                st.plotly_chart(px.pie(values=ultimo.values, names=ultimo.index, title="Participación (último período)"),
+                                use_container_width=True)
+    return agg_plat
 
-with tab2:
-    st.subheader("Segmentación por plataforma")
-    met_seg = st.selectbox("Métrica para segmentar", metricas, index=1)
-    plat_map = {"Impresiones": imp_plat, "Descargas": dwn_plat, "Lanzamientos": lnc_plat}
-    dfp = plat_map.get(met_seg)
-    if dfp is None:
-        st.info("Tus CSV no traen columnas por plataforma.")
+# =========================
+# Reportes en segundo plano (report.COLA_REPORTES: progreso, deduplicación y resultados con TTL)
+# =========================
+# La clave de cada trabajo son sus parámetros (un pedido repetido devuelve el mismo resultado).
+# La sesión recuerda el último pedido de cada pestaña; su progreso y, al terminar, la descarga
+# se dibujan en el cuerpo del rerun completo, con los bytes que guarda la cola, nunca dentro
+# de un fragmento. El pedido se descarta si cambian los datos o el rango que lo originaron.
+# Mientras sigue activo, un fragmento chico redibuja solo la barra de progreso cada segundo y,
+# cuando el trabajo termina, pide un único rerun completo que ya dibuja la descarga.
+pedidos = st.session_state.setdefault("reportes_pedidos", {})
+
+def pedir(pestaña, contexto, clave, fn, *args, descripcion, etiqueta, archivo, mime, **kwargs):
+    """Encola el trabajo, lo recuerda como pedido de la pestaña y pasa a un rerun completo."""
+    COLA_REPORTES.enviar(clave, fn, *args, descripcion=descripcion, **kwargs)
+    pedidos[pestaña] = (contexto, clave, etiqueta, archivo, mime)
+    st.rerun()
+
+@st.fragment(run_every=1)
+def progreso_trabajo(clave):
+    t = COLA_REPORTES.obtener(clave)
+    if t is None or not t.activo:
+        st.rerun()   # terminó: un único rerun completo dibuja la descarga
+    st.progress(t.progreso, text=f"{t.mensaje}…")
+
+def panel_trabajo(pestaña, contexto):
+    pedido = pedidos.get(pestaña)
+    if pedido is None or pedido[0] != contexto:
+        pedidos.pop(pestaña, None)
+        return
+    _, clave, etiqueta, nombre_archivo, mime = pedido
+    t = COLA_REPORTES.obtener(clave)
+    if t is None:
+        return
+    if t.activo:
+        progreso_trabajo(clave)
+    elif t.estado == "listo":
+        st.download_button(etiqueta, data=t.resultado, file_name=nombre_archivo, mime=mime,
+                           key=f"descarga_{pestaña}")
     else:
-        dfp = dfp.merge(df[["Fecha"]], on="Fecha", how="inner")
-        dfp["Año"]=dfp["Fecha"].dt.year; dfp["MesNum"]=dfp["Fecha"].dt.month
-        dfp["Semana"]=dfp["Fecha"].dt.isocalendar().week.astype(int)
-        dfp["Sem_ini"]=dfp["Fecha"]-pd.to_timedelta(dfp["Fecha"].dt.weekday, unit="D")
-        dfp["Sem_fin"]=dfp["Sem_ini"]+pd.Timedelta(days=6)
-        dfp["Etiqueta_dia"]=dfp["Fecha"].apply(lambda x: fmt_fecha_es(x, True))
-        dfp["Etiqueta_mes"]=dfp["MesNum"].map(lambda m: MESES_LARGO[m-1])+" "+dfp["Año"].astype(str)
-        dfp["Etiqueta_año"]=dfp["Año"].astype(str)
-        dfp["Etiqueta_sem"]=("Sem "+dfp["Semana"].astype(str)+" ("+
-                             dfp["Sem_ini"].apply(lambda x: fmt_fecha_es(x, True))+" – "+
-                             dfp["Sem_fin"].apply(lambda x: fmt_fecha_es(x, True))+")")
-        by_map={"Día":["Año","MesNum","Fecha","Etiqueta_dia"],"Semana":["Año","Semana","Etiqueta_sem"],
-                "Mes":["Año","MesNum","Etiqueta_mes"],"Año":["Año","Etiqueta_año"]}
-        etiqueta = by_map[gran][-1]
-        agg_plat = dfp.groupby(by_map[gran], dropna=False).sum(numeric_only=True).reset_index().rename(columns={etiqueta:"Etiqueta"})
-        num_cols = [c for c in agg_plat.columns if c not in by_map[gran]+["Etiqueta","Sem_ini","Sem_fin","Fecha","MesNum","Año","Semana"]]
-        agg_plat = agg_plat.sort_values([c for c in ["Año","MesNum","Semana","Fecha"] if c in agg_plat.columns])
-        agg_plat["Etiqueta"]=agg_plat["Etiqueta"].astype(str)
-
-        fig_stack = px.bar(agg_plat, x="Etiqueta", y=num_cols, barmode="stack", title=f"{met_seg} por {gran.lower()} (apilado)")
-        fig_stack.update_xaxes(type="category")
-        fig_stack.update_layout(xaxis_title="", legend_title="")
-        st.plotly_chart(fig_stack, use_container_width=True)
-
-        if len(agg_plat)>0:
-            ultimo = agg_plat.iloc[-1][num_cols]
-            st.plotly_chart(px.pie(values=ultimo.values, names=ultimo.index, title="Participación (último período)"),
-                            use_container_width=True)
+        st.error(f"No se pudo generar el archivo: {t.error}")
+
+@st.fragment
+def tab_exportacion(ds, ini_r, fin_r):
+    with rerun_parcial("exportacion"):
+        st.subheader("Descargar datos agregados")
+        periodo = st.selectbox("Periodo de tabla", ["Diario","Semanal","Mensual","Anual"])
+        with RENDIMIENTO.etapa("agregacion"):
+            tabla = tabla_por_periodo(ds.cubo, periodo, ini_r, fin_r)
+        st.dataframe(tabla, use_container_width=True)
+
+        col_fmt, col_todos, col_btn = st.columns([1.2, 1.6, 1], vertical_alignment="bottom")
+        with col_fmt:
+            formato_sel = st.selectbox("Formato", list(FORMATOS_EXPORTACION))
+        with col_todos:
+            todos = st.checkbox("Todos los periodos (Diario, Semanal, Mensual y Anual)",
+                                help="Excel: una hoja por periodo. CSV / Parquet: una tabla con columna «Periodo».")
+        ext, mime = FORMATOS_EXPORTACION[formato_sel]
+        periodos = ("Diario","Semanal","Mensual","Anual") if todos else (periodo,)
+        clave_exp = ("exportacion", ds.huella, ini_r, fin_r, periodos, ext)
+        with col_btn:
+            if st.button("📦 Preparar descarga"):
+                pedir("exportacion", (ds.huella, ini_r, fin_r), clave_exp, exportar,
+                      ds.cubo, list(periodos), ini_r, fin_r, ext, descripcion=f"{ext} {'/'.join(periodos)}",
+                      etiqueta=f"📥 Descargar {formato_sel}", mime=mime,
+                      archivo=f"datos_{'periodos' if todos else periodo.lower()}.{ext}")
+    return tabla
+
+@st.fragment
+def tab_pdf(ds, k, resumen, gran, cmp_yoy, ini_r, fin_r):
+    with rerun_parcial("pdf"):
+        st.subheader("Generar Reporte PDF profesional")
+        periodo_pdf = st.selectbox("Periodo de tabla PDF", ["Diario","Semanal","Mensual","Anual"])
+        tabla_completa = st.checkbox("Incluir la tabla completa (todas las filas, paginada)", value=False,
+                                     help=f"Por defecto el PDF lleva los primeros {PDF_FILAS_TABLA} registros.")
+
+        # Los KPIs y el resumen se derivan de (datos, rango, granularidad, YoY): no van en la clave
+        clave_pdf = ("pdf", ds.huella, ini_r, fin_r, gran, cmp_yoy, periodo_pdf, tabla_completa)
+        if st.button("🖨️ Generar PDF"):
+            RASTERIZADOR.calentar()   # recién al primer pedido: cada renderer es un Chromium
+            pedir("pdf", (ds.huella, ini_r, fin_r, gran, cmp_yoy), clave_pdf, generar_reporte_pdf,
+                  ds, k, periodo_pdf, resumen, tabla_completa=tabla_completa,
+                  descripcion=f"pdf {periodo_pdf.lower()}" + (" completo" if tabla_completa else ""),
+                  etiqueta="📥 Descargar PDF", archivo=f"reporte_{periodo_pdf.lower()}.pdf", mime="application/pdf")
 
+tab1, tab2, tab3, tab4 = st.tabs(["📊 Visualización", "🧩 Por plataforma", "📄 Reporte (Excel)", "🖨️ Reporte PDF"])
+with tab1:
+    agg = tab_visualizacion(ds, gran, ini_r, fin_r, modo_guia)
+with tab2:
+    agg_plat = tab_plataformas(ds, gran, ini_r, fin_r)
 with tab3:
-    st.subheader("Descargar datos agregados")
-    periodo = st.selectbox("Periodo de tabla", ["Diario","Semanal","Mensual","Anual"])
-    def agregar_tabla(df_local, p):
-        mapa = {"Diario":"Día", "Semanal":"Semana", "Mensual":"Mes", "Anual":"Año"}
-        t = agregar(df_local, mapa[p], metricas); t["Etiqueta"]=t["Etiqueta"].astype(str); return t
-    tabla = agregar_tabla(df, periodo)
-    st.dataframe(tabla, use_container_width=True)
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="xlsxwriter") as writer:
-        tabla.to_excel(writer, index=False, sheet_name="Datos")
-    st.download_button("📥 Descargar Excel", data=out.getvalue(),
-                       file_name=f"datos_{periodo.lower()}.xlsx",
-                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    tabla = tab_exportacion(ds, ini_r, fin_r)
+    panel_trabajo("exportacion", (ds.huella, ini_r, fin_r))
+with tab4:
+    tab_pdf(ds, k, resumen, gran, cmp_yoy, ini_r, fin_r)
+    panel_trabajo("pdf", (ds.huella, ini_r, fin_r, gran, cmp_yoy))
 
 # =========================
-# PDF profesional (maquetado avanzado)
+# Rendimiento (panel opcional)
 # =========================
-def build_pdf(
-    logo_url: str,
-    titulo: str,
-    subtitulo: str,
-    kpis: Dict[str, float],
-    figuras_png: List[bytes],
-    tabla_df: pd.DataFrame,
-    extra_image_bytes: Optional[bytes] = None,
-    yoy_block: Optional[Dict] = None,
-    resumen_texto: Optional[str] = None,
-    deltas: Optional[Dict[str, float]] = None,        # {"imp","dwn","lnc","conv","uso"}
-    deltas_yoy: Optional[Dict[str, float]] = None     # no usado visualmente, pero previsto
-):
-    """Genera PDF con portada, imagen destacada, KPIs, gráficos, YoY y tabla."""
-    # ----- Utils -----
-    def _thousands(x):
-        if isinstance(x, (int, np.integer)): return f"{x:,}"
-        if isinstance(x, float): return f"{x:,.2f}"
-        return str(x)
-    def _delta_chip(x):
-        if x is None or (isinstance(x, float) and (pd.isna(x) or np.isnan(x))): return "—"
-        return f"{x:+.1f}%"
-    def _fit_image_bytes(img_bytes, max_w, max_h):
-        try:
-            ir = ImageReader(io.BytesIO(img_bytes))
-            iw, ih = ir.getSize()
-            ratio = min(max_w / iw, max_h / ih)
-            return Image(io.BytesIO(img_bytes), width=iw * ratio, height=ih * ratio)
-        except Exception:
-            return None
-
-    # ----- Doc -----
-    buf = io.BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=A4,
-                            topMargin=1.2*cm, bottomMargin=1.2*cm,
-                            leftMargin=1.5*cm, rightMargin=1.5*cm)
-    W, H = A4
-
-    styles = getSampleStyleSheet()
-    if "TituloReporte" not in styles.byName:
-        styles.add(ParagraphStyle(name="TituloReporte", parent=styles["Heading1"], alignment=1, fontSize=20, spaceAfter=8))
-    if "SubtituloReporte" not in styles.byName:
-        styles.add(ParagraphStyle(name="SubtituloReporte", parent=styles["Heading2"], alignment=1, fontSize=11, textColor=colors.grey, spaceAfter=6))
-    if "BodySmall" not in styles.byName:
-        styles.add(ParagraphStyle(name="BodySmall", parent=styles["Normal"], fontSize=9, leading=12))
-    if "KPIHead" not in styles.byName:
-        styles.add(ParagraphStyle(name="KPIHead", parent=styles["Normal"], alignment=1, fontSize=9, textColor=colors.grey))
-    if "KPIValue" not in styles.byName:
-        styles.add(ParagraphStyle(name="KPIValue", parent=styles["Normal"], alignment=1, fontSize=16, spaceAfter=4))
-    if "KPISub" not in styles.byName:
-        styles.add(ParagraphStyle(name="KPISub", parent=styles["Normal"], alignment=1, fontSize=9, textColor=colors.grey))
-
-    def _header_footer(canvas, _doc):
-        canvas.saveState()
-        canvas.setFont("Helvetica", 8)
-        canvas.setFillColor(colors.grey)
-        canvas.setStrokeColor(colors.lightgrey)
-        canvas.setLineWidth(0.3)
-        canvas.line(1.5*cm, H-1.0*cm, W-1.5*cm, H-1.0*cm)
-        canvas.drawString(1.5*cm, 0.9*cm, "Dashboard Evolución App Heaven")
-        canvas.drawRightString(W-1.5*cm, 0.9*cm, f"Página {_doc.page}")
-        canvas.restoreState()
-
-    story = []
-
-    # ----- Portada -----
-    try:
-        logo_bytes = requests.get(logo_url, timeout=10).content
-    except Exception:
-        logo_bytes = None
-    story.append(Spacer(1, 0.4*cm))
-    if logo_bytes:
-        logo_img = _fit_image_bytes(logo_bytes, max_w=3.8*cm, max_h=3.0*cm)
-        if logo_img: story.append(logo_img)
-        story.append(Spacer(1, 0.2*cm))
-    story.append(Paragraph(titulo, styles["TituloReporte"]))
-    story.append(Paragraph(subtitulo, styles["SubtituloReporte"]))
-    sep = Table([[""]], colWidths=[W-3*cm], rowHeights=[0.15*cm])
-    sep.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,-1), colors.lightgrey)]))
-    story.append(sep)
-    story.append(Spacer(1, 0.3*cm))
-
-    # Imagen destacada (del repo)
-    if extra_image_bytes:
-        big = _fit_image_bytes(extra_image_bytes, max_w=W-3*cm, max_h=H/2)
-        if big:
-            story.append(Paragraph("Imagen destacada", styles["Heading2"]))
-            story.append(big)
-            story.append(Spacer(1, 0.2*cm))
-
-    if resumen_texto:
-        story.append(Paragraph("Resumen ejecutivo", styles["Heading2"]))
-        story.append(Paragraph(resumen_texto, styles["BodySmall"]))
-        story.append(Spacer(1, 0.2*cm))
-    story.append(PageBreak())
-
-    # ----- KPIs en tarjetas -----
-    def _kpi_card(nombre, valor, delta=None):
-        lbl = Paragraph(nombre, styles["KPIHead"])
-        val = Paragraph(_thousands(valor), styles["KPIValue"])
-        if delta is None or (isinstance(delta, float) and pd.isna(delta)):
-            sub = Paragraph("&nbsp;", styles["KPISub"])
-        else:
-            col = colors.green if delta >= 0 else colors.red
-            sub = Paragraph(f"<font color='{col.rgb()}'>({_delta_chip(delta)})</font>", styles["KPISub"])
-        t = Table([[lbl],[val],[sub]], colWidths=[(W-3*cm)/5])
-        t.setStyle(TableStyle([
-            ('BOX',(0,0),(-1,-1), 0.5, colors.lightgrey),
-            ('INNERGRID',(0,0),(-1,-1), 0.25, colors.whitesmoke),
-            ('BACKGROUND',(0,0),(-1,0), colors.whitesmoke),
-            ('VALIGN',(0,0),(-1,-1),'MIDDLE'),
-            ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ]))
-        return t
-
-    cards = [
-        _kpi_card("👀 Impresiones", kpis["imp"], (deltas or {}).get("imp")),
-        _kpi_card("📥 Descargas",   kpis["dwn"], (deltas or {}).get("dwn")),
-        _kpi_card("🚀 Lanzamientos",kpis["lnc"], (deltas or {}).get("lnc")),
-        _kpi_card("📈 Conversión (%)", kpis["conv"], (deltas or {}).get("conv")),
-        _kpi_card("🧭 Uso/instalación", kpis["uso"], (deltas or {}).get("uso")),
-    ]
-    story.append(Table([cards], colWidths=[(W-3*cm)/5]*5, hAlign='CENTER', spaceBefore=6, spaceAfter=6))
-    story.append(PageBreak())
-
-    # ----- Gráficos (2 por página) -----
-    if figuras_png:
-        story.append(Paragraph("Gráficos", styles["Heading2"]))
-        for i in range(0, len(figuras_png), 2):
-            row = []
-            for j in range(i, min(i+2, len(figuras_png))):
-                img = _fit_image_bytes(figuras_png[j], max_w=(W-3*cm)/2 - 0.5*cm, max_h=H-6*cm)
-                if img is None:
-                    img = Image(io.BytesIO(figuras_png[j]), width=(W-3*cm)/2 - 0.5*cm, height=(H-6*cm)/2)
-                row.append(img)
-            story.append(Table([row], colWidths=[(W-3*cm)/2 - 0.5*cm]*len(row)))
-            story.append(Spacer(1, 0.3*cm))
-        story.append(PageBreak())
-
-    # ----- Tabla YoY -----
-    if yoy_block:
-        ini_y, fin_y = yoy_block["RangoYoY"]
-        story.append(Paragraph(
-            f"Comparativo YoY (mismo período del año anterior): "
-            f"{fmt_fecha_es(pd.to_datetime(ini_y))} – {fmt_fecha_es(pd.to_datetime(fin_y))}",
-            styles["Heading2"])
-        )
-        filas = [["Métrica", "Actual", "YoY", "Δ%"]]
-        for nombre, actual, yoy, delta in yoy_block["Filas"]:
-            filas.append([nombre, _thousands(actual), _thousands(yoy), _delta_chip(delta)])
-        tbl_yoy = Table(filas, repeatRows=1, colWidths=[6*cm, 3*cm, 3*cm, 3*cm])
-        tbl_yoy.setStyle(TableStyle([
-            ('BACKGROUND',(0,0),(-1,0), colors.Color(0.12,0.12,0.12)),
-            ('TEXTCOLOR',(0,0),(-1,0), colors.white),
-            ('GRID',(0,0),(-1,-1), 0.25, colors.lightgrey),
-            ('ALIGN',(1,1),(-1,-1),'CENTER'),
-            ('FONT',(0,0),(-1,0),'Helvetica-Bold'),
-            ('ROWBACKGROUNDS',(0,1),(-1,-1), [colors.whitesmoke, colors.lightgrey]),
-        ]))
-        story.append(tbl_yoy)
-        story.append(PageBreak())
-
-    # ----- Tabla de datos (primeros 30) -----
-    story.append(Paragraph("Datos agregados (primeros 30 registros)", styles["Heading2"]))
-    head = list(tabla_df.columns)
-    body = tabla_df.head(30).copy()
-    for c in ["Impresiones","Descargas","Lanzamientos"]:
-        if c in body.columns:
-            body[c] = body[c].apply(_thousands)
-    rows = [head] + body.astype(str).values.tolist()
-    tbl = Table(rows, repeatRows=1, colWidths=[(W-3*cm)/len(head)]*len(head))
-    tbl.setStyle(TableStyle([
-        ('BACKGROUND',(0,0),(-1,0), colors.Color(0.12,0.12,0.12)),
-        ('TEXTCOLOR',(0,0),(-1,0), colors.white),
-        ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ('GRID',(0,0),(-1,-1), 0.25, colors.lightgrey),
-        ('FONT',(0,0),(-1,0),'Helvetica-Bold'),
-        ('FONT',(0,1),(-1,-1),'Helvetica'),
-        ('ROWBACKGROUNDS',(0,1),(-1,-1), [colors.whitesmoke, colors.lightgrey]),
-    ]))
-    story.append(tbl)
-
-    doc.build(story, onFirstPage=_header_footer, onLaterPages=_header_footer)
-    return buf.getvalue()
-
-with tab4:
-    st.subheader("Generar Reporte PDF profesional")
-    periodo_pdf = st.selectbox("Periodo de tabla PDF", ["Diario","Semanal","Mensual","Anual"])
-
-    def tabla_por_periodo(df_local, p):
-        mapa = {"Diario":"Día","Semanal":"Semana","Mensual":"Mes","Anual":"Año"}
-        t = agregar(df_local, mapa[p], metricas); t["Etiqueta"]=t["Etiqueta"].astype(str); return t
-
-    tabla_pdf = tabla_por_periodo(df, periodo_pdf)
-
-    # Figuras base (evolución del período actual)
-    if gran in ["Día","Semana"]:
-        fig1 = px.line(agg, x="Etiqueta", y=metricas, markers=True, title=f"Evolución por {gran.lower()}")
-    else:
-        fig1 = px.bar(agg, x="Etiqueta", y=metricas, barmode="group", title=f"Evolución por {gran.lower()}")
-    fig1.update_xaxes(type="category"); fig1.update_layout(xaxis_title="", legend_title="")
-
-    # Gráficos YoY por métrica (si está activo)
-    figs_yoy = []
-    if yoy_block:
-        ini_yoy, fin_yoy = yoy_block["RangoYoY"]
-        df_yoy = df_all[(df_all["Fecha"]>=pd.to_datetime(ini_yoy))&(df_all["Fecha"]<=pd.to_datetime(fin_yoy))]
-        agg_yoy = agregar(df_yoy, gran, metricas)
-        for m in metricas:
-            comb = pd.DataFrame({"Etiqueta": agg["Etiqueta"], "Actual": agg[m]})
-            if len(agg_yoy) == len(agg):
-                comb["YoY"] = agg_yoy[m].values
-            else:
-                comb["YoY"] = np.nan
-            figm = px.bar(comb, x="Etiqueta", y=["Actual","YoY"], barmode="group", title=f"Comparativo YoY • {m}")
-            figm.update_xaxes(type="category"); figm.update_layout(xaxis_title="", legend_title="")
-            figs_yoy.append(figm)
-    else:
-        fig2 = px.bar(agg, x="Etiqueta", y=metricas, barmode="group", title="Comparativa")
-        fig2.update_xaxes(type="category"); fig2.update_layout(xaxis_title="", legend_title="")
-
-    # Exportar figuras a PNG (kaleido)
-    def plot_to_png(fig, w=1100, h=500, scale=2): 
-        return fig.to_image(format="png", width=w, height=h, scale=scale)
-
-    pngs = [plot_to_png(fig1)]
-    if yoy_block:
-        pngs.extend([plot_to_png(f) for f in figs_yoy])  # un gráfico por métrica
-    else:
-        pngs.append(plot_to_png(fig2))
-
-    # Imagen destacada: usamos la MISMA del repo por defecto
-    try:
-        extra_image_bytes = requests.get(LOGO_URL, timeout=10).content
-    except Exception:
-        extra_image_bytes = None
-
-    kpis = {"imp": tot_imp, "dwn": tot_dwn, "lnc": tot_lnc, "conv": conv, "uso": uso}
-    subtitulo = f"Rango: {fmt_fecha_es(df['Fecha'].min())} a {fmt_fecha_es(df['Fecha'].max())} • Granularidad: {gran}"
-
-    # Deltas para colorear tarjetas en PDF
-    deltas_pdf = {"imp": delta_imp, "dwn": delta_dwn, "lnc": delta_lnc, "conv": delta_conv, "uso": delta_uso}
-    deltas_yoy_pdf = None
-    if yoy_block:
-        deltas_yoy_pdf = {
-            "imp": yoy_block["Filas"][0][3],
-            "dwn": yoy_block["Filas"][1][3],
-            "lnc": yoy_block["Filas"][2][3],
-            "conv": yoy_block["Filas"][3][3],
-            "uso": yoy_block["Filas"][4][3],
-        }
-
-    if st.button("🖨️ Generar PDF"):
-        pdf_bytes = build_pdf(
-            LOGO_URL,
-            "📊 Dashboard Evolucion de APP Heaven",
-            subtitulo,
-            kpis,
-            pngs,
-            tabla_pdf,
-            extra_image_bytes=extra_image_bytes,  # imagen del repo
-            yoy_block=yoy_block,
-            resumen_texto=resumen,
-            deltas=deltas_pdf,
-            deltas_yoy=deltas_yoy_pdf
-        )
-        st.download_button("📥 Descargar PDF", data=pdf_bytes,
-                           file_name=f"reporte_{periodo_pdf.lower()}.pdf", mime="application/pdf")
+# Memoria propia de la sesión: lo derivado en este rerun (df_all es una vista compartida)
+propios = [agg, tabla, k] + ([agg_plat] if agg_plat is not None else [])
+mem_sesion = memoria_objetos(*propios)
+ctx = get_script_run_ctx()
+etapas_rerun = RENDIMIENTO.fin_rerun(sesion=ctx.session_id if ctx else None, memoria=mem_sesion,
+                                     filas=k["filas"], gran=gran)
+if ver_rend:
+    res = RENDIMIENTO.resumen()
+    with panel_rend:
+        st.caption(f"Este rerun: **{etapas_rerun['rerun']*1000:,.0f} ms** · "
+                   f"promedio: **{res['reruns']['medio_ms']:,.0f} ms** ({res['reruns']['n']} reruns)")
+        filas_rend = [{"Etapa": n, "Este rerun (ms)": round(etapas_rerun.get(n, 0) * 1000, 1),
+                       "Promedio (ms)": e["medio_ms"], "p95 (ms)": e["p95_ms"], "N": e["n"]}
+                      for n, e in res["etapas"].items()]
+        st.dataframe(pd.DataFrame(filas_rend), hide_index=True, use_container_width=True)
+        if res["fragmentos"]:
+            st.caption("Reruns parciales (un widget de una pestaña vuelve a correr solo esa pestaña):")
+            st.dataframe(pd.DataFrame([{"Pestaña": n, "Promedio (ms)": f["medio_ms"], "p95 (ms)": f["p95_ms"],
+                                        "vs. rerun completo": f"{f['medio_ms'] / res['reruns']['medio_ms']:.0%}"
+                                        if res["reruns"].get("medio_ms") else "–", "N": f["n"]}
+                                       for n, f in res["fragmentos"].items()]),
+                         hide_index=True, use_container_width=True)
+        ratio = res["cache_datasets"]["ratio"]
+        st.caption(f"Caché de datasets: {ratio:.0%} aciertos · {len(res['datasets'])} en memoria "
+                   f"({res['cache_datasets']['mb']:,.1f} / {res['cache_datasets']['max_mb']:,.0f} MB) · "
+                   f"{len(ds.df_all):,} filas" if ratio is not None else "Caché de datasets: sin consultas")
+        ses = res["sesiones"]
+        st.caption(f"Memoria: dataset compartido {ds.memoria() / 2**20:,.1f} MB · esta sesión "
+                   f"{mem_sesion / 2**20:,.2f} MB · {ses['activas']} sesiones activas"
+                   + (f" (media {ses['mb_medio']:,.2f} MB)" if ses["mb_medio"] is not None else ""))
+        with st.expander("Memoria del dataset por columna"):
+            st.dataframe(ds.reporte_memoria(), hide_index=True, use_container_width=True)
@@ -0,0 +1,139 @@
+# batch_report.py
+# Genera reportes PDF / Excel en lote, sin Streamlit, repartiendo las combinaciones
+# (año, mes, granularidad) entre varios procesos.
+#
+#   python batch_report.py --anios 2023 2024 --meses 1-12 --granularidad Día Semana --formatos pdf xlsx
+#   python batch_report.py --app "Otra app" --anios 2024     # app del registro (apps.json)
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import core
+import report
+
+GRANULARIDADES = {"dia": "Día", "día": "Día", "semana": "Semana", "mes": "Mes", "año": "Año", "anio": "Año"}
+PERIODO_POR_GRAN = {"Día": "Diario", "Semana": "Semanal", "Mes": "Mensual", "Año": "Anual"}
+
+# =========================
+# Worker (un dataset por proceso)
+# =========================
+_ds = None
+
+def _iniciar_worker(fuentes, app):
+    global _ds
+    # Un renderer de kaleido (Chromium) por proceso: el paralelismo ya lo dan los procesos,
+    # y el pool por defecto (RASTER_HILOS) multiplicaría los Chromium por --procesos
+    report.RASTERIZADOR = report.Rasterizador(hilos=1)
+    _ds = core.obtener_dataset(fuentes, app)
+
+def _generar(anio, mes, gran, periodo, cmp_yoy, formatos, salida, tabla_completa=False):
+    """Un trabajo: KPIs del rango y escritura de los archivos pedidos. Devuelve (nombre, archivos, segundos)."""
+    t0 = time.perf_counter()
+    ini_r, fin_r = core.rango_inteligente(anio, mes=mes, data_min=_ds.data_min, data_max=_ds.data_max)
+    nombre = f"reporte_{anio}" + (f"_{mes:02d}" if mes else "") + f"_{gran.lower()}"
+    if ini_r > fin_r:
+        return nombre, [], time.perf_counter() - t0
+    k = core.calcular_kpis(_ds, ini_r, fin_r, gran, cmp_yoy)
+    if k["filas"] == 0:
+        return nombre, [], time.perf_counter() - t0
+
+    archivos = []
+    if "pdf" in formatos:
+        p = salida / f"{nombre}.pdf"
+        p.write_bytes(report.generar_reporte_pdf(_ds, k, periodo or PERIODO_POR_GRAN[gran],
+                                                 tabla_completa=tabla_completa))
+        archivos.append(p.name)
+    for ext in ("xlsx", "csv", "parquet"):
+        if ext in formatos:
+            p = salida / f"{nombre}.{ext}"
+            p.write_bytes(report.exportar(_ds.cubo, [periodo or PERIODO_POR_GRAN[gran]], ini_r, fin_r, ext))
+            archivos.append(p.name)
+    return nombre, archivos, time.perf_counter() - t0
+
+# =========================
+# CLI
+# =========================
+def _meses(valores):
+    """'1-12', '3' o 'todos' → lista de meses (None = año completo)."""
+    meses = []
+    for v in valores:
+        if v.lower() == "todos":
+            meses.append(None)
+        elif "-" in v:
+            a, b = map(int, v.split("-", 1))
+            meses.extend(range(a, b + 1))
+        else:
+            meses.append(int(v))
+    for m in meses:
+        if m is not None and not 1 <= m <= 12:
+            raise argparse.ArgumentTypeError(f"Mes fuera de rango: {m}")
+    return meses
+
+def _granularidad(v):
+    g = GRANULARIDADES.get(v.lower())
+    if g is None:
+        raise argparse.ArgumentTypeError(f"Granularidad desconocida: {v} (Día, Semana, Mes, Año)")
+    return g
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Reportes PDF / Excel en lote del Dashboard Heaven.")
+    ap.add_argument("--datos", type=Path, default=core.BASE_DIR, help="Carpeta con los tres CSV del repositorio")
+    ap.add_argument("--app", help="App del registro (apps.json / HEAVEN_APPS) en vez de --datos")
+    ap.add_argument("--anios", type=int, nargs="+", help="Años a reportar (por defecto, todos los disponibles)")
+    ap.add_argument("--meses", nargs="+", default=["todos"], help="Meses: '1-12', '3 6 9' o 'todos' (año completo)")
+    ap.add_argument("--granularidad", type=_granularidad, nargs="+", default=["Mes"])
+    ap.add_argument("--periodo-tabla", choices=list(PERIODO_POR_GRAN.values()),
+                    help="Periodo de la tabla (por defecto, el de la granularidad)")
+    ap.add_argument("--yoy", action="store_true", help="Incluir comparación YoY")
+    ap.add_argument("--tabla-completa", action="store_true",
+                    help=f"PDF con todas las filas de la tabla, paginadas (por defecto, las primeras {report.PDF_FILAS_TABLA})")
+    ap.add_argument("--formatos", nargs="+", choices=["pdf", "xlsx", "csv", "parquet"], default=["pdf"])
+    ap.add_argument("--salida", type=Path, default=Path("reportes"))
+    ap.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args(argv)
+
+    try:
+        meses = _meses(args.meses)
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        ap.error(str(e))
+    try:
+        if args.app:
+            apps = core.registro_apps()
+            if args.app not in apps:
+                ap.error(f"App desconocida: {args.app} (registradas: {', '.join(apps)})")
+            fuentes = apps[args.app]
+        else:
+            fuentes = {m: str(args.datos / f) for m, f in core.FUENTES_REPO.items()}
+        ds = core.obtener_dataset(fuentes, args.app)
+    except (core.DatosInvalidos, FileNotFoundError) as e:
+        print(f"Error leyendo datos: {e}", file=sys.stderr)
+        return 2
+    anios = args.anios or ds.filtros.anios
+    args.salida.mkdir(parents=True, exist_ok=True)
+
+    trabajos = list(product(anios, meses, args.granularidad))
+    print(f"{len(trabajos)} trabajos en {args.procesos} procesos → {args.salida}")
+    t0 = time.perf_counter()
+    errores = 0
+    with ProcessPoolExecutor(max_workers=args.procesos, initializer=_iniciar_worker, initargs=(fuentes, args.app)) as pool:
+        futuros = {pool.submit(_generar, a, m, g, args.periodo_tabla, args.yoy, args.formatos, args.salida,
+                               args.tabla_completa): (a, m, g)
+                   for a, m, g in trabajos}
+        for n, fut in enumerate(as_completed(futuros), 1):
+            try:
+                nombre, archivos, seg = fut.result()
+            except Exception as e:
+                errores += 1
+                print(f"[{n}/{len(trabajos)}] {futuros[fut]} ERROR: {e}", file=sys.stderr)
+                continue
+            estado = ", ".join(archivos) if archivos else "sin datos"
+            print(f"[{n}/{len(trabajos)}] {nombre}: {estado} ({seg:.2f}s)")
+    print(f"Listo en {time.perf_counter() - t0:.1f}s ({errores} errores)")
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
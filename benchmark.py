@@ -0,0 +1,256 @@
+# benchmark.py
+# Benchmark reproducible del pipeline con datos sintéticos a escala de producción.
+#
+#   python benchmark.py --anios 10 --salida bench.json
+#   python benchmark.py --anios 10 --salida bench_nuevo.json --comparar bench.json
+#   python benchmark.py --anios 30 --etapas build_pdf_completo   # PDF con la tabla diaria completa (10k+ filas)
+#
+# Genera N años de datos diarios (total + 8 plataformas) para las tres métricas, mide cada
+# etapa (tiempo de varias repeticiones y pico de memoria con tracemalloc), reporta la memoria
+# del dataset por componente y columna, y escribe un JSON para comparar corrida contra corrida.
+# La etapa build_pdf_completo reporta además filas, páginas y tamaño del PDF con la tabla completa.
+import os
+import re
+import sys
+import json
+import time
+import platform
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from pathlib import Path
+from statistics import median
+
+import numpy as np
+import pandas as pd
+
+PLATAFORMAS = ["ios","android","apple_tv","roku","fire_tv","google_tv","car_play","android_auto"]
+# Participación aproximada por plataforma y volumen diario base por métrica
+PARTICIPACION = np.array([0.38, 0.42, 0.05, 0.05, 0.04, 0.03, 0.02, 0.01])
+VOLUMEN_BASE = {"Impresiones": 40_000, "Descargas": 1_600, "Lanzamientos": 16_000}
+
+# =========================
+# Generador sintético
+# =========================
+def generar_serie(fechas, volumen, rng):
+    """Conteos diarios por plataforma: tendencia + estacionalidad semanal/anual + ruido."""
+    t = np.arange(len(fechas))
+    tendencia = 1 + 0.3 * np.sin(t / 365.25 * 2 * np.pi) + t / max(len(t), 1) * 0.5
+    semanal = 1 + 0.15 * np.isin(fechas.dayofweek, [5, 6])
+    base = volumen * tendencia * semanal
+    part = PARTICIPACION * rng.uniform(0.8, 1.2, size=(len(fechas), len(PLATAFORMAS)))
+    part /= part.sum(axis=1, keepdims=True)
+    return rng.poisson(base[:, None] * part).astype(np.int64)
+
+def generar_datos(carpeta, anios, inicio="2015-01-01", semilla=0):
+    """Escribe los tres CSV (date,total,plataformas...) con los nombres del repositorio."""
+    from core import FUENTES_REPO
+    carpeta = Path(carpeta); carpeta.mkdir(parents=True, exist_ok=True)
+    fechas = pd.date_range(inicio, periods=int(round(anios * 365.25)), freq="D")
+    rng = np.random.default_rng(semilla)
+    for metrica, archivo in FUENTES_REPO.items():
+        valores = generar_serie(fechas, VOLUMEN_BASE[metrica], rng)
+        df = pd.DataFrame(valores, columns=PLATAFORMAS)
+        df.insert(0, "total", valores.sum(axis=1))
+        df.insert(0, "date", fechas.strftime("%Y-%m-%d"))
+        df.to_csv(carpeta / archivo, index=False)
+    return {m: str(carpeta / f) for m, f in FUENTES_REPO.items()}
+
+# =========================
+# Medición
+# =========================
+def medir(fn, repeticiones):
+    """Tiempos de `repeticiones` llamadas y pico de memoria (MB) de una llamada extra con tracemalloc."""
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter(); fn(); tiempos.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        fn()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"segundos": tiempos, "min": min(tiempos), "mediana": median(tiempos), "pico_mb": pico / 2**20}
+
+def paginas_pdf(pdf: bytes) -> int:
+    return len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", pdf))
+
+def etapas_pipeline(fuentes, tmp):
+    """(nombre, función) de cada etapa, en el orden en que corre la app; `pdf_tabla` se completa
+    al correr build_pdf_completo. `tmp`: carpeta descartable para las etapas que escriben."""
+    import core
+    import report
+
+    ds = core.construir_dataset(fuentes)
+    fin = ds.data_max
+    ini = max(ds.data_min, (pd.Timestamp(fin) - pd.DateOffset(years=1)).date())
+    rng = np.random.default_rng(1)
+    n_fechas = len(ds.idx.fechas)
+    rangos = [sorted(rng.integers(0, n_fechas, size=2)) for _ in range(1000)]
+    rangos = [(ds.idx.fechas[a], ds.idx.fechas[b]) for a, b in rangos]
+    agg_dia = ds.cubo.rango("Día", ds.data_min, fin)
+    fig_dia = report.figura_evolucion(agg_dia, "Día")
+    fig_mes = report.figura_evolucion(ds.cubo.rango("Mes", ini, fin), "Mes")
+    ds.plataformas
+    memoria = ds.reporte_memoria()
+    tabla_dia = core.tabla_por_periodo(ds.cubo, "Diario", ds.data_min, fin)
+    ctx_dia = report.contexto_reporte(core.calcular_kpis(ds, ds.data_min, fin, "Mes", True))
+    pdf_tabla = {}
+
+    def ingesta_csv():
+        for m, f in fuentes.items():
+            core.cargar_metricas(f, m)
+
+    def ingesta_snapshot():
+        for m, f in fuentes.items():
+            core.cargar_metricas_snapshot(f, m)
+
+    def plataformas():
+        ds._plataformas = None
+        for m in ds.plataformas.metricas:
+            ds.plataformas.rango(m, "Semana", ini, fin)
+            ds.plataformas.ultimo(m, "Semana", ini, fin)
+
+    def build_pdf_completo():
+        # Solo la maquetación: sin gráficos, toda la tabla diaria paginada
+        pdf = report.build_pdf(report.LOGO_URL, report.TITULO, ctx_dia["subtitulo"], ctx_dia["kpis"], [], tabla_dia,
+                               yoy_block=ctx_dia["yoy_block"], deltas=ctx_dia["deltas"], filas_tabla=None)
+        pdf_tabla.update(filas=len(tabla_dia), paginas=paginas_pdf(pdf), mb=round(len(pdf) / 2**20, 3))
+
+    # Refresco diario: cada llamada agrega un día a copias de los tres CSV (en `tmp`, nunca
+    # los de --datos) y vuelve a pedir el dataset
+    copias = Path(tmp) / "incremental"; copias.mkdir(exist_ok=True)
+    fuentes_inc = {m: shutil.copy(f, copias / Path(f).name) for m, f in fuentes.items()}
+    siguiente = [pd.Timestamp(fin) + pd.Timedelta(days=1)]
+    core.obtener_dataset(fuentes_inc)
+    def ingesta_incremental():
+        fecha = pd.DatetimeIndex(siguiente)
+        for m, f in fuentes_inc.items():
+            valores = generar_serie(fecha, VOLUMEN_BASE[m], rng)[0]
+            with open(f, "a", encoding="utf-8") as fh:
+                fh.write(",".join([fecha[0].strftime("%Y-%m-%d"), str(valores.sum())] + [str(v) for v in valores]) + "\n")
+        siguiente[0] += pd.Timedelta(days=1)
+        core.obtener_dataset(fuentes_inc)
+
+    return [
+        ("ingesta_csv", ingesta_csv),
+        ("ingesta_snapshot", ingesta_snapshot),
+        ("dataset", lambda: core.construir_dataset(fuentes)),
+        ("agregar", lambda: [core.agregar(ds.df_all, n, core.METRICAS) for n in core.NIVELES]),
+        ("cubo_rango", lambda: [ds.cubo.rango(n, ini, fin) for n in core.NIVELES]),
+        ("sumar_rango_x1000", lambda: [core.sumar_rango(ds.idx, a, b) for a, b in rangos]),
+        ("kpis", lambda: core.calcular_kpis(ds, ini, fin, "Mes", cmp_yoy=True)),
+        ("comparativo", lambda: [core.comparativo(ds, n, ini, fin) for n in core.NIVELES]),
+        ("plataformas", plataformas),
+        ("plotly_json", lambda: fig_dia.to_json()),
+        ("plot_to_png", lambda: report.RASTERIZADOR._render(fig_mes, 1100, 500, 2)),
+        ("plot_to_png_cache", lambda: report.plot_to_png(fig_mes)),
+        ("build_pdf", lambda: report.generar_reporte_pdf(ds, core.calcular_kpis(ds, ini, fin, "Mes", True), "Mensual")),
+        ("build_pdf_completo", build_pdf_completo),
+        ("ingesta_incremental", ingesta_incremental),
+    ], len(ds.df_all), memoria, pdf_tabla
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def resumen_memoria(rep):
+    """{"total_mb", "componentes": {componente: MB}, "columnas": filas del reporte} para el JSON."""
+    comp = rep.groupby("Componente", sort=False)["MB"].sum().round(3)
+    return {"total_mb": round(float(rep["MB"].sum()), 3), "componentes": comp.to_dict(),
+            "columnas": rep.to_dict("records")}
+
+def comparar(actual, previo, umbral):
+    """Imprime la variación por etapa; devuelve las etapas más lentas que `umbral` × la corrida previa."""
+    lentas = []
+    print(f"\n{'etapa':<20}{'previo (s)':>12}{'actual (s)':>12}{'ratio':>8}")
+    for nombre, r in actual["etapas"].items():
+        p = previo.get("etapas", {}).get(nombre)
+        if p is None:
+            print(f"{nombre:<20}{'–':>12}{r['mediana']:>12.4f}{'–':>8}"); continue
+        ratio = r["mediana"] / p["mediana"] if p["mediana"] > 0 else float("inf")
+        marca = "  ⚠" if ratio > umbral else ""
+        print(f"{nombre:<20}{p['mediana']:>12.4f}{r['mediana']:>12.4f}{ratio:>8.2f}{marca}")
+        if ratio > umbral:
+            lentas.append(nombre)
+    mem, mem_previo = actual.get("memoria"), previo.get("memoria")
+    if mem and mem_previo:
+        print(f"{'memoria (MB)':<20}{mem_previo['total_mb']:>12.2f}{mem['total_mb']:>12.2f}"
+              f"{mem['total_mb'] / mem_previo['total_mb']:>8.2f}")
+    return lentas
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark del pipeline con datos sintéticos.")
+    ap.add_argument("--anios", type=float, default=10, help="Años de datos diarios a generar")
+    ap.add_argument("--inicio", default="2015-01-01")
+    ap.add_argument("--semilla", type=int, default=0)
+    ap.add_argument("--repeticiones", type=int, default=3)
+    ap.add_argument("--etapas", nargs="+", help="Solo estas etapas (por defecto, todas)")
+    ap.add_argument("--datos", type=Path, help="Carpeta donde generar/reusar los CSV (por defecto, temporal)")
+    ap.add_argument("--salida", type=Path, default=Path("benchmark.json"))
+    ap.add_argument("--comparar", type=Path, help="Resultados previos contra los cuales comparar")
+    ap.add_argument("--umbral", type=float, default=1.2, help="Ratio a partir del cual una etapa cuenta como regresión")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="heaven-bench-") as tmp:
+        # Snapshots y assets en una caché aislada, para no mezclar con la de la app
+        os.environ["HEAVEN_CACHE_DIR"] = str(Path(tmp) / "cache")
+        t0 = time.perf_counter()
+        fuentes = generar_datos(args.datos or Path(tmp) / "datos", args.anios, args.inicio, args.semilla)
+        print(f"Datos generados en {time.perf_counter() - t0:.1f}s")
+
+        etapas, filas, memoria, pdf_tabla = etapas_pipeline(fuentes, tmp)
+        memoria = resumen_memoria(memoria)
+        print(f"Dataset en memoria: {memoria['total_mb']:.2f} MB ("
+              + ", ".join(f"{c} {mb:.2f}" for c, mb in memoria["componentes"].items()) + ")")
+        if args.etapas:
+            desconocidas = set(args.etapas) - {n for n, _ in etapas}
+            if desconocidas:
+                ap.error(f"Etapas desconocidas: {sorted(desconocidas)}")
+            etapas = [(n, f) for n, f in etapas if n in args.etapas]
+
+        resultados = {}
+        for nombre, fn in etapas:
+            r = medir(fn, args.repeticiones)
+            resultados[nombre] = r
+            print(f"{nombre:<20}{r['mediana']:>10.4f}s (min {r['min']:.4f}s)  pico {r['pico_mb']:>8.1f} MB")
+        if pdf_tabla:
+            pdf_tabla["segundos_por_pagina"] = round(resultados["build_pdf_completo"]["mediana"] / pdf_tabla["paginas"], 4)
+            print(f"PDF tabla completa: {pdf_tabla['filas']:,} filas → {pdf_tabla['paginas']} páginas, "
+                  f"{pdf_tabla['mb']:.2f} MB ({pdf_tabla['segundos_por_pagina'] * 1000:.0f} ms/página)")
+
+    actual = {
+        "version": 1,
+        "fecha": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "entorno": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                    "plataforma": platform.platform()},
+        "parametros": {"anios": args.anios, "inicio": args.inicio, "semilla": args.semilla,
+                       "repeticiones": args.repeticiones, "filas": filas},
+        "etapas": resultados,
+        "memoria": memoria,
+        "pdf_tabla": pdf_tabla or None,
+    }
+    args.salida.write_text(json.dumps(actual, indent=2, ensure_ascii=False))
+    print(f"Resultados → {args.salida}")
+
+    if args.comparar:
+        previo = json.loads(args.comparar.read_text())
+        if previo.get("parametros", {}).get("filas") != filas:
+            print("Aviso: la corrida previa usó otra escala de datos.", file=sys.stderr)
+        lentas = comparar(actual, previo, args.umbral)
+        if lentas:
+            print(f"Regresiones (> {args.umbral:.2f}×): {', '.join(lentas)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
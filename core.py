@@ -0,0 +1,1442 @@
+# core.py
+# Núcleo de cálculo del dashboard: ingesta, dataset normalizado, cubos de agregación y KPIs.
+# No depende de Streamlit, así que se puede usar desde app.py, la CLI de reportes o scripts.
+import io
+import os
+import csv
+import json
+import time
+import hashlib
+import logging
+import shutil
+import threading
+from collections import OrderedDict, deque
+from datetime import date, timedelta
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# =========================
+# Configuración general
+# =========================
+# Caché local en disco (assets, snapshots de datos)
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_DIR = Path(os.environ.get("HEAVEN_CACHE_DIR", BASE_DIR / ".cache"))
+
+METRICAS = ["Impresiones","Descargas","Lanzamientos"]
+FUENTES_REPO = {"Impresiones": "impressions-year.csv",
+                "Descargas": "app-downloads-year.csv",
+                "Lanzamientos": "app-launches-year.csv"}
+
+MESES_LARGO = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+MESES_ABR   = ["ene","feb","mar","abr","may","jun","jul","ago","sep","oct","nov","dic"]
+
+def fmt_fecha_es(ts, abr=True):
+    if pd.isna(ts): return ""
+    d = int(ts.day); m = int(ts.month); y = int(ts.year)
+    mes = (MESES_ABR if abr else MESES_LARGO)[m-1]
+    return f"{d:02d} {mes.capitalize()} {y}"
+
+class DatosInvalidos(ValueError):
+    """El CSV no tiene el formato esperado (columnas `date` y `total`)."""
+
+# =========================
+# Rendimiento (tiempos por etapa y contadores)
+# =========================
+# Cada etapa del pipeline (ingesta, merge, cubos, agregación, Plotly, kaleido, PDF) se mide
+# con RENDIMIENTO.etapa(...). Los tiempos quedan en memoria para el panel de la app, se
+# escriben como líneas JSON en el log de rendimiento y, al final de cada rerun, el resumen
+# se vuelca a RENDIMIENTO_ESTADO para que healthcheck.py lo lea desde otro proceso. Cada
+# proceso del servidor escribe su propio archivo (rendimiento-<pid>.json) y el healthcheck
+# agrega los de los procesos vivos.
+# También se guarda la memoria propia de cada sesión (lo que no comparte con el dataset).
+RENDIMIENTO_LOG = os.environ.get("HEAVEN_LOG_RENDIMIENTO", str(CACHE_DIR / "rendimiento.jsonl"))  # "" = sin log
+RENDIMIENTO_ESTADO = CACHE_DIR / "rendimiento-{pid}.json"
+RENDIMIENTO_HISTORIAL = 200
+SESIONES_ACTIVAS_S = 600   # una sesión cuenta como activa si tuvo un rerun en este lapso
+
+_log_rendimiento = logging.getLogger("heaven.rendimiento")
+_log_rendimiento.propagate = False
+
+def log_rendimiento(evento: str, **campos):
+    if not _log_rendimiento.handlers:
+        if not RENDIMIENTO_LOG:
+            _log_rendimiento.addHandler(logging.NullHandler())
+        else:
+            try:
+                Path(RENDIMIENTO_LOG).parent.mkdir(parents=True, exist_ok=True)
+                _log_rendimiento.addHandler(RotatingFileHandler(RENDIMIENTO_LOG, maxBytes=5 * 2**20, backupCount=3))
+            except OSError:
+                _log_rendimiento.addHandler(logging.NullHandler())
+            _log_rendimiento.setLevel(logging.INFO)
+    _log_rendimiento.info(json.dumps({"ts": round(time.time(), 3), "pid": os.getpid(), "evento": evento, **campos},
+                                     ensure_ascii=False, default=str))
+
+def _ms(valores):
+    v = np.asarray(valores, dtype=np.float64) * 1000
+    return {"n": int(v.size), "ultimo_ms": round(float(v[-1]), 2), "medio_ms": round(float(v.mean()), 2),
+            "p95_ms": round(float(np.percentile(v, 95)), 2)} if v.size else {"n": 0}
+
+class Rendimiento:
+    def __init__(self, historial=RENDIMIENTO_HISTORIAL):
+        self.historial = historial
+        self.etapas = {}                          # etapa -> últimos tiempos (s)
+        self.reruns = deque(maxlen=historial)     # duración total de cada rerun (s)
+        self.fragmentos = {}                      # fragmento -> duración de sus reruns parciales (s)
+        self.sesiones = OrderedDict()             # sesión -> (último rerun, bytes propios)
+        self.lock = threading.Lock()
+        self._local = threading.local()           # rerun en curso (cada sesión corre en su hilo)
+
+    @contextmanager
+    def etapa(self, nombre, **extra):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(nombre, time.perf_counter() - t0, **extra)
+
+    def registrar(self, nombre, segundos, **extra):
+        with self.lock:
+            self.etapas.setdefault(nombre, deque(maxlen=self.historial)).append(segundos)
+        actual = getattr(self._local, "rerun", None)
+        if actual is not None:
+            actual[nombre] = actual.get(nombre, 0.0) + segundos
+        log_rendimiento("etapa", etapa=nombre, ms=round(segundos * 1000, 3), **extra)
+
+    def inicio_rerun(self):
+        self._local.rerun = {}
+        self._local.t0 = time.perf_counter()
+
+    def fin_rerun(self, sesion=None, memoria=None, fragmento=None, **extra) -> Dict[str, float]:
+        """Cierra el rerun en curso; devuelve sus etapas (s) con el total en "rerun".
+        `memoria`: bytes propios de la sesión (frames derivados, sin el dataset compartido).
+        `fragmento`: el rerun fue parcial (solo ese fragmento de la página); se promedia aparte."""
+        etapas = getattr(self._local, "rerun", None)
+        if etapas is None:
+            return {}
+        total = time.perf_counter() - self._local.t0
+        self._local.rerun = None
+        with self.lock:
+            if fragmento is None:
+                self.reruns.append(total)
+            else:
+                self.fragmentos.setdefault(fragmento, deque(maxlen=self.historial)).append(total)
+            if sesion is not None and memoria is not None:
+                self.sesiones[sesion] = (time.time(), memoria)
+                self.sesiones.move_to_end(sesion)
+                while len(self.sesiones) > self.historial:
+                    self.sesiones.popitem(last=False)
+        if memoria is not None:
+            extra["memoria_sesion_mb"] = round(memoria / 2**20, 3)
+        if fragmento is not None:
+            extra["fragmento"] = fragmento
+        log_rendimiento("rerun", ms=round(total * 1000, 3),
+                        etapas={k: round(v * 1000, 3) for k, v in etapas.items()}, **extra)
+        self.guardar_estado()
+        return {**etapas, "rerun": total}
+
+    def resumen(self) -> Dict:
+        with self.lock:
+            etapas = {k: _ms(v) for k, v in self.etapas.items()}
+            reruns = _ms(self.reruns)
+            fragmentos = {k: _ms(v) for k, v in self.fragmentos.items()}
+            limite = time.time() - SESIONES_ACTIVAS_S
+            mem = np.array([b for t, b in self.sesiones.values() if t >= limite], dtype=np.float64) / 2**20
+        with CACHE_DATASETS.lock:
+            datasets = [{"huella": k, "app": CACHE_DATASETS.nombres.get(k), "filas": len(ds.df_all),
+                         "mb": round(ds.memoria() / 2**20, 2)} for k, ds in CACHE_DATASETS.datos.items()]
+        consultas = CACHE_DATASETS.aciertos + CACHE_DATASETS.fallos
+        return {
+            "pid": os.getpid(), "actualizado": round(time.time(), 3),
+            "reruns": reruns, "fragmentos": fragmentos, "etapas": etapas,
+            "cache_datasets": {"aciertos": CACHE_DATASETS.aciertos, "fallos": CACHE_DATASETS.fallos,
+                               "ratio": round(CACHE_DATASETS.aciertos / consultas, 4) if consultas else None,
+                               "descartes": CACHE_DATASETS.descartes,
+                               "mb": round(CACHE_DATASETS.bytes_total() / 2**20, 2),
+                               "max_mb": round(CACHE_DATASETS.max_bytes / 2**20, 2)},
+            "datasets": datasets,
+            "sesiones": {"activas": int(mem.size), "mb_medio": round(float(mem.mean()), 3) if mem.size else None,
+                         "mb_max": round(float(mem.max()), 3) if mem.size else None},
+        }
+
+    def guardar_estado(self):
+        # El pid se resuelve al escribir: los procesos hijos (fork) no pisan el archivo del padre
+        destino = RENDIMIENTO_ESTADO.with_name(RENDIMIENTO_ESTADO.name.format(pid=os.getpid()))
+        tmp = destino.with_name(f"{destino.name}.tmp")
+        try:
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(self.resumen()))
+            os.replace(tmp, destino)
+        except OSError:
+            pass
+
+RENDIMIENTO = Rendimiento()
+
+# =========================
+# Carga y normalización
+# =========================
+# Ingesta: el separador y el encabezado se detectan con una muestra del inicio del archivo
+# y el parseo lo hace el motor C de pandas con tipos explícitos (fecha y conteos enteros).
+# Los archivos muy grandes se leen por bloques, normalizando y agregando por fecha sin
+# cargarlos completos en memoria.
+INGESTA_MUESTRA = 64 * 1024                # bytes
+INGESTA_BLOQUES_BYTES = 256 * 1024 * 1024  # a partir de este tamaño se ingiere por bloques
+INGESTA_FILAS_BLOQUE = 500_000
+
+def detectar_formato(path_or_buffer):
+    """(separador, columnas) a partir de una muestra del inicio del archivo."""
+    if hasattr(path_or_buffer, "read"):
+        path_or_buffer.seek(0); data = path_or_buffer.read(INGESTA_MUESTRA); path_or_buffer.seek(0)
+    else:
+        with open(path_or_buffer, "rb") as fh:
+            data = fh.read(INGESTA_MUESTRA)
+    texto = data.decode("utf-8-sig", errors="replace") if isinstance(data, bytes) else data
+    lineas = texto.splitlines()
+    if len(lineas) > 1 and len(data) == INGESTA_MUESTRA:
+        lineas = lineas[:-1]   # la última línea de la muestra puede venir cortada
+    if not lineas:
+        return ",", []
+    try:
+        sep = csv.Sniffer().sniff("\n".join(lineas[:50]), delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
+    return sep, next(csv.reader([lineas[0]], delimiter=sep))
+
+def _tipos_columnas(columnas):
+    fecha = next((c for c in columnas if c.lower() == "date"), None)
+    return fecha, {c: "int64" for c in columnas if c != fecha}
+
+def leer_csv(path):
+    sep, columnas = detectar_formato(path)
+    fecha, dtypes = _tipos_columnas(columnas)
+    try:
+        with np.errstate(invalid="ignore"):
+            return pd.read_csv(path, sep=sep, engine="c", dtype=dtypes,
+                               parse_dates=[fecha] if fecha else False)
+    except (ValueError, TypeError):
+        # Conteos con decimales o valores vacíos: se deja inferir y se normaliza después
+        if hasattr(path, "seek"): path.seek(0)
+        return pd.read_csv(path, sep=sep, engine="c")
+
+def _validar_columnas(columnas):
+    cols_lower = {c.lower(): c for c in columnas}
+    if "date" not in cols_lower or "total" not in cols_lower:
+        raise DatosInvalidos(f"El archivo debe tener columnas 'date' y 'total'. Trae: {list(columnas)}")
+    return cols_lower
+
+def normalizar_metricas(raw, nombre_metrica):
+    cols_lower = _validar_columnas(raw.columns)
+    df = raw.rename(columns={cols_lower["date"]: "Fecha", cols_lower["total"]: nombre_metrica}).copy()
+    df["Fecha"] = pd.to_datetime(df["Fecha"], errors="coerce")
+    df = df.dropna(subset=["Fecha"])
+    df[nombre_metrica] = pd.to_numeric(df[nombre_metrica], errors="coerce").fillna(0)
+
+    # Solo hechos (fecha, valor): los atributos de calendario se unen después por fecha
+    df_total = df[["Fecha", nombre_metrica]]
+
+    # Plataformas opcionales
+    plat_cols = [c for c in raw.columns if c not in [cols_lower["date"], cols_lower["total"]]]
+    df_plat = None
+    if plat_cols:
+        dfp = raw[[cols_lower["date"]] + plat_cols].copy()
+        dfp["Fecha"] = pd.to_datetime(dfp[cols_lower["date"]], errors="coerce")
+        dfp = dfp.dropna(subset=["Fecha"]).drop(columns=[cols_lower["date"]])
+        def pretty(c):
+            m = {"ios":"iOS","android":"Android","apple_tv":"Apple TV","roku":"Roku","fire_tv":"Fire TV",
+                 "google_tv":"Google TV","car_play":"CarPlay","android_auto":"Android Auto"}
+            key = c.strip().lower()
+            return m.get(key, c.replace("_"," ").title())
+        dfp = dfp.rename(columns={c: pretty(c) for c in plat_cols})
+        for c in dfp.columns:
+            if c != "Fecha":
+                dfp[c] = pd.to_numeric(dfp[c], errors="coerce").fillna(0)
+        df_plat = dfp
+
+    return df_total, df_plat
+
+def combinar_metricas(df_total, df_plat):
+    """Un solo frame (Fecha, total, plataformas...) y la lista de plataformas."""
+    if df_plat is None:
+        return df_total, []
+    plats = [c for c in df_plat.columns if c != "Fecha"]
+    return pd.concat([df_total, df_plat[plats]], axis=1), plats
+
+def separar_metricas(comb, nombre_metrica, plats):
+    df_total = comb[["Fecha", nombre_metrica]]
+    df_plat = comb[plats + ["Fecha"]] if plats else None
+    return df_total, df_plat
+
+# Conteos compactos: cada columna se guarda con el entero más chico que contiene sus valores
+# (sin signo si no hay negativos) y se suma en int64, para que los agregados no desborden.
+def tipo_compacto(valores) -> np.dtype:
+    """Menor tipo entero para los valores; el tipo que traen si no son enteros (decimales, NaN)."""
+    v = np.asarray(valores)
+    if v.size == 0 or not (np.issubdtype(v.dtype, np.integer) or np.issubdtype(v.dtype, np.floating)):
+        return v.dtype
+    if np.issubdtype(v.dtype, np.floating) and not (np.isfinite(v).all() and (v == np.trunc(v)).all()):
+        return v.dtype
+    tipo = np.promote_types(np.min_scalar_type(int(v.min())), np.min_scalar_type(int(v.max())))
+    return tipo if np.issubdtype(tipo, np.integer) else v.dtype
+
+def tipo_suma(dtype) -> np.dtype:
+    return np.dtype(np.int64) if np.issubdtype(dtype, np.integer) else np.dtype(np.float64)
+
+def enteros_salida(df):
+    """df con sus enteros numpy (claves de calendario int8/int16, conteos compactos) en int64:
+    los tipos compactos son de memoria y no deben llegar a archivos ni a cuentas del usuario."""
+    return df.astype({c: np.int64 for c, t in df.dtypes.items() if isinstance(t, np.dtype) and np.issubdtype(t, np.integer)})
+
+def compactar(df):
+    """df con cada conteo en su tipo_compacto (None pasa de largo)."""
+    if df is None:
+        return None
+    return df.astype({c: tipo_compacto(df[c].to_numpy()) for c in df.columns if c != "Fecha"})
+
+def leer_csv_por_bloques(path_or_buffer, nombre_metrica, filas=INGESTA_FILAS_BLOQUE):
+    """Ingesta en streaming: cada bloque se normaliza y se agrega por fecha; la memoria
+    queda acotada por el número de fechas distintas y no por el de filas."""
+    sep, columnas = detectar_formato(path_or_buffer)
+    _validar_columnas(columnas)
+    fecha, _ = _tipos_columnas(columnas)
+    partes, plats = [], []
+    for bloque in pd.read_csv(path_or_buffer, sep=sep, engine="c", chunksize=filas, parse_dates=[fecha]):
+        comb, plats = combinar_metricas(*normalizar_metricas(bloque, nombre_metrica))
+        partes.append(comb.groupby("Fecha", sort=False).sum())
+    if not partes:
+        return normalizar_metricas(pd.DataFrame(columns=columnas), nombre_metrica)
+    comb = pd.concat(partes).groupby(level=0).sum().reset_index()
+    return separar_metricas(comb, nombre_metrica, plats)
+
+def cargar_metricas(path_or_buffer, nombre_metrica):
+    tam = getattr(path_or_buffer, "size", None) if hasattr(path_or_buffer, "read") else os.path.getsize(path_or_buffer)
+    if tam is not None and tam >= INGESTA_BLOQUES_BYTES:
+        df_total, df_plat = leer_csv_por_bloques(path_or_buffer, nombre_metrica)
+    else:
+        df_total, df_plat = normalizar_metricas(leer_csv(path_or_buffer), nombre_metrica)
+    return compactar(df_total), compactar(df_plat)
+
+# =========================
+# Snapshot columnar (arranque en frío)
+# =========================
+# Tras la primera ingesta de un CSV del repositorio, sus columnas normalizadas se guardan
+# como .npy (una por columna) y se abren con mmap mientras el archivo fuente no cambie
+# (ruta, mtime y tamaño): un worker nuevo mapea los datos sin parsear el CSV. Además se
+# guarda el dataset ya combinado (df_all, calendario y frames por plataforma) para el trío
+# de fuentes: el Dataset se arma directamente sobre las columnas mapeadas, sin merge, y los
+# procesos comparten esas páginas del sistema operativo. Las categóricas se guardan como
+# códigos (mapeados) y sus categorías van en el manifest; los índices derivados (cubos,
+# sumas acumuladas) siguen siendo propios de cada proceso.
+SNAPSHOT_VERSION = 2   # 2: conteos compactos
+
+def _carpeta_snapshot(path, stt=None):
+    stt = stt or os.stat(path)
+    clave = f"{Path(path).resolve()}|{stt.st_mtime_ns}|{stt.st_size}|v{SNAPSHOT_VERSION}"
+    return CACHE_DIR / "snapshots" / hashlib.blake2b(clave.encode("utf-8"), digest_size=12).hexdigest()
+
+def leer_manifest(carpeta) -> Optional[Dict]:
+    try:
+        return json.loads((carpeta / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+def guardar_snapshot(carpeta, columnas, meta):
+    """columnas: {nombre: Series} (o un DataFrame); pueden tener largos distintos."""
+    # Carpeta temporal por hilo: las sesiones de un mismo proceso pueden guardar a la vez
+    tmp = carpeta.with_name(f"{carpeta.name}.tmp{os.getpid()}-{threading.get_ident()}")
+    try:
+        tmp.mkdir(parents=True, exist_ok=True)
+        categorias = {}
+        for i, (c, serie) in enumerate(columnas.items()):
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                categorias[c] = serie.cat.categories.tolist()
+                serie = serie.cat.codes
+            np.save(tmp / f"c{i}.npy", serie.to_numpy(), allow_pickle=False)
+        (tmp / "manifest.json").write_text(json.dumps({**meta, "columnas": list(columnas.keys()),
+                                                       "categorias": categorias}))
+        os.replace(tmp, carpeta)
+    except (OSError, ValueError):
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    # Snapshots anteriores del mismo archivo fuente quedaron obsoletos
+    for otra in carpeta.parent.iterdir():
+        m = leer_manifest(otra) if otra != carpeta else None
+        if m and m.get("fuente") == meta.get("fuente"):
+            shutil.rmtree(otra, ignore_errors=True)
+
+def abrir_snapshot(carpeta):
+    """(columnas mapeadas en memoria, manifest) o (None, None) si no hay snapshot válido."""
+    meta = leer_manifest(carpeta)
+    if meta is None:
+        return None, None
+    try:
+        # np.asarray: vista ndarray del mapeo (sin copiar), no la subclase memmap
+        cols = {c: np.asarray(np.load(carpeta / f"c{i}.npy", mmap_mode="r", allow_pickle=False))
+                for i, c in enumerate(meta["columnas"])}
+        for c, cats in meta.get("categorias", {}).items():
+            cols[c] = pd.Categorical.from_codes(cols[c], cats, validate=False)   # los códigos siguen mapeados
+    except (OSError, ValueError, KeyError, EOFError, TypeError):
+        return None, None
+    return cols, meta
+
+def cargar_metricas_snapshot(fuente, nombre_metrica):
+    """cargar_metricas con snapshot en disco para archivos del repositorio (no para subidas)."""
+    if not isinstance(fuente, (str, Path)):
+        return cargar_metricas(fuente, nombre_metrica)
+    carpeta = _carpeta_snapshot(fuente)
+    cols, meta = abrir_snapshot(carpeta)
+    if cols is None:
+        df_total, df_plat = cargar_metricas(fuente, nombre_metrica)
+        comb, plats = combinar_metricas(df_total, df_plat)
+        guardar_snapshot(carpeta, comb, {"fuente": str(Path(fuente).resolve()),
+                                         "metrica": nombre_metrica, "plataformas": plats,
+                                         "huella": huella_fuente(fuente), "version": SNAPSHOT_VERSION})
+        return df_total, df_plat
+    df_total = pd.DataFrame({"Fecha": cols["Fecha"], nombre_metrica: cols[meta["metrica"]]}, copy=False)
+    df_plat = None
+    if meta["plataformas"]:
+        df_plat = pd.DataFrame({**{c: cols[c] for c in meta["plataformas"]}, "Fecha": cols["Fecha"]}, copy=False)
+    return df_total, df_plat
+
+def _carpeta_snapshot_dataset(fuentes, stts):
+    """Carpeta del snapshot del dataset combinado (None si alguna fuente es una subida)."""
+    if set(stts) != set(fuentes):
+        return None
+    clave = "|".join(f"{m}={_carpeta_snapshot(f, stts[m]).name}" for m, f in fuentes.items())
+    return CACHE_DIR / "snapshots" / hashlib.blake2b(f"dataset|{clave}".encode("utf-8"), digest_size=12).hexdigest()
+
+def guardar_snapshot_dataset(carpeta, fuentes, df_all, cal, plats, ultimas):
+    frames = {"df_all": df_all, "calendario": cal, **{m: p for m, p in plats.items() if p is not None}}
+    guardar_snapshot(carpeta, {f"{n}/{c}": serie for n, df in frames.items() for c, serie in df.items()},
+                     {"fuente": "dataset|" + "|".join(str(Path(f).resolve()) for f in fuentes.values()),
+                      "frames": {n: list(df.columns) for n, df in frames.items()},
+                      "ultimas": {m: None if pd.isna(u) else pd.Timestamp(u).isoformat() for m, u in ultimas.items()},
+                      "version": SNAPSHOT_VERSION})
+
+def abrir_snapshot_dataset(carpeta, fuentes):
+    """(df_all, calendario, frames por plataforma, última fecha por métrica) sobre columnas
+    mapeadas, o None si no hay snapshot del dataset."""
+    cols, meta = abrir_snapshot(carpeta)
+    if cols is None:
+        return None
+    frames = {n: pd.DataFrame({c: cols[f"{n}/{c}"] for c in columnas}, copy=False)
+              for n, columnas in meta["frames"].items()}
+    ultimas = {m: pd.Timestamp(u) if u else pd.NaT for m, u in meta["ultimas"].items()}
+    return frames["df_all"], frames["calendario"], {m: frames.get(m) for m in fuentes}, ultimas
+
+# =========================
+# Dimensión calendario (una fila por fecha distinta)
+# =========================
+_MESES_ABR_CAP = np.array([m.capitalize() for m in MESES_ABR], dtype=object)
+_MESES_LARGO   = np.array(MESES_LARGO, dtype=object)
+ETIQUETAS = ["Etiqueta_dia","Etiqueta_mes","Etiqueta_año","Etiqueta_sem"]
+
+def fmt_fechas_es(s: pd.Series) -> pd.Series:
+    """Versión vectorizada de fmt_fecha_es(abr=True) para una serie de fechas."""
+    return (s.dt.day.astype(str).str.zfill(2) + " " +
+            pd.Series(_MESES_ABR_CAP[s.dt.month.to_numpy() - 1], index=s.index) + " " +
+            s.dt.year.astype(str))
+
+def calendario(fechas: pd.Series) -> pd.DataFrame:
+    f = pd.Series(pd.to_datetime(pd.unique(fechas.dropna()))).sort_values(ignore_index=True)
+    cal = pd.DataFrame({"Fecha": f})
+    cal["Año"]    = f.dt.year.astype(np.int16)
+    cal["MesNum"] = f.dt.month.astype(np.int8)
+    cal["Semana"] = f.dt.isocalendar().week.astype(np.int8)
+    cal["Sem_ini"] = f - pd.to_timedelta(f.dt.weekday, unit="D")
+    cal["Sem_fin"] = cal["Sem_ini"] + pd.Timedelta(days=6)
+
+    cal["Etiqueta_dia"] = fmt_fechas_es(f)
+    cal["Etiqueta_mes"] = pd.Series(_MESES_LARGO[cal["MesNum"].to_numpy() - 1]) + " " + cal["Año"].astype(str)
+    cal["Etiqueta_año"] = cal["Año"].astype(str)
+    cal["Etiqueta_sem"] = ("Sem " + cal["Semana"].astype(str) + " (" +
+                           fmt_fechas_es(cal["Sem_ini"]) + " – " + fmt_fechas_es(cal["Sem_fin"]) + ")")
+    for c in ETIQUETAS:
+        cal[c] = cal[c].astype("category")
+    return cal
+
+# Columnas del calendario que se copian a df_all (las que usan los niveles de agregación)
+CALENDARIO_HECHOS = ["Año","MesNum","Semana"] + ETIQUETAS
+
+def unir_calendario(df, cal) -> pd.DataFrame:
+    """df + CALENDARIO_HECHOS por posición de la fecha en cal (ordenado, una fila por fecha):
+    un searchsorted en vez de un merge."""
+    pos = np.searchsorted(cal["Fecha"].to_numpy(dtype="datetime64[ns]"), df["Fecha"].to_numpy(dtype="datetime64[ns]"))
+    return pd.concat([df.reset_index(drop=True), cal[CALENDARIO_HECHOS].iloc[pos].reset_index(drop=True)], axis=1)
+
+# =========================
+# Agregación
+# =========================
+NIVELES = {
+    "Día":    (["Año","MesNum","Fecha","Etiqueta_dia"], "Etiqueta_dia"),
+    "Semana": (["Año","Semana","Etiqueta_sem"], "Etiqueta_sem"),
+    "Mes":    (["Año","MesNum","Etiqueta_mes"], "Etiqueta_mes"),
+    "Año":    (["Año","Etiqueta_año"], "Etiqueta_año"),
+}
+ORDEN = ["Año","MesNum","Semana","Fecha"]
+
+def agregar(df_local, nivel, cols):
+    by, lab = NIVELES[nivel]
+    df_local = df_local.astype({c: tipo_suma(df_local[c].dtype) for c in cols})
+    g = df_local.groupby(by, dropna=False, observed=True)[cols].sum().reset_index().rename(columns={lab:"Etiqueta"})
+    g = g.sort_values([c for c in ORDEN if c in g.columns])
+    g["Etiqueta"] = g["Etiqueta"].astype(str)
+    return g
+
+# Índice de sumas por rango: fechas ordenadas + sumas acumuladas por métrica.
+# El total de cualquier [ini, fin] sale de dos searchsorted (O(log n)) en vez de un scan.
+class IndiceRango:
+    def __init__(self, df_base, cols):
+        d = df_base.sort_values("Fecha", kind="stable")
+        self.fechas = d["Fecha"].to_numpy(dtype="datetime64[ns]")
+        self.acum = {c: np.concatenate([[0.0], np.cumsum(d[c].to_numpy(dtype=np.float64))]) for c in cols}
+
+    def extender(self, df_base, desde) -> "IndiceRango":
+        """Índice para df_base (ordenado por Fecha) que solo cambió desde `desde`: las sumas
+        anteriores se conservan y se acumula únicamente la cola."""
+        desde = np.datetime64(pd.Timestamp(desde), "ns")
+        i = int(np.searchsorted(self.fechas, desde))
+        fechas = df_base["Fecha"].to_numpy(dtype="datetime64[ns]")
+        j = int(np.searchsorted(fechas, desde))
+        cola = df_base.iloc[j:]
+        nuevo = IndiceRango.__new__(IndiceRango)
+        nuevo.fechas = np.concatenate([self.fechas[:i], fechas[j:]])
+        nuevo.acum = {c: np.concatenate([a[:i+1], a[i] + np.cumsum(cola[c].to_numpy(dtype=np.float64))])
+                      for c, a in self.acum.items()}
+        return nuevo
+
+    def posiciones(self, ini, fin):
+        i = int(np.searchsorted(self.fechas, np.datetime64(pd.Timestamp(ini), "ns"), side="left"))
+        j = int(np.searchsorted(self.fechas, np.datetime64(pd.Timestamp(fin), "ns"), side="right"))
+        return i, max(i, j)
+
+    def sumar(self, ini, fin):
+        i, j = self.posiciones(ini, fin)
+        return {c: int(a[j] - a[i]) for c, a in self.acum.items()}, j - i
+
+# Índice de filtros: opciones de los selectores de año / semana / día sacadas de slices
+# posicionales por año del calendario (ordenado por Fecha), sin recorrer df_all en cada rerun.
+class IndiceFiltros:
+    def __init__(self, df_base):
+        anios = df_base["Año"].to_numpy()
+        cortes = np.flatnonzero(np.diff(anios)) + 1
+        inicios, fines = np.r_[0, cortes], np.r_[cortes, len(anios)]
+        self.anios = [int(anios[i]) for i in inicios] if len(anios) else []
+        self.filas_anio = {a: (int(i), int(j)) for a, i, j in zip(self.anios, inicios, fines)}
+        dias = np.datetime_as_string(df_base["Fecha"].to_numpy(dtype="datetime64[ns]"), unit="D")
+        semanas = df_base["Semana"].to_numpy()
+        lunes = df_base["Sem_ini"].to_numpy(dtype="datetime64[D]")
+        self.dias, self.semanas = {}, {}
+        for a, (i, j) in self.filas_anio.items():
+            self.dias[a] = dias[i:j].tolist()
+            sem = {}
+            for s, l in sorted(set(zip(semanas[i:j].tolist(), lunes[i:j].tolist()))):
+                # La misma semana ISO puede aparecer al inicio y al final del año (p. ej. la 1
+                # en 30-31 dic.): se queda la que pertenece al año ISO `a`
+                if s not in sem or (l + timedelta(days=3)).year == a:
+                    sem[s] = l
+            self.semanas[a] = sem
+
+    def lunes(self, anio, semana) -> Optional[date]:
+        return self.semanas.get(int(anio), {}).get(int(semana))
+
+# Cubos de agregación (Día/Semana/Mes/Año) calculados una vez por dataset.
+# Cada cubo está en orden cronológico junto con el rango [Ini, Fin] de fechas de cada cubeta,
+# así que filtrar un rango es un slice contiguo; solo las cubetas de los bordes, que pueden
+# quedar parcialmente fuera, se recalculan con el índice de sumas acumuladas.
+def _cubetas(df_base, cols, niveles=NIVELES):
+    """{nivel: (cubetas en orden cronológico, Ini, Fin)} de df_base."""
+    cubos = {}
+    base = df_base.assign(Ini=df_base["Fecha"], Fin=df_base["Fecha"],
+                          **{c: df_base[c].astype(tipo_suma(df_base[c].dtype)) for c in cols})
+    for nivel in niveles:
+        by, lab = NIVELES[nivel]
+        g = (base.groupby(by, dropna=False, observed=True)
+                 .agg({**{c: "sum" for c in cols}, "Ini": "min", "Fin": "max"})
+                 .reset_index().rename(columns={lab: "Etiqueta"})
+                 .sort_values("Ini", kind="stable", ignore_index=True))
+        g["Etiqueta"] = g["Etiqueta"].astype(str)
+        ini = g.pop("Ini").to_numpy(dtype="datetime64[ns]")
+        fin = g.pop("Fin").to_numpy(dtype="datetime64[ns]")
+        cubos[nivel] = (g, ini, fin)
+    return cubos
+
+class CuboRollup:
+    def __init__(self, df_base, cols):
+        self.cols = list(cols)
+        self.idx = IndiceRango(df_base, self.cols)
+        self.cubos = _cubetas(df_base, self.cols)
+
+    def extender(self, df_base, desde) -> "CuboRollup":
+        """Cubo para df_base (ordenado por Fecha) que solo cambió desde `desde`. Se conservan
+        las cubetas anteriores y se recalculan la que contiene el último día previo (puede
+        seguir creciendo, p. ej. el mes en curso) y las posteriores."""
+        desde = np.datetime64(pd.Timestamp(desde), "ns")
+        fechas = df_base["Fecha"].to_numpy(dtype="datetime64[ns]")
+        nuevo = CuboRollup.__new__(CuboRollup)
+        nuevo.cols = self.cols
+        nuevo.idx = self.idx.extender(df_base, desde)
+        nuevo.cubos = {}
+        for nivel, (g, c_ini, c_fin) in self.cubos.items():
+            k = max(0, int(np.searchsorted(c_fin, desde, side="left")) - 1)
+            inicio = c_ini[k] if k < len(c_ini) else desde
+            gc, ic, fc = _cubetas(df_base.iloc[int(np.searchsorted(fechas, inicio)):], self.cols, [nivel])[nivel]
+            nuevo.cubos[nivel] = (pd.concat([g.iloc[:k], gc], ignore_index=True),
+                                  np.concatenate([c_ini[:k], ic]), np.concatenate([c_fin[:k], fc]))
+        return nuevo
+
+    def rango(self, nivel, ini, fin, con_tramos=False):
+        """Mismo resultado que agregar(df filtrado a [ini, fin], nivel, cols). Con con_tramos,
+        agrega Ini / Fin: primer y último día con datos de cada cubeta dentro del rango."""
+        g, c_ini, c_fin = self.cubos[nivel]
+        ini = np.datetime64(pd.Timestamp(ini), "ns"); fin = np.datetime64(pd.Timestamp(fin), "ns")
+        a = int(np.searchsorted(c_fin, ini, side="left"))
+        b = max(a, int(np.searchsorted(c_ini, fin, side="right")))
+        t = g.iloc[a:b].copy()   # el recorte de bordes no toca el cubo compartido
+        vacias = []
+        for k in sorted({0, len(t) - 1}) if len(t) else []:
+            if c_ini[a+k] >= ini and c_fin[a+k] <= fin:
+                continue
+            i, j = self.idx.posiciones(max(c_ini[a+k], ini), min(c_fin[a+k], fin))
+            if j == i:
+                vacias.append(t.index[k]); continue
+            for col in self.cols:
+                acum = self.idx.acum[col]
+                t.iat[k, t.columns.get_loc(col)] = t[col].dtype.type(acum[j] - acum[i])
+        if con_tramos:
+            t = t.assign(Ini=np.maximum(c_ini[a:b], ini), Fin=np.minimum(c_fin[a:b], fin))
+        t = t.drop(index=vacias)
+        return t.sort_values([c for c in ORDEN if c in t.columns] + ["Etiqueta"], kind="stable", ignore_index=True)
+
+# Cubo de plataformas: hechos en formato largo (posición de la fecha, métrica, plataforma,
+# valor) con métricas y plataformas codificadas como enteros. Se arma una vez por dataset sobre las
+# mismas cubetas que el CuboRollup principal: un arreglo denso [cubeta, métrica, plataforma]
+# por granularidad y sumas acumuladas diarias para recortar las cubetas de los bordes.
+# Cambiar de métrica, granularidad o rango es un slice; el último período, un acceso directo.
+class CuboPlataformas:
+    def __init__(self, cubo: CuboRollup, frames: Dict[str, pd.DataFrame], columnas: Dict[str, List[str]]):
+        self.cubo = cubo
+        fechas = cubo.idx.fechas
+        self.metricas = list(frames)
+        self.plataformas = list(dict.fromkeys(c for m in self.metricas for c in columnas[m]))  # código -> nombre
+        codigo = {c: i for i, c in enumerate(self.plataformas)}
+        self.codigos = {m: np.array([codigo[c] for c in columnas[m]], dtype=np.int16) for m in self.metricas}
+        # Tipo de los valores de salida: los frames traen conteos compactos, las sumas van en int64
+        self.tipos = {m: {c: tipo_suma(frames[m][c].dtype) for c in columnas[m]} for m in self.metricas}
+        entero = all(np.issubdtype(t, np.integer) for m in self.metricas for t in self.tipos[m].values())
+        valor = np.int64 if entero else np.float64
+
+        diario, presencia = self._diarios(fechas, frames, columnas, valor)
+        forma = diario.shape
+        self.acum = np.concatenate([np.zeros((1,) + forma[1:], dtype=diario.dtype), np.cumsum(diario, axis=0)])
+        self.acum_presencia = np.concatenate([np.zeros((1, forma[1]), dtype=np.int64), np.cumsum(presencia, axis=0)])
+
+        # Rollups por granularidad, alineados con las cubetas del cubo principal
+        self.claves, self.rollups, self.presencias = {}, {}, {}
+        for nivel, (g, c_ini, _) in cubo.cubos.items():
+            self.claves[nivel] = g.drop(columns=cubo.cols)
+            inicios = np.searchsorted(fechas, c_ini)
+            vacio = len(inicios) == 0
+            self.rollups[nivel] = np.zeros((0,) + forma[1:], diario.dtype) if vacio else np.add.reduceat(diario, inicios, axis=0)
+            self.presencias[nivel] = np.zeros((0, forma[1]), np.int64) if vacio else np.add.reduceat(presencia, inicios, axis=0)
+
+    def _diarios(self, fechas, frames, columnas, valor, desde=None):
+        """Arreglos densos [día, métrica, plataforma] (valores) y [día, métrica] (filas) sobre
+        `fechas`, con los hechos de los frames desde `desde` (todos si es None). Son solo para
+        armar las sumas: no se conservan."""
+        forma = (len(fechas), len(self.metricas), len(self.plataformas))
+        diario = np.zeros(forma, dtype=valor)
+        presencia = np.zeros(forma[:2], dtype=np.int64)
+        for mi, m in enumerate(self.metricas):
+            dfp, cols = frames[m], columnas[m]
+            f = dfp["Fecha"].to_numpy(dtype="datetime64[ns]")
+            filas = slice(None) if desde is None else f >= desde
+            pos = np.searchsorted(fechas, f[filas])
+            np.add.at(presencia[:, mi], pos, 1)
+            if cols:
+                np.add.at(diario, (np.tile(pos, len(cols)), mi, np.repeat(self.codigos[m], len(pos))),
+                          np.concatenate([np.asarray(dfp[c].to_numpy()[filas], dtype=valor) for c in cols]))
+        return diario, presencia
+
+    def extender(self, cubo: CuboRollup, frames, columnas, desde) -> "CuboPlataformas":
+        """Cubo de plataformas sobre `cubo` (el CuboRollup extendido desde `desde`, ver
+        CuboRollup.extender) con los frames que solo cambiaron desde `desde`. Se conservan
+        las sumas acumuladas y los rollups de las cubetas anteriores; los hechos se vuelven a
+        sumar solo desde el inicio de la primera cubeta recalculada. Si cambian las métricas,
+        las plataformas o el tipo de los valores, se arma de cero."""
+        tipos = {m: {c: tipo_suma(frames[m][c].dtype) for c in columnas[m]} for m in frames}
+        entero = all(np.issubdtype(t, np.integer) for t_m in tipos.values() for t in t_m.values())
+        if (list(frames) != self.metricas or any(self.columnas(m) != columnas[m] for m in frames)
+                or (np.int64 if entero else np.float64) != self.acum.dtype):
+            return CuboPlataformas(cubo, frames, columnas)
+        desde = np.datetime64(pd.Timestamp(desde), "ns")
+        fechas = cubo.idx.fechas
+        # Cubetas que se conservan por nivel (las mismas que conserva CuboRollup.extender)
+        conservar = {}
+        for nivel, (_, c_ini, c_fin) in self.cubo.cubos.items():
+            k = max(0, int(np.searchsorted(c_fin, desde, side="left")) - 1)
+            conservar[nivel] = (k, c_ini[k] if k < len(c_ini) else desde)
+        inicio = min([desde] + [i for _, i in conservar.values()])
+        p = int(np.searchsorted(fechas, inicio))   # días anteriores: mismas fechas y mismos hechos
+
+        nuevo = CuboPlataformas.__new__(CuboPlataformas)
+        nuevo.cubo, nuevo.metricas, nuevo.plataformas, nuevo.codigos = cubo, self.metricas, self.plataformas, self.codigos
+        nuevo.tipos = tipos
+        diario, presencia = nuevo._diarios(fechas[p:], frames, columnas, self.acum.dtype, fechas[p] if p < len(fechas) else desde)
+        # La suma sigue desde acum[p] en el mismo orden que el cumsum completo
+        nuevo.acum = np.concatenate([self.acum[:p], np.cumsum(np.concatenate([self.acum[p:p+1], diario]), axis=0)])
+        nuevo.acum_presencia = np.concatenate([self.acum_presencia[:p],
+                                               np.cumsum(np.concatenate([self.acum_presencia[p:p+1], presencia]), axis=0)])
+        nuevo.claves, nuevo.rollups, nuevo.presencias = {}, {}, {}
+        for nivel, (g, c_ini, _) in cubo.cubos.items():
+            k = conservar[nivel][0]
+            nuevo.claves[nivel] = g.drop(columns=cubo.cols)
+            inicios = np.searchsorted(fechas, c_ini[k:]) - p
+            rollups, presencias = self.rollups[nivel][:k], self.presencias[nivel][:k]
+            if len(inicios):
+                rollups = np.concatenate([rollups, np.add.reduceat(diario, inicios, axis=0)])
+                presencias = np.concatenate([presencias, np.add.reduceat(presencia, inicios, axis=0)])
+            nuevo.rollups[nivel], nuevo.presencias[nivel] = rollups, presencias
+        return nuevo
+
+    def columnas(self, metrica) -> List[str]:
+        return [self.plataformas[c] for c in self.codigos.get(metrica, [])]
+
+    def _cubetas(self, nivel, ini, fin):
+        _, c_ini, c_fin = self.cubo.cubos[nivel]
+        ini = np.datetime64(pd.Timestamp(ini), "ns"); fin = np.datetime64(pd.Timestamp(fin), "ns")
+        a = int(np.searchsorted(c_fin, ini, side="left"))
+        return a, max(a, int(np.searchsorted(c_ini, fin, side="right"))), ini, fin
+
+    def _cubeta(self, nivel, k, mi, ini, fin):
+        """(valores por plataforma, filas presentes) de la cubeta k, recortada a [ini, fin] si es de borde."""
+        _, c_ini, c_fin = self.cubo.cubos[nivel]
+        if c_ini[k] >= ini and c_fin[k] <= fin:
+            return self.rollups[nivel][k, mi], self.presencias[nivel][k, mi]
+        i, j = self.cubo.idx.posiciones(max(c_ini[k], ini), min(c_fin[k], fin))
+        return self.acum[j, mi] - self.acum[i, mi], self.acum_presencia[j, mi] - self.acum_presencia[i, mi]
+
+    def rango(self, metrica, nivel, ini, fin) -> pd.DataFrame:
+        """Mismo resultado que CuboRollup(frame de la métrica, plataformas).rango(nivel, ini, fin)."""
+        mi, cods, cols = self.metricas.index(metrica), self.codigos[metrica], self.columnas(metrica)
+        a, b, ini, fin = self._cubetas(nivel, ini, fin)
+        vals = self.rollups[nivel][a:b, mi].copy()
+        pres = self.presencias[nivel][a:b, mi].copy()
+        for k in sorted({0, b - a - 1}) if b > a else []:
+            vals[k], pres[k] = self._cubeta(nivel, a + k, mi, ini, fin)
+        t = self.claves[nivel].iloc[a:b][pres > 0]
+        valores = pd.DataFrame(vals[pres > 0][:, cods], columns=cols, index=t.index).astype(self.tipos[metrica])
+        t = pd.concat([t, valores], axis=1)
+        return t.sort_values([c for c in ORDEN if c in t.columns] + ["Etiqueta"], kind="stable", ignore_index=True)
+
+    def ultimo(self, metrica, nivel, ini, fin) -> Optional[pd.Series]:
+        """Valores por plataforma del último período con datos en [ini, fin] (None si no hay)."""
+        mi, cods = self.metricas.index(metrica), self.codigos[metrica]
+        a, b, ini, fin = self._cubetas(nivel, ini, fin)
+        for k in range(b - 1, a - 1, -1):
+            vals, pres = self._cubeta(nivel, k, mi, ini, fin)
+            if pres > 0:
+                return pd.Series(vals[cods], index=self.columnas(metrica))
+        return None
+
+PERIODOS = {"Diario":"Día", "Semanal":"Semana", "Mensual":"Mes", "Anual":"Año"}
+
+def tabla_por_periodo(cubo_local, p, ini, fin):
+    """Tabla de un periodo para mostrar o exportar: claves y conteos en int64."""
+    return enteros_salida(cubo_local.rango(PERIODOS[p], ini, fin))
+
+# Reducción de puntos para series largas (Largest-Triangle-Three-Buckets): conserva la forma
+# de la serie (picos y valles) eligiendo en cada cubeta el punto que forma el triángulo de
+# mayor área con el punto elegido antes y el promedio de la cubeta siguiente.
+def lttb(x: np.ndarray, y: np.ndarray, n_salida: int) -> np.ndarray:
+    """Índices (ordenados, incluyen el primero y el último) de a lo sumo n_salida puntos."""
+    n = len(y)
+    if n_salida >= n or n_salida < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+    bordes = (np.arange(n_salida - 1) * ((n - 2) / (n_salida - 2))).astype(np.int64) + 1
+    idx = np.empty(n_salida, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_salida - 2):
+        ini, fin = bordes[i], bordes[i + 1]
+        if i + 2 < len(bordes):
+            cx, cy = x[fin:bordes[i + 2]].mean(), y[fin:bordes[i + 2]].mean()
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - cx) * (y[ini:fin] - y[a]) - (x[a] - x[ini:fin]) * (cy - y[a]))
+        a = ini + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+# =========================
+# Dataset normalizado (caché por hash de contenido)
+# =========================
+# El dataset completo (df_all + calendario + frames por plataforma) se arma una vez por
+# combinación de contenidos de los tres CSV y se comparte entre reruns, sesiones y apps
+# del proceso. La caché tiene un presupuesto de memoria: al superarlo se descartan los
+# datasets usados menos recientemente (el último guardado siempre se conserva).
+CACHE_DATASETS_MB = float(os.environ.get("HEAVEN_CACHE_DATASETS_MB", 1024))
+
+def _arreglos(obj, vistos):
+    """Frames y arreglos numpy alcanzables desde obj (cada uno una vez)."""
+    if id(obj) in vistos:
+        return
+    vistos.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from _arreglos(v, vistos)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            yield from _arreglos(v, vistos)
+    elif isinstance(obj, (IndiceRango, CuboRollup, CuboPlataformas, Dataset)):
+        for k, v in vars(obj).items():
+            if k != "_lock":
+                yield from _arreglos(v, vistos)
+
+def memoria_objetos(*objs) -> int:
+    """Bytes aproximados de los frames / arreglos alcanzables desde objs (sin contar dos veces)."""
+    return sum(a.nbytes if isinstance(a, np.ndarray) else int(np.sum(a.memory_usage(deep=True)))
+               for a in _arreglos(objs, set()))
+
+def _congelar(obj):
+    """Índices compartidos de solo lectura: escribir en ellos falla en vez de afectar a otras sesiones."""
+    for a in _arreglos(obj, set()):
+        if isinstance(a, np.ndarray):
+            a.flags.writeable = False
+
+class CacheDatasets:
+    def __init__(self, max_mb=CACHE_DATASETS_MB):
+        self.max_bytes = int(max_mb * 2**20)
+        self.datos = OrderedDict()
+        self.nombres = {}      # clave -> app que la pidió por última vez
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+        self.lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self.lock:
+            ds = self.datos.get(clave)
+            if ds is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            self.datos.move_to_end(clave)
+            return ds
+
+    def guardar(self, clave, ds, nombre=None):
+        with self.lock:
+            self.datos[clave] = ds
+            self.datos.move_to_end(clave)
+            if nombre:
+                self.nombres[clave] = nombre
+            self._recortar()
+
+    def nombrar(self, clave, nombre):
+        with self.lock:
+            if nombre and clave in self.datos:
+                self.nombres[clave] = nombre
+
+    def descartar(self, clave):
+        with self.lock:
+            self.datos.pop(clave, None)
+            self.nombres.pop(clave, None)
+
+    def bytes_total(self) -> int:
+        with self.lock:
+            return sum(ds.memoria() for ds in self.datos.values())
+
+    def residentes(self) -> List[str]:
+        """Apps con su dataset en memoria."""
+        with self.lock:
+            return [self.nombres[k] for k in self.datos if k in self.nombres]
+
+    def ajustar(self):
+        """Vuelve a aplicar el presupuesto (p. ej. tras construir un índice perezoso)."""
+        with self.lock:
+            self._recortar()
+
+    def _recortar(self):
+        total = sum(ds.memoria() for ds in self.datos.values())
+        while total > self.max_bytes and len(self.datos) > 1:
+            clave, ds = self.datos.popitem(last=False)
+            self.nombres.pop(clave, None)
+            total -= ds.memoria()
+            self.descartes += 1
+
+CACHE_DATASETS = CacheDatasets()
+_huellas = OrderedDict()   # (ruta, mtime_ns, tamaño) | file_id de una subida -> hash
+_huellas_lock = threading.Lock()
+HUELLAS_MAX = 256
+
+def huella_fuente(fuente) -> str:
+    """Hash de contenido de un CSV (ruta o UploadedFile); no se relee mientras no cambie."""
+    es_ruta = isinstance(fuente, (str, Path))
+    if es_ruta:
+        stt = os.stat(fuente)
+        clave = (str(fuente), stt.st_mtime_ns, stt.st_size)
+    else:
+        # Un UploadedFile de Streamlit conserva su file_id (único) entre reruns
+        clave = ("upload", getattr(fuente, "file_id", id(fuente)))
+    with _huellas_lock:
+        h = _huellas.get(clave)
+    if h is None and es_ruta:
+        # En frío, el manifest del snapshot ya trae el hash: no hace falta releer el CSV
+        meta = leer_manifest(_carpeta_snapshot(fuente, stt))
+        h = meta.get("huella") if meta else None
+    if h is None:
+        data = Path(fuente).read_bytes() if es_ruta else fuente.getvalue()
+        h = hashlib.blake2b(data, digest_size=16).hexdigest()
+    _registrar_huella(clave, h)
+    return h
+
+def _registrar_huella(clave, h):
+    with _huellas_lock:
+        _huellas[clave] = h
+        _huellas.move_to_end(clave)
+        while len(_huellas) > HUELLAS_MAX:
+            _huellas.popitem(last=False)
+
+class Dataset:
+    """Dataset normalizado: df_all (hechos + calendario), frames por plataforma y los
+    índices derivados (cubos, sumas acumuladas), construidos una sola vez."""
+    def __init__(self, df_all, cal, plat, huella, marcas=None, cubo=None, plataformas=None):
+        self.df_all = df_all
+        self.cal = cal
+        self.plat = plat
+        self.huella = huella
+        self.marcas = marcas or {}     # métrica -> marca de agua de su CSV (ver ingesta incremental)
+        self.cubo = cubo if cubo is not None else CuboRollup(df_all, METRICAS)
+        _congelar(self.cubo)
+        self._plataformas = plataformas
+        if plataformas is not None:
+            _congelar(plataformas)
+        self._filtros = None
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def vista(self) -> pd.DataFrame:
+        """df_all para una sesión; lo que la sesión le agregue o modifique no llega al dataset
+        compartido. Con Copy-on-Write activo (la app lo activa al arrancar) es una copia
+        superficial sin copiar datos; sin él, una copia completa."""
+        return self.df_all.copy(deep=not pd.get_option("mode.copy_on_write"))
+
+    def memoria(self) -> int:
+        """Bytes aproximados del dataset y sus índices (se recalcula al construir el cubo de plataformas)."""
+        if self._bytes is None:
+            self._bytes = memoria_objetos(self)
+        return self._bytes
+
+    def reporte_memoria(self) -> pd.DataFrame:
+        """MB por componente: columna a columna (con su tipo) en los frames; en bloque para los
+        índices derivados (el cubo de plataformas solo si ya se construyó)."""
+        filas = []
+        frames = [("df_all", self.df_all), ("calendario", self.cal)]
+        frames += [(f"plataformas {m}", p) for m, p in self.plat.items() if p is not None]
+        for comp, df in frames:
+            for c, b in df.memory_usage(deep=True, index=False).items():
+                filas.append((comp, c, str(df[c].dtype), len(df), b))
+        filas.append(("cubo", "", "", len(self.df_all), memoria_objetos(self.cubo)))
+        if self._plataformas is not None:
+            filas.append(("cubo plataformas", "", "", len(self.idx.fechas), memoria_objetos(self._plataformas)))
+        rep = pd.DataFrame(filas, columns=["Componente", "Columna", "Tipo", "Filas", "MB"])
+        rep["MB"] = (rep["MB"] / 2**20).round(3)
+        return rep
+
+    @property
+    def idx(self) -> IndiceRango:
+        return self.cubo.idx
+
+    @property
+    def data_min(self):
+        return pd.Timestamp(self.idx.fechas[0]).date()
+
+    @property
+    def data_max(self):
+        return pd.Timestamp(self.idx.fechas[-1]).date()
+
+    @property
+    def filtros(self) -> IndiceFiltros:
+        with self._lock:
+            if self._filtros is None:
+                self._filtros = IndiceFiltros(self.cal)
+            return self._filtros
+
+    def _frames_plataforma(self):
+        frames = {m: p for m, p in self.plat.items() if p is not None}
+        return frames, {m: [c for c in p.columns if c not in self.cal.columns] for m, p in frames.items()}
+
+    @property
+    def plataformas(self) -> CuboPlataformas:
+        with self._lock:
+            if self._plataformas is None:
+                with RENDIMIENTO.etapa("cubos_plataforma"):
+                    self._plataformas = CuboPlataformas(self.cubo, *self._frames_plataforma())
+                _congelar(self._plataformas)
+                self._bytes = None
+                construido = True
+            else:
+                construido = False
+        if construido:
+            CACHE_DATASETS.ajustar()
+        return self._plataformas
+
+def construir_dataset(fuentes: Dict[str, object], huella: str = "") -> Dataset:
+    stts = {m: os.stat(f) for m, f in fuentes.items() if isinstance(f, (str, Path))}
+    carpeta = _carpeta_snapshot_dataset(fuentes, stts)
+    if carpeta is not None:
+        with RENDIMIENTO.etapa("ingesta", snapshot="dataset"):
+            snap = abrir_snapshot_dataset(carpeta, fuentes)
+        if snap is not None:
+            df_all, cal, plats, ultimas = snap
+            marcas = {m: marca_fuente(f, ultimas[m], stts[m]) for m, f in fuentes.items()}
+            with RENDIMIENTO.etapa("cubos", filas=len(df_all)):
+                return Dataset(df_all, cal, plats, huella, marcas)
+
+    tots, plats, marcas = [], {}, {}
+    for nombre, fuente in fuentes.items():
+        with RENDIMIENTO.etapa("ingesta", metrica=nombre):
+            tot, plat = cargar_metricas_snapshot(fuente, nombre)
+        tots.append(tot); plats[nombre] = plat
+        if nombre in stts:
+            marcas[nombre] = marca_fuente(fuente, tot["Fecha"].max() if len(tot) else pd.NaT, stts[nombre])
+
+    with RENDIMIENTO.etapa("merge"):
+        df_all = (tots[0].merge(tots[1], on="Fecha", how="outer")
+                         .merge(tots[2], on="Fecha", how="outer")
+                         .fillna(0).sort_values("Fecha"))
+        for c, tot in zip(fuentes, tots):
+            df_all[c] = pd.to_numeric(df_all[c], errors="coerce").fillna(0)
+            if pd.api.types.is_integer_dtype(tot[c].dtype):
+                df_all[c] = df_all[c].astype(tot[c].dtype)   # conteos: los días faltantes (0) no los vuelven float
+        cal = calendario(df_all["Fecha"])
+        df_all = unir_calendario(df_all, cal)   # los frames por plataforma quedan solo con hechos
+    if carpeta is not None:
+        guardar_snapshot_dataset(carpeta, fuentes, df_all, cal, plats, {m: marcas[m]["marca"] for m in fuentes})
+    with RENDIMIENTO.etapa("cubos", filas=len(df_all)):
+        return Dataset(df_all, cal, plats, huella, marcas)
+
+def _clave_dataset(huellas: Dict[str, str]) -> str:
+    return hashlib.blake2b("|".join(f"{m}={h}" for m, h in huellas.items()).encode("utf-8"),
+                           digest_size=16).hexdigest()
+
+def obtener_dataset(fuentes: Dict[str, object], app: Optional[str] = None) -> Dataset:
+    """Dataset para las tres fuentes (rutas o archivos subidos), desde la caché si ya existe.
+    Si los CSV del repositorio solo crecieron por el final, se extiende el dataset anterior."""
+    if INGESTA_INCREMENTAL:
+        ds = refrescar_incremental(fuentes, app)
+        if ds is not None:
+            return ds
+    clave = _clave_dataset({m: huella_fuente(f) for m, f in fuentes.items()})
+    ds = CACHE_DATASETS.obtener(clave)
+    if ds is None:
+        ds = construir_dataset(fuentes, clave)
+        CACHE_DATASETS.guardar(clave, ds, app)
+    else:
+        CACHE_DATASETS.nombrar(clave, app)
+    _recordar_rutas(fuentes, clave)
+    return ds
+
+# =========================
+# Registro de apps
+# =========================
+# Cada app es un trío de fuentes (una por métrica). La del repositorio siempre existe; un
+# apps.json (o el archivo de HEAVEN_APPS) agrega otras, con rutas relativas a ese archivo:
+#   {"Otra app": "datos/otra",                       <- carpeta con los tres CSV del repositorio
+#    "Tercera": {"Impresiones": "imp.csv", "Descargas": "dwn.csv", "Lanzamientos": "lnc.csv"}}
+APP_REPO = "Heaven"
+APPS_CONFIG = Path(os.environ.get("HEAVEN_APPS", BASE_DIR / "apps.json"))
+
+def registro_apps(config: Path = APPS_CONFIG) -> Dict[str, Dict[str, str]]:
+    """{app: {métrica: ruta}} en el orden de METRICAS."""
+    apps = {APP_REPO: {m: str(BASE_DIR / FUENTES_REPO[m]) for m in METRICAS}}
+    config = Path(config)
+    if not config.exists():
+        return apps
+    try:
+        cfg = json.loads(config.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise DatosInvalidos(f"No se pudo leer el registro de apps {config}: {e}")
+    if not isinstance(cfg, dict):
+        raise DatosInvalidos(f"{config}: se espera un objeto {{app: carpeta | {{métrica: csv}}}}")
+    for nombre, spec in cfg.items():
+        if isinstance(spec, str):
+            apps[nombre] = {m: str(config.parent / spec / FUENTES_REPO[m]) for m in METRICAS}
+        elif isinstance(spec, dict) and set(spec) == set(METRICAS):
+            apps[nombre] = {m: str(config.parent / spec[m]) for m in METRICAS}
+        else:
+            raise DatosInvalidos(f"App '{nombre}' en {config}: se espera una carpeta o un CSV por métrica "
+                                 f"({', '.join(METRICAS)})")
+    return apps
+
+# =========================
+# Ingesta incremental (CSV que solo crecen por el final)
+# =========================
+# Cada dataset armado desde archivos del repositorio guarda, por métrica, una marca de agua:
+# bytes consumidos, mtime, hash de contenido, los últimos INGESTA_COLA_BYTES bytes leídos, el
+# estado del hash (para seguirlo sin releer) y la última fecha. Si un CSV creció, sus bytes
+# previos terminan igual que la cola guardada y solo trae filas posteriores a la marca, se
+# leen y parsean solo los bytes agregados y se extiende el dataset anterior: la cola de
+# df_all, el calendario, las sumas acumuladas y las cubetas afectadas (también las del cubo de
+# plataformas, si ya estaba armado) se recalculan; el resto se reutiliza. Se asume que los
+# CSV solo se escriben por el final: una edición en medio del archivo que conserve la cola no
+# se detecta hasta la próxima ingesta completa. Tras un arranque en frío (desde snapshot) no
+# hay estado del hash y el primer anexo lee una vez el prefijo completo para armarlo. El
+# dataset nuevo es otro objeto (copy-on-write), así que las sesiones que todavía leen el
+# anterior no ven cambios a mitad de un rerun. Cualquier otro cambio (reescritura, filas con
+# fechas ya vistas, línea final incompleta) vuelve a la ingesta completa.
+INGESTA_INCREMENTAL = os.environ.get("HEAVEN_INGESTA_INCREMENTAL", "1") != "0"
+INGESTA_COLA_BYTES = 1 << 16
+
+_claves_por_rutas: Dict[Tuple, str] = {}   # (métrica, ruta)... -> clave del último dataset de esas rutas
+_incremental_lock = threading.Lock()
+
+def marca_fuente(fuente, ultima, stt) -> Dict:
+    with open(fuente, "rb") as fh:
+        fh.seek(max(0, stt.st_size - INGESTA_COLA_BYTES))
+        cola = fh.read(INGESTA_COLA_BYTES)
+    return {"bytes": stt.st_size, "mtime": stt.st_mtime_ns, "marca": ultima, "huella": huella_fuente(fuente),
+            "cola": cola, "hash": None}
+
+def _rutas(fuentes):
+    if not all(isinstance(f, (str, Path)) for f in fuentes.values()):
+        return None
+    return tuple((m, str(Path(f).resolve())) for m, f in fuentes.items())
+
+def _recordar_rutas(fuentes, clave):
+    rutas = _rutas(fuentes)
+    if rutas is not None:
+        with _incremental_lock:
+            _claves_por_rutas[rutas] = clave
+
+def leer_anexado(fuente, marca: Dict, nombre_metrica: str, stt):
+    """(tot, plat, marca nueva) con solo las filas agregadas al final del CSV desde `marca`,
+    o None si el archivo no creció solo por el final. Lee el encabezado, la cola guardada y
+    los bytes nuevos; el prefijo completo solo si la marca no trae el estado del hash."""
+    previo, cola = marca["bytes"], marca["cola"]
+    if stt.st_size <= previo:
+        return None
+    with open(fuente, "rb") as fh:
+        encabezado = fh.readline()
+        fh.seek(previo - len(cola))
+        if fh.read(len(cola)) != cola or (previo and cola[-1:] != b"\n"):
+            return None   # cambió el final del contenido previo (o la última línea no estaba completa)
+        if marca["hash"] is None:
+            h = hashlib.blake2b(digest_size=16)
+            fh.seek(0)
+            resto = previo
+            while resto:
+                bloque = fh.read(min(resto, 1 << 20))
+                if not bloque:
+                    return None
+                h.update(bloque); resto -= len(bloque)
+            if h.hexdigest() != marca["huella"]:
+                return None
+        else:
+            h = marca["hash"].copy()   # la marca anterior la puede seguir usando otro dataset
+            fh.seek(previo)
+        nuevos = fh.read(stt.st_size - previo)
+    if not nuevos.endswith(b"\n"):
+        return None   # el archivo se está escribiendo: se toma completo en el próximo rerun
+    tot, plat = normalizar_metricas(leer_csv(io.BytesIO(encabezado + nuevos)), nombre_metrica)
+    if len(tot) and pd.notna(marca["marca"]) and tot["Fecha"].min() <= marca["marca"]:
+        return None   # trae fechas ya ingeridas: no es un anexo
+    h.update(nuevos)   # mismo hash de contenido que huella_fuente sobre el archivo completo
+    huella = h.hexdigest()
+    _registrar_huella((str(fuente), stt.st_mtime_ns, stt.st_size), huella)
+    ultima = tot["Fecha"].max() if len(tot) else marca["marca"]
+    return tot, plat, {"bytes": stt.st_size, "mtime": stt.st_mtime_ns, "marca": ultima, "huella": huella,
+                       "cola": (cola + nuevos)[-INGESTA_COLA_BYTES:], "hash": h}
+
+def _concat_categorias(frames):
+    """concat que conserva las columnas categóricas (unión ordenada de categorías)."""
+    out = pd.concat(frames, ignore_index=True)
+    for c in frames[0].columns:
+        if isinstance(frames[0][c].dtype, pd.CategoricalDtype):
+            out[c] = union_categoricals([f[c] for f in frames], sort_categories=True)
+    return out
+
+def extender_dataset(ds: Dataset, nuevos: Dict[str, Tuple], marcas: Dict[str, Dict], huella: str) -> Dataset:
+    """Dataset de ds más las filas nuevas {métrica: (tot, plat)} (todas posteriores a la
+    marca de su métrica). Solo se recalcula desde la primera fecha nueva."""
+    con_filas = [tot for tot, _ in nuevos.values() if len(tot)]
+    if not con_filas:
+        return Dataset(ds.df_all, ds.cal, ds.plat, huella, marcas, ds.cubo)
+    desde = min(tot["Fecha"].min() for tot in con_filas)
+    df = ds.df_all
+    corte = int(np.searchsorted(df["Fecha"].to_numpy(dtype="datetime64[ns]"), np.datetime64(desde, "ns")))
+
+    # Cola de hechos: filas previas desde `desde` + filas nuevas, una fila por fecha
+    cola = (pd.concat([df.iloc[corte:][["Fecha"] + METRICAS]] + con_filas, ignore_index=True)
+              .groupby("Fecha", as_index=False, sort=True).sum())
+    for c in METRICAS:
+        cola[c] = cola[c].astype(np.promote_types(df[c].dtype, tipo_compacto(cola[c].to_numpy())))
+
+    # Calendario: solo las fechas que no existían
+    cal = ds.cal
+    fechas_nuevas = cola["Fecha"][~cola["Fecha"].isin(cal["Fecha"].iloc[int(np.searchsorted(
+        cal["Fecha"].to_numpy(dtype="datetime64[ns]"), np.datetime64(desde, "ns"))):])]
+    if len(fechas_nuevas):
+        cal = _concat_categorias([cal, calendario(fechas_nuevas)])
+        if not cal["Fecha"].is_monotonic_increasing:
+            cal = cal.sort_values("Fecha", ignore_index=True)
+    cal_cola = cal.iloc[int(np.searchsorted(cal["Fecha"].to_numpy(dtype="datetime64[ns]"), np.datetime64(desde, "ns"))):]
+
+    df_all = _concat_categorias([df.iloc[:corte], unir_calendario(cola, cal_cola)[df.columns]])
+    plats = dict(ds.plat)
+    for m, p in plats.items():
+        plat = nuevos.get(m, (None, None))[1]
+        if p is not None and plat is not None and len(plat):
+            plats[m] = pd.concat([p, compactar(plat)[p.columns]], ignore_index=True)
+    cubo = ds.cubo.extender(df_all, desde)
+    ext = Dataset(df_all, cal, plats, huella, marcas, cubo)
+    if ds._plataformas is not None:   # si el anterior ya tenía el cubo de plataformas, se extiende también
+        ext._plataformas = ds._plataformas.extender(cubo, *ext._frames_plataforma(), desde)
+        _congelar(ext._plataformas)
+    return ext
+
+def refrescar_incremental(fuentes: Dict[str, object], app: Optional[str] = None) -> Optional[Dataset]:
+    """Dataset extendido si los CSV del último dataset de estas rutas solo crecieron por el
+    final; None si no hay dataset previo, si nada cambió o si el cambio no es un anexo."""
+    rutas = _rutas(fuentes)
+    if rutas is None:
+        return None
+    with _incremental_lock:
+        clave = _claves_por_rutas.get(rutas)
+        with CACHE_DATASETS.lock:
+            previo = CACHE_DATASETS.datos.get(clave) if clave else None
+        if previo is None or set(previo.marcas) != set(fuentes):
+            return None
+        nuevos, marcas = {}, dict(previo.marcas)
+        for m, f in fuentes.items():
+            stt = os.stat(f)
+            if (stt.st_mtime_ns, stt.st_size) == (marcas[m]["mtime"], marcas[m]["bytes"]):
+                continue
+            anexo = leer_anexado(f, marcas[m], m, stt)
+            if anexo is None:
+                return None
+            nuevos[m] = anexo[:2]; marcas[m] = anexo[2]
+        if not nuevos:
+            return None
+        filas = sum(len(t) for t, _ in nuevos.values())
+        with RENDIMIENTO.etapa("ingesta_incremental", filas=filas):
+            clave = _clave_dataset({m: marcas[m]["huella"] for m in fuentes})
+            ds = extender_dataset(previo, nuevos, marcas, clave)
+        # La versión anterior ya no la pide nadie por estas rutas: libera su memoria
+        CACHE_DATASETS.descartar(_claves_por_rutas[rutas])
+        CACHE_DATASETS.guardar(clave, ds, app)
+        _claves_por_rutas[rutas] = clave
+    return ds
+
+# =========================
+# Comparativas vectorizadas (período anterior y YoY)
+# =========================
+# Un "tramo" es un intervalo [ini, fin] de días: el rango elegido (KPIs) o cada cubeta de
+# una granularidad (gráficos / tablas comparativas). Los tramos anteriores y del año
+# anterior se calculan para todos a la vez con aritmética de fechas de numpy, alineados por
+# calendario, y sus totales salen de las sumas acumuladas con dos searchsorted por lote.
+def _dias(x) -> np.ndarray:
+    return np.asarray(pd.to_datetime(np.atleast_1d(x))).astype("datetime64[D]")
+
+def tramos_anteriores(ini, fin, gran: str):
+    """Período anterior de cada tramo: el año / mes completo anterior, la semana anterior
+    (mismos días) o, en Día, el tramo de igual duración inmediatamente antes."""
+    ini, fin = _dias(ini), _dias(fin)
+    if gran == "Año":
+        y = ini.astype("datetime64[Y]")
+        return (y - 1).astype("datetime64[D]"), y.astype("datetime64[D]") - 1
+    if gran == "Mes":
+        m = ini.astype("datetime64[M]")
+        return (m - 1).astype("datetime64[D]"), m.astype("datetime64[D]") - 1
+    if gran == "Semana":
+        return ini - 7, fin - 7
+    dur = fin - ini
+    return ini - dur - 1, fin - dur - 1
+
+def _semana_iso(d: np.ndarray) -> np.ndarray:
+    return pd.DatetimeIndex(d).isocalendar()["week"].to_numpy(dtype=np.int64)
+
+def tramos_yoy(ini, fin, semana_iso: bool = False):
+    """Mismo período del año anterior. Por fecha (DateOffset: el 29 Feb pasa al 28 Feb) o,
+    con semana_iso, la misma semana ISO del año ISO anterior con los mismos días de la
+    semana (NaT si ese año no tiene semana 53)."""
+    ini, fin = _dias(ini), _dias(fin)
+    if not semana_iso:
+        un_anio = pd.DateOffset(years=1)
+        return (np.asarray(pd.DatetimeIndex(ini) - un_anio).astype("datetime64[D]"),
+                np.asarray(pd.DatetimeIndex(fin) - un_anio).astype("datetime64[D]"))
+    lunes = ini - (ini.astype(np.int64) + 3) % 7          # 1970-01-01 fue jueves
+    sem = _semana_iso(lunes)
+    desp = np.where(_semana_iso(lunes - 364) == sem, 364, np.where(_semana_iso(lunes - 371) == sem, 371, 0))
+    nat = np.datetime64("NaT", "D")
+    return np.where(desp > 0, ini - desp, nat), np.where(desp > 0, fin - desp, nat)
+
+def sumar_tramos(idx: IndiceRango, ini, fin):
+    """({métrica: totales}, filas) de cada tramo; los tramos NaT suman 0 con 0 filas."""
+    ini, fin = _dias(ini), _dias(fin)
+    validos = ~(np.isnat(ini) | np.isnat(fin))
+    i = np.searchsorted(idx.fechas, ini.astype("datetime64[ns]"), side="left")
+    j = np.maximum(i, np.searchsorted(idx.fechas, fin.astype("datetime64[ns]"), side="right"))
+    i, j = np.where(validos, i, 0), np.where(validos, j, 0)
+    return {c: a[j] - a[i] for c, a in idx.acum.items()}, j - i
+
+def _pct_tramos(a, b) -> np.ndarray:
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b > 0, (a - b) / b * 100.0, np.nan)
+
+def comparativo(ds: "Dataset", gran: str, ini, fin) -> pd.DataFrame:
+    """Cubetas de `gran` en [ini, fin] (igual que cubo.rango) con, por métrica, el valor del
+    período anterior, el del año anterior y sus Δ%. En Semana el YoY es la misma semana
+    ISO; sin datos en el tramo comparado, el valor queda NaN."""
+    t = ds.cubo.rango(gran, ini, fin, con_tramos=True)
+    t_ini, t_fin = t.pop("Ini").to_numpy(), t.pop("Fin").to_numpy()
+    prev, n_prev = sumar_tramos(ds.idx, *tramos_anteriores(t_ini, t_fin, gran))
+    yoy, n_yoy = sumar_tramos(ds.idx, *tramos_yoy(t_ini, t_fin, semana_iso=gran == "Semana"))
+    for m in METRICAS:
+        ant = np.where(n_prev > 0, prev[m], np.nan)
+        ya = np.where(n_yoy > 0, yoy[m], np.nan)
+        t[f"{m} anterior"], t[f"Δ% {m}"] = ant, _pct_tramos(t[m], ant)
+        t[f"{m} YoY"], t[f"Δ% {m} YoY"] = ya, _pct_tramos(t[m], ya)
+    return t
+
+def periodo_anterior(ini: pd.Timestamp, fin: pd.Timestamp, gran: str):
+    a, b = tramos_anteriores(ini, fin, gran)
+    return pd.Timestamp(a[0]), pd.Timestamp(b[0])
+
+def periodo_yoy(ini: pd.Timestamp, fin: pd.Timestamp, gran: Optional[str] = None):
+    """Mismo tramo que usa comparativo para el YoY (en Semana, la misma semana ISO; NaT si no existe)."""
+    a, b = tramos_yoy(ini, fin, semana_iso=gran == "Semana")
+    return pd.Timestamp(a[0]), pd.Timestamp(b[0])
+
+# =========================
+# Helpers comparativas
+# =========================
+
+def pct(a,b):
+    if b in (0, np.nan) or pd.isna(b): return np.nan
+    return (a - b) / b * 100.0
+
+def sumar_rango(idx: IndiceRango, ini, fin):
+    tot, n = idx.sumar(ini, fin)
+    if n == 0:
+        return {"Impresiones":0, "Descargas":0, "Lanzamientos":0}, np.nan, np.nan
+    imp = tot["Impresiones"]; dwn = tot["Descargas"]; lnc = tot["Lanzamientos"]
+    conv = (dwn/imp*100) if imp>0 else np.nan
+    uso  = (lnc/dwn) if dwn>0 else np.nan
+    return {"Impresiones":imp, "Descargas":dwn, "Lanzamientos":lnc}, conv, uso
+
+def chip(valor):
+    if pd.isna(valor): return "—"
+    return ("🟢 +" if valor >= 0 else "🔴 ") + f"{valor:.1f}%"
+
+# =========================
+# Rango y KPIs de un período
+# =========================
+def rango_inteligente(anio, mes=None, semana=None, dia=None, data_min=None, data_max=None,
+                      filtros: Optional[IndiceFiltros] = None):
+    """Rango [ini, fin] según la selección (prioridad: Día > Semana > Mes > Año),
+    limitado al rango real de datos. La semana es la semana ISO de `anio`, o la que
+    figura con ese número en los datos de `anio` si se pasa el índice de filtros."""
+    if dia is not None:
+        ini_r = fin_r = pd.to_datetime(dia).date()
+    elif semana is not None:
+        lunes = filtros.lunes(anio, semana) if filtros is not None else None
+        sem_ini = pd.Timestamp(lunes or date.fromisocalendar(int(anio), int(semana), 1))
+        sem_fin = sem_ini + pd.Timedelta(days=6)
+        ini_r, fin_r = sem_ini.date(), sem_fin.date()
+    elif mes is not None:
+        ini_r = pd.Timestamp(anio, mes, 1).date()
+        fin_r = (pd.Timestamp(anio, mes, 1) + pd.offsets.MonthEnd(1)).date()
+    else:
+        ini_r = pd.Timestamp(anio, 1, 1).date()
+        fin_r = pd.Timestamp(anio, 12, 31).date()
+    if data_min is not None: ini_r = max(ini_r, data_min)
+    if data_max is not None: fin_r = min(fin_r, data_max)
+    return ini_r, fin_r
+
+def calcular_kpis(ds: Dataset, ini_r, fin_r, gran: str, cmp_yoy: bool = False) -> Dict:
+    """Totales del período, deltas vs. período anterior y (opcional) bloque YoY."""
+    idx = ds.idx
+    data_min, data_max = ds.data_min, ds.data_max
+
+    # Período actual
+    tot, filas = idx.sumar(ini_r, fin_r)
+    i, j = idx.posiciones(ini_r, fin_r)
+    tot_imp = tot["Impresiones"]
+    tot_dwn = tot["Descargas"]
+    tot_lnc = tot["Lanzamientos"]
+    conv = (tot_dwn/tot_imp*100) if tot_imp>0 else 0
+    uso  = (tot_lnc/tot_dwn) if tot_dwn>0 else 0
+
+    # Período anterior
+    ini_prev, fin_prev = periodo_anterior(pd.to_datetime(ini_r), pd.to_datetime(fin_r), gran)
+    ini_prev = max(ini_prev.date(), data_min); fin_prev = min(fin_prev.date(), data_max)
+    sum_prev, conv_prev, uso_prev = sumar_rango(idx, ini_prev, fin_prev)
+
+    deltas = {
+        "imp": pct(tot_imp, sum_prev["Impresiones"]),
+        "dwn": pct(tot_dwn, sum_prev["Descargas"]),
+        "lnc": pct(tot_lnc, sum_prev["Lanzamientos"]),
+        "conv": pct(conv, conv_prev) if pd.notna(conv_prev) else np.nan,
+        "uso":  pct(uso,  uso_prev)  if pd.notna(uso_prev)  else np.nan,
+    }
+
+    # Período YoY (opcional) — armado general para PDF
+    yoy_block = None
+    ini_yoy = fin_yoy = pd.NaT
+    if cmp_yoy:
+        ini_yoy, fin_yoy = periodo_yoy(pd.to_datetime(ini_r), pd.to_datetime(fin_r), gran)
+    if pd.notna(ini_yoy):   # sin la semana ISO equivalente el año anterior no hay bloque YoY
+        ini_yoy = max(ini_yoy.date(), data_min); fin_yoy = min(fin_yoy.date(), data_max)
+        sum_yoy, conv_yoy, uso_yoy = sumar_rango(idx, ini_yoy, fin_yoy)
+
+        delta_imp_yoy = pct(tot_imp, sum_yoy["Impresiones"])
+        delta_dwn_yoy = pct(tot_dwn, sum_yoy["Descargas"])
+        delta_lnc_yoy = pct(tot_lnc, sum_yoy["Lanzamientos"])
+        delta_conv_yoy = pct(conv, conv_yoy) if pd.notna(conv_yoy) else np.nan
+        delta_uso_yoy  = pct(uso,  uso_yoy)  if pd.notna(uso_yoy)  else np.nan
+
+        yoy_block = {
+            "RangoYoY": (ini_yoy, fin_yoy),
+            "Filas": [
+                ("Impresiones",        tot_imp, sum_yoy["Impresiones"], delta_imp_yoy),
+                ("Descargas",          tot_dwn, sum_yoy["Descargas"],   delta_dwn_yoy),
+                ("Lanzamientos",       tot_lnc, sum_yoy["Lanzamientos"],delta_lnc_yoy),
+                ("Conversión (%)",     conv,    conv_yoy if pd.notna(conv_yoy) else 0, delta_conv_yoy),
+                ("Uso/instalación",    uso,     uso_yoy if pd.notna(uso_yoy) else 0,   delta_uso_yoy),
+            ]
+        }
+
+    return {
+        "ini": ini_r, "fin": fin_r, "gran": gran, "filas": filas,
+        "fecha_min": pd.Timestamp(idx.fechas[i]) if filas else pd.NaT,
+        "fecha_max": pd.Timestamp(idx.fechas[j-1]) if filas else pd.NaT,
+        "tot": tot, "conv": conv, "uso": uso,
+        "prev": (ini_prev, fin_prev), "deltas": deltas, "yoy_block": yoy_block,
+    }
+
+def texto_resumen(k: Dict) -> str:
+    d = k["deltas"]; ini_prev, fin_prev = k["prev"]
+    resumen = (
+        f"**Resumen:** Impresiones {chip(d['imp'])}, Descargas {chip(d['dwn'])}, "
+        f"Lanzamientos {chip(d['lnc'])}, Conversión {chip(d['conv'])}, Uso/instalación {chip(d['uso'])} "
+        f"vs. período anterior ({fmt_fecha_es(pd.to_datetime(ini_prev))} – {fmt_fecha_es(pd.to_datetime(fin_prev))})."
+    )
+    yoy_block = k["yoy_block"]
+    if yoy_block:
+        ini_yoy, fin_yoy = yoy_block["RangoYoY"]
+        di = yoy_block["Filas"][0][3]; dd = yoy_block["Filas"][1][3]; dl = yoy_block["Filas"][2][3]
+        dc = yoy_block["Filas"][3][3]; du = yoy_block["Filas"][4][3]
+        resumen += (
+            f"  |  **YoY:** Imp {chip(di)}, Desc {chip(dd)}, Lanz {chip(dl)}, "
+            f"Conv {chip(dc)}, Uso {chip(du)} vs. {fmt_fecha_es(pd.to_datetime(ini_yoy))} – {fmt_fecha_es(pd.to_datetime(fin_yoy))}."
+        )
+    return resumen
@@ -1 +1,139 @@
-healthcheck.py
\ No newline at end of file
+# healthcheck.py
+# Estado del dashboard para el balanceador y on-call, sin adjuntar un profiler.
+#
+#   python healthcheck.py                 # imprime el JSON; código de salida 0 (ok) / 1 (degradado)
+#   python healthcheck.py --puerto 8502   # sirve GET /health (200 ok / 503 degradado)
+#
+# Lee los resúmenes que cada proceso de la app vuelca al final de cada rerun
+# (core.RENDIMIENTO_ESTADO, uno por pid) y agrega los de los procesos vivos: ratio de aciertos
+# de la caché, latencia de los reruns (y la de los reruns parciales de cada pestaña), tiempos
+# de reportes (PDF, kaleido, Excel), filas y MB de cada dataset en memoria y memoria propia por
+# sesión. No importa core para no cargar pandas en cada chequeo; la ruta del estado se
+# resuelve igual que en core.py.
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_DIR = Path(os.environ.get("HEAVEN_CACHE_DIR", Path(__file__).resolve().parent / ".cache"))
+PATRON_ESTADO = "rendimiento-*.json"
+ETAPAS_REPORTE = ["reporte_pdf", "pdf", "kaleido", "excel"]
+
+def _pid_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+def _leer_estados(carpeta):
+    """{pid: resumen} de los procesos vivos y lista de pids muertos que dejaron su archivo."""
+    vivos, muertos = {}, []
+    for f in sorted(carpeta.glob(PATRON_ESTADO)):
+        try:
+            r = json.loads(f.read_text())
+        except (OSError, ValueError):
+            continue
+        pid = r.get("pid", -1)
+        if _pid_vivo(pid):
+            vivos[pid] = r
+        else:
+            muertos.append(pid)
+    return vivos, muertos
+
+def _sumar_ms(lista):
+    """Junta resúmenes de tiempos de varios procesos: media ponderada por n y el peor p95."""
+    lista = [t for t in lista if t.get("n")]
+    if not lista:
+        return {"n": 0}
+    n = sum(t["n"] for t in lista)
+    return {"n": n, "medio_ms": round(sum(t["medio_ms"] * t["n"] for t in lista) / n, 2),
+            "p95_ms": max(t["p95_ms"] for t in lista)}
+
+def _sumar_por_clave(dicts):
+    claves = sorted({k for d in dicts for k in d})
+    return {k: _sumar_ms([d[k] for d in dicts if k in d]) for k in claves}
+
+def chequear(max_latencia_ms: float, carpeta: Path = CACHE_DIR) -> dict:
+    """Resumen de salud de todos los procesos vivos: "ok", "sin_datos" (ninguno completó aún
+    un rerun) o "degradado"."""
+    vivos, muertos = _leer_estados(carpeta)
+    if not vivos and not muertos:
+        return {"estado": "sin_datos", "motivos": [f"No hay estado en {carpeta / PATRON_ESTADO}"]}
+
+    motivos = []
+    if not vivos:
+        motivos.append(f"Ningún proceso vivo: los que escribieron el estado ({', '.join(map(str, muertos))}) ya no existen")
+    for pid, r in vivos.items():
+        reruns = r.get("reruns", {})
+        if reruns.get("n") and reruns["medio_ms"] > max_latencia_ms:
+            motivos.append(f"Proceso {pid}: latencia media de rerun {reruns['medio_ms']:.0f} ms > {max_latencia_ms:.0f} ms")
+    estados = list(vivos.values())
+    etapas = _sumar_por_clave([r.get("etapas", {}) for r in estados])
+    caches = [r.get("cache_datasets") or {} for r in estados]
+    aciertos, fallos = sum(c.get("aciertos", 0) for c in caches), sum(c.get("fallos", 0) for c in caches)
+    sesiones = [r.get("sesiones") or {} for r in estados]
+    activas = sum(s.get("activas", 0) for s in sesiones)
+    return {
+        "estado": "degradado" if motivos else "ok",
+        "motivos": motivos,
+        "edad_s": round(time.time() - max((r.get("actualizado", 0) for r in estados), default=0), 1),
+        "pids": sorted(vivos),
+        "pids_muertos": muertos,
+        "cache_datasets": {"aciertos": aciertos, "fallos": fallos,
+                           "ratio": round(aciertos / (aciertos + fallos), 4) if aciertos + fallos else None,
+                           "descartes": sum(c.get("descartes", 0) for c in caches),
+                           "mb": round(sum(c.get("mb", 0) for c in caches), 2),
+                           "max_mb": round(sum(c.get("max_mb", 0) for c in caches), 2)},
+        "rerun": _sumar_ms([r.get("reruns", {}) for r in estados]),
+        "fragmentos": _sumar_por_clave([r.get("fragmentos", {}) for r in estados]),
+        "reportes": {k: etapas[k] for k in ETAPAS_REPORTE if k in etapas},
+        "etapas": etapas,
+        "datasets": [{**d, "pid": pid} for pid, r in vivos.items() for d in r.get("datasets", [])],
+        "sesiones": {"activas": activas,
+                     "mb_medio": round(sum((s.get("mb_medio") or 0) * s.get("activas", 0) for s in sesiones) / activas, 3)
+                                 if activas else None,
+                     "mb_max": max((s["mb_max"] for s in sesiones if s.get("mb_max") is not None), default=None)},
+        "procesos": {pid: {"edad_s": round(time.time() - r.get("actualizado", 0), 1), "rerun": r.get("reruns", {})}
+                     for pid, r in vivos.items()},
+    }
+
+def servir(puerto, max_latencia_ms):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/health"):
+                self.send_error(404); return
+            res = chequear(max_latencia_ms)
+            cuerpo = json.dumps(res, ensure_ascii=False).encode("utf-8")
+            self.send_response(503 if res["estado"] == "degradado" else 200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("", puerto), Handler).serve_forever()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Healthcheck del Dashboard Heaven.")
+    ap.add_argument("--max-latencia-ms", type=float, default=float(os.environ.get("HEAVEN_MAX_LATENCIA_MS", 5000)),
+                    help="Latencia media de rerun a partir de la cual se reporta degradado")
+    ap.add_argument("--puerto", type=int, help="Servir GET /health en este puerto en vez de imprimir")
+    args = ap.parse_args(argv)
+
+    if args.puerto:
+        servir(args.puerto, args.max_latencia_ms)
+        return 0
+    res = chequear(args.max_latencia_ms)
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+    return 1 if res["estado"] == "degradado" else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
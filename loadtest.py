@@ -0,0 +1,269 @@
+# loadtest.py
+# Prueba de carga del dashboard: N sesiones simultáneas corriendo app.py sin navegador ni red.
+#
+#   python loadtest.py --sesiones 1 2 4 8 --acciones 20
+#   python loadtest.py --anios 10 --sesiones 4 16 --salida carga.json   # datos sintéticos
+#
+# Cada sesión es un AppTest de Streamlit en su propio hilo, dentro del mismo proceso: como en
+# el servidor, comparten la caché de datasets, el rasterizador y la cola de reportes. Cada una
+# repite un recorrido realista (granularidad, año, mes, YoY, widgets de cada pestaña, "Generar
+# PDF") con pausas de lectura entre acciones. Por cada nivel de concurrencia reporta latencia
+# de rerun p50/p95/p99, reruns por segundo, tiempo hasta tener el PDF y memoria del proceso;
+# una acción sobre un widget que no está (la app cortó por falta de datos) cuenta como omitida.
+# Las pestañas se renderizan todas en cada rerun (cambiar de pestaña no vuelve a correr nada),
+# así que "pestaña" toca un widget propio de una; AppTest corre el script completo aunque el
+# widget esté en un fragmento, por lo que esas latencias son una cota superior.
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+APP = Path(__file__).resolve().parent / "app.py"
+APP_SINTETICA = "Sintética"
+
+# Acción -> peso en el recorrido (los filtros se tocan más que el PDF)
+ACCIONES = {"granularidad": 3, "anio": 2, "mes": 3, "yoy": 1, "pestaña": 3, "pdf": 1}
+WIDGETS_PESTAÑA = ["Métrica para segmentar", "Periodo de tabla", "Periodo de tabla PDF"]
+
+# =========================
+# Memoria del proceso
+# =========================
+def rss_mb() -> float:
+    """Memoria residente actual (MB); sin /proc, el pico de getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 2**20 if sys.platform == "darwin" else pico / 2**10
+
+class MuestreoMemoria:
+    """Pico de RSS mientras corre un nivel, muestreado en un hilo aparte."""
+    def __init__(self, intervalo=0.2):
+        self.intervalo, self.pico = intervalo, rss_mb()
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._correr, daemon=True)
+
+    def _correr(self):
+        while not self._fin.wait(self.intervalo):
+            self.pico = max(self.pico, rss_mb())
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set(); self._hilo.join()
+        self.pico = max(self.pico, rss_mb())
+
+# =========================
+# AppTest concurrente
+# =========================
+def preparar_apptest():
+    """AppTest asume un solo script a la vez: cada run instala un Runtime simulado propio y lo
+    borra al terminar, apaga `global.appTest` al salir y compila app.py de nuevo. Con varias
+    sesiones en paralelo eso deja a las demás sin Runtime a mitad del script, y compilar en
+    varios hilos a la vez falla en Python 3.11 ("AST constructor recursion depth mismatch").
+    Como en el servidor, se comparten un Runtime y el bytecode del script en todo el proceso."""
+    import logging
+    from unittest.mock import MagicMock
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    config.set_option("global.appTest", True)
+    bytecode = ScriptCache()
+    local_script_runner.ScriptCache = lambda: bytecode
+    # Armar un AppTest fuera de un script avisa "missing ScriptRunContext" si hay Runtime
+    logging.getLogger("streamlit.runtime.scriptrunner.script_run_context").setLevel(logging.ERROR)
+
+# =========================
+# Sesión simulada
+# =========================
+def _widget(lista, etiqueta):
+    """Widget por etiqueta exacta o, si no hay, por la primera que la contenga."""
+    ws = list(lista)
+    return next((w for w in ws if w.label == etiqueta), None) or next(w for w in ws if etiqueta in w.label)
+
+class Sesion:
+    """Un visitante: su AppTest, su generador de acciones y los tiempos de cada rerun."""
+    def __init__(self, semilla, app=None, pausa=0.3, timeout=300):
+        from streamlit.testing.v1 import AppTest
+        self.rng = np.random.default_rng(semilla)
+        self.app, self.pausa, self.timeout = app, pausa, timeout
+        self.at = AppTest.from_file(str(APP), default_timeout=timeout)
+        self.reruns = []      # (acción, segundos)
+        self.pdf = []         # segundos desde el clic hasta tener el PDF
+        self.omitidas = 0     # acciones sobre widgets que no estaban (la app cortó por falta de datos)
+        self.errores = []
+
+    def _run(self, accion):
+        t0 = time.perf_counter()
+        self.at.run()
+        self.reruns.append((accion, time.perf_counter() - t0))
+        if self.at.exception:
+            self.errores.append(f"{accion}: {self.at.exception[0].message}")
+
+    def abrir(self):
+        self._run("inicio")
+        if self.app:
+            _widget(self.at.selectbox, "App").set_value(self.app)
+            self._run("app")
+
+    def accion(self, nombre):
+        at, rng = self.at, self.rng
+        if nombre == "granularidad":
+            w = _widget(at.radio, "Granularidad"); w.set_value(rng.choice(w.options))
+        elif nombre == "anio":
+            w = _widget(at.selectbox, "Año"); w.select_index(int(rng.integers(len(w.options))))
+        elif nombre == "mes":
+            w = _widget(at.selectbox, "Mes"); w.select_index(int(rng.integers(len(w.options))))
+        elif nombre == "yoy":
+            w = _widget(at.toggle, "Comparar YoY"); w.set_value(not w.value)
+        elif nombre == "pestaña":
+            etiqueta = WIDGETS_PESTAÑA[int(rng.integers(len(WIDGETS_PESTAÑA)))]
+            w = _widget(at.selectbox, etiqueta); w.select_index(int(rng.integers(len(w.options))))
+        elif nombre == "pdf":
+            return self.generar_pdf()
+        self._run(nombre)
+
+    def generar_pdf(self):
+        """Clic en "Generar PDF", espera al trabajo de la cola y rerun para la descarga."""
+        from report import COLA_REPORTES
+        t0 = time.perf_counter()
+        _widget(self.at.button, "Generar PDF").click()
+        self._run("pdf")
+        for _, clave, *_ in self.at.session_state["reportes_pedidos"].values():
+            t = COLA_REPORTES.obtener(clave)
+            while t is not None and t.activo and time.perf_counter() - t0 < self.timeout:
+                time.sleep(0.1)
+        self._run("pdf_listo")    # en la app lo pide el fragmento de progreso al terminar (AppTest no corre run_every)
+        self.pdf.append(time.perf_counter() - t0)
+        if not any("PDF" in b.proto.label for b in self.at.get("download_button")):
+            self.errores.append("pdf: sin descarga")
+
+    def recorrido(self, acciones):
+        nombres, pesos = list(ACCIONES), np.array(list(ACCIONES.values()), dtype=float)
+        for nombre in self.rng.choice(nombres, size=acciones, p=pesos / pesos.sum()):
+            time.sleep(self.rng.exponential(self.pausa))
+            try:
+                self.accion(str(nombre))
+            except StopIteration:    # "No hay datos en el rango": la app cortó antes de las pestañas
+                self.omitidas += 1
+            except Exception as e:   # timeout del rerun o del PDF
+                self.errores.append(f"{nombre}: {e!r}")
+
+# =========================
+# Niveles de concurrencia
+# =========================
+def percentiles(segundos):
+    if not segundos:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p = np.percentile(np.asarray(segundos) * 1000, [50, 95, 99])
+    return {"p50_ms": round(float(p[0]), 1), "p95_ms": round(float(p[1]), 1), "p99_ms": round(float(p[2]), 1)}
+
+def correr_nivel(n, acciones, app, pausa, semilla, timeout):
+    """n sesiones abiertas a la vez; cada una hace `acciones` acciones. Resultados del nivel."""
+    rss_inicio = rss_mb()
+    sesiones = [Sesion(semilla * 10_000 + n * 100 + i, app, pausa, timeout) for i in range(n)]
+    with ThreadPoolExecutor(max_workers=n) as pool, MuestreoMemoria() as mem:
+        list(pool.map(Sesion.abrir, sesiones))
+        t0 = time.perf_counter()
+        list(pool.map(lambda s: s.recorrido(acciones), sesiones))
+        dur = time.perf_counter() - t0
+
+    inicio = [seg for s in sesiones for a, seg in s.reruns if a in ("inicio", "app")]
+    reruns = [seg for s in sesiones for a, seg in s.reruns if a not in ("inicio", "app")]
+    por_accion = {}
+    for s in sesiones:
+        for a, seg in s.reruns:
+            por_accion.setdefault(a, []).append(seg)
+    return {
+        "sesiones": n,
+        "reruns": len(reruns),
+        **percentiles(reruns),
+        "reruns_por_s": round(len(reruns) / dur, 2) if dur > 0 else None,
+        "duracion_s": round(dur, 2),
+        "inicio": percentiles(inicio),
+        "por_accion": {a: {"n": len(v), **percentiles(v)} for a, v in por_accion.items()},
+        "pdf": {"n": sum(len(s.pdf) for s in sesiones), **percentiles([x for s in sesiones for x in s.pdf])},
+        "omitidas": sum(s.omitidas for s in sesiones),
+        "rss_mb": round(rss_mb(), 1),
+        "rss_pico_mb": round(mem.pico, 1),
+        "rss_delta_mb": round(mem.pico - rss_inicio, 1),
+        "errores": [e for s in sesiones for e in s.errores],
+    }
+
+def _fmt(v, ancho, dec=0):
+    return f"{'–':>{ancho}}" if v is None else f"{v:>{ancho},.{dec}f}"
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prueba de carga del dashboard con sesiones simuladas (AppTest).")
+    ap.add_argument("--sesiones", type=int, nargs="+", default=[1, 2, 4, 8], help="Niveles de concurrencia")
+    ap.add_argument("--acciones", type=int, default=20, help="Acciones por sesión en cada nivel")
+    ap.add_argument("--pausa", type=float, default=0.3, help="Pausa media entre acciones (s, exponencial)")
+    ap.add_argument("--anios", type=float, help="Años de datos sintéticos (por defecto, los CSV del repositorio)")
+    ap.add_argument("--semilla", type=int, default=0)
+    ap.add_argument("--timeout", type=float, default=300, help="Máximo por rerun y por PDF (s)")
+    ap.add_argument("--salida", type=Path, help="Escribir los resultados en este JSON")
+    args = ap.parse_args(argv)
+    if min(args.sesiones) < 1 or args.acciones < 1:
+        ap.error("--sesiones y --acciones deben ser >= 1")
+
+    with tempfile.TemporaryDirectory(prefix="heaven-carga-") as tmp:
+        # Caché, snapshots y registro de apps aislados; se fijan antes de importar core
+        os.environ["HEAVEN_CACHE_DIR"] = str(Path(tmp) / "cache")
+        app = None
+        if args.anios:
+            (Path(tmp) / "apps.json").write_text(json.dumps({APP_SINTETICA: "datos"}), encoding="utf-8")
+            os.environ["HEAVEN_APPS"] = str(Path(tmp) / "apps.json")
+            from benchmark import generar_datos
+            generar_datos(Path(tmp) / "datos", args.anios, semilla=args.semilla)
+            app = APP_SINTETICA
+        preparar_apptest()
+
+        print(f"{'sesiones':>8}{'reruns':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rerun/s':>9}"
+              f"{'PDF p50 s':>11}{'RSS MB':>9}{'pico MB':>9}{'omitidas':>10}{'errores':>9}")
+        niveles = []
+        for n in args.sesiones:
+            r = correr_nivel(n, args.acciones, app, args.pausa, args.semilla, args.timeout)
+            niveles.append(r)
+            pdf_s = r["pdf"]["p50_ms"] / 1000 if r["pdf"]["p50_ms"] is not None else None
+            print(f"{n:>8}{r['reruns']:>8}{_fmt(r['p50_ms'], 9)}{_fmt(r['p95_ms'], 9)}{_fmt(r['p99_ms'], 9)}"
+                  f"{_fmt(r['reruns_por_s'], 9, 1)}{_fmt(pdf_s, 11, 1)}{_fmt(r['rss_mb'], 9)}"
+                  f"{_fmt(r['rss_pico_mb'], 9)}{r['omitidas']:>10}{len(r['errores']):>9}")
+            for e in r["errores"][:3]:
+                print(f"    {e}", file=sys.stderr)
+
+    if args.salida:
+        import pandas as pd
+        args.salida.write_text(json.dumps({
+            "fecha": pd.Timestamp.now().isoformat(timespec="seconds"),
+            "parametros": {k: v for k, v in vars(args).items() if k != "salida"},
+            "niveles": niveles,
+        }, indent=2, ensure_ascii=False))
+        print(f"Resultados → {args.salida}")
+    return 1 if any(r["errores"] for r in niveles) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
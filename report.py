@@ -0,0 +1,840 @@
+# report.py
+# Reportes: assets (logo), figuras Plotly, exportación PNG (kaleido), PDF (ReportLab) y Excel.
+# Igual que core.py, no depende de Streamlit.
+import io
+import os
+import copy
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Union, Callable
+
+import requests
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.graph_objects as go
+
+# ReportLab (PDF)
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.units import cm
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import (
+    SimpleDocTemplate, Paragraph, Spacer, Image,
+    Table, TableStyle, PageBreak, Flowable
+)
+from reportlab.lib.utils import ImageReader
+
+from core import BASE_DIR, CACHE_DIR, METRICAS, RENDIMIENTO, fmt_fecha_es, tabla_por_periodo, lttb, comparativo, Dataset
+
+TITULO = "📊 Dashboard Evolucion de APP Heaven"
+
+# Logo e imagen del repo (se usa en portada e imagen destacada del PDF)
+LOGO_URL = "https://raw.githubusercontent.com/ale1795/HeavenAPP/main/HVN%20central%20blanco.png"
+
+# =========================
+# Assets (logo / imagen destacada)
+# =========================
+# Orden de resolución: memoria -> caché en disco -> PNG incluido en el repo.
+# La red solo se usa para revalidar (ETag / Last-Modified) en segundo plano cuando
+# la copia local venció, o si no existe ninguna copia local.
+ASSET_TTL = 24 * 3600  # segundos
+ASSETS_LOCALES = {LOGO_URL: BASE_DIR / "HVN central blanco.png"}
+
+_assets_mem: Dict[str, Dict] = {}   # url -> {"data", "reader", "verificado"}
+_assets_lock = threading.Lock()
+_assets_revalidando = set()
+
+def _asset_paths(url):
+    h = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return CACHE_DIR / "assets" / f"{h}.bin", CACHE_DIR / "assets" / f"{h}.json"
+
+def _asset_meta(meta_p):
+    try:
+        return json.loads(meta_p.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def _asset_revalidar(url, timeout=10):
+    """GET condicional; un 304 solo renueva la marca de verificación de la copia en disco."""
+    bin_p, meta_p = _asset_paths(url)
+    meta = _asset_meta(meta_p) if bin_p.exists() else {}
+    headers = {}
+    if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+    ahora = time.time()
+    try:
+        r = requests.get(url, headers=headers, timeout=timeout)
+        if r.status_code == 304:
+            data = bin_p.read_bytes()
+        elif r.ok and r.content:
+            data = r.content
+            meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+            bin_p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = bin_p.with_suffix(".tmp"); tmp.write_bytes(data); tmp.replace(bin_p)
+        else:
+            return None
+        meta["verificado"] = ahora
+        meta_p.write_text(json.dumps(meta))
+    except Exception:
+        return None
+    with _assets_lock:
+        _assets_mem[url] = {"data": data, "reader": None, "verificado": ahora}
+    return data
+
+def _asset_revalidar_fondo(url):
+    with _assets_lock:
+        if url in _assets_revalidando: return
+        _assets_revalidando.add(url)
+    def _tarea():
+        try:
+            if _asset_revalidar(url) is None:
+                # Sin red: seguimos con la copia local y reintentamos al vencer el TTL
+                with _assets_lock:
+                    if url in _assets_mem: _assets_mem[url]["verificado"] = time.time()
+        finally:
+            with _assets_lock: _assets_revalidando.discard(url)
+    threading.Thread(target=_tarea, daemon=True).start()
+
+def obtener_asset(url: str, ttl: float = ASSET_TTL) -> Optional[bytes]:
+    """Bytes del asset sin bloquear en red mientras exista cualquier copia local."""
+    with _assets_lock:
+        ent = _assets_mem.get(url)
+    if ent is None:
+        bin_p, meta_p = _asset_paths(url)
+        data, verificado = None, 0.0
+        if bin_p.exists():
+            try:
+                data = bin_p.read_bytes(); verificado = _asset_meta(meta_p).get("verificado", 0.0)
+            except OSError:
+                data = None
+        local = ASSETS_LOCALES.get(url)
+        if data is None and local is not None and local.exists():
+            data = local.read_bytes()
+        if data is None:
+            return _asset_revalidar(url)   # único caso bloqueante: no hay copia local
+        ent = {"data": data, "reader": None, "verificado": verificado}
+        with _assets_lock:
+            ent = _assets_mem.setdefault(url, ent)
+    if time.time() - ent["verificado"] >= ttl:
+        _asset_revalidar_fondo(url)
+    return ent["data"]
+
+def imagen_asset(url: str) -> Optional[ImageReader]:
+    """ImageReader decodificado una sola vez por proceso (y por versión del asset)."""
+    data = obtener_asset(url)
+    if not data: return None
+    with _assets_lock:
+        ent = _assets_mem.get(url)
+    if ent is not None and ent["data"] is data and ent["reader"] is not None:
+        return ent["reader"]
+    try:
+        reader = ImageReader(io.BytesIO(data))
+        reader.getRGBData()
+    except Exception:
+        return None
+    if ent is not None and ent["data"] is data:
+        ent["reader"] = reader
+    return reader
+
+class ImagenDecodificada(Image):
+    """Flowable Image que reutiliza un ImageReader ya decodificado."""
+    def __init__(self, reader: ImageReader, width=None, height=None):
+        self._img = reader
+        super().__init__(io.BytesIO(b""), width=width, height=height)
+
+# =========================
+# PDF profesional (maquetado avanzado)
+# =========================
+# Las partes fijas del PDF (hojas de estilo, estilos de tabla, separador, logo decodificado y
+# encabezado / pie) se arman una vez por proceso en PLANTILLA_PDF y se comparten entre
+# reportes. Estilos e imágenes decodificadas son de solo lectura durante el maquetado; los
+# flowables fijos se entregan como copia superficial (drawOn guarda el canvas en el flowable),
+# así que la plantilla sirve para varios reportes en paralelo (COLA_REPORTES).
+# La tabla de datos puede ir completa: TablaPaginada arma una Table por página, con el
+# encabezado repetido, en vez de una sola Table con todas las filas.
+PDF_FILAS_TABLA = 30   # filas de la tabla de datos en el modo resumido
+
+def _thousands(x):
+    if isinstance(x, (int, np.integer)): return f"{x:,}"
+    if isinstance(x, float): return f"{x:,.2f}"
+    return str(x)
+
+def _delta_chip(x):
+    if x is None or (isinstance(x, float) and (pd.isna(x) or np.isnan(x))): return "—"
+    return f"{x:+.1f}%"
+
+def _fit_image(img, max_w, max_h):
+    try:
+        ir = img if isinstance(img, ImageReader) else ImageReader(io.BytesIO(img))
+        iw, ih = ir.getSize()
+        ratio = min(max_w / iw, max_h / ih)
+        return ImagenDecodificada(ir, width=iw * ratio, height=ih * ratio)
+    except Exception:
+        return None
+
+class Separador(Flowable):
+    """Franja de color a todo el ancho."""
+    def __init__(self, ancho, alto, color):
+        super().__init__()
+        self.ancho, self.alto, self.color = ancho, alto, color
+
+    def wrap(self, availWidth, availHeight):
+        return self.ancho, self.alto
+
+    def draw(self):
+        self.canv.setFillColor(self.color)
+        self.canv.rect(0, 0, self.ancho, self.alto, stroke=0, fill=1)
+
+class PlantillaPDF:
+    """Partes fijas del PDF, armadas una vez por proceso."""
+    def __init__(self):
+        self.W, self.H = A4
+        self.ancho = self.W - 3*cm
+        s = getSampleStyleSheet()
+        s.add(ParagraphStyle(name="TituloReporte", parent=s["Heading1"], alignment=1, fontSize=20, spaceAfter=8))
+        s.add(ParagraphStyle(name="SubtituloReporte", parent=s["Heading2"], alignment=1, fontSize=11, textColor=colors.grey, spaceAfter=6))
+        s.add(ParagraphStyle(name="BodySmall", parent=s["Normal"], fontSize=9, leading=12))
+        s.add(ParagraphStyle(name="KPIHead", parent=s["Normal"], alignment=1, fontSize=9, textColor=colors.grey))
+        s.add(ParagraphStyle(name="KPIValue", parent=s["Normal"], alignment=1, fontSize=16, spaceAfter=4))
+        s.add(ParagraphStyle(name="KPISub", parent=s["Normal"], alignment=1, fontSize=9, textColor=colors.grey))
+        self.estilos = s
+        self.estilo_kpi = TableStyle([
+            ('BOX',(0,0),(-1,-1), 0.5, colors.lightgrey),
+            ('INNERGRID',(0,0),(-1,-1), 0.25, colors.whitesmoke),
+            ('BACKGROUND',(0,0),(-1,0), colors.whitesmoke),
+            ('VALIGN',(0,0),(-1,-1),'MIDDLE'),
+            ('ALIGN',(0,0),(-1,-1),'CENTER'),
+        ])
+        self.estilo_yoy = TableStyle([
+            ('BACKGROUND',(0,0),(-1,0), colors.Color(0.12,0.12,0.12)),
+            ('TEXTCOLOR',(0,0),(-1,0), colors.white),
+            ('GRID',(0,0),(-1,-1), 0.25, colors.lightgrey),
+            ('ALIGN',(1,1),(-1,-1),'CENTER'),
+            ('FONT',(0,0),(-1,0),'Helvetica-Bold'),
+            ('ROWBACKGROUNDS',(0,1),(-1,-1), [colors.whitesmoke, colors.lightgrey]),
+        ])
+        self.estilo_datos = TableStyle([
+            ('BACKGROUND',(0,0),(-1,0), colors.Color(0.12,0.12,0.12)),
+            ('TEXTCOLOR',(0,0),(-1,0), colors.white),
+            ('ALIGN',(0,0),(-1,-1),'CENTER'),
+            ('GRID',(0,0),(-1,-1), 0.25, colors.lightgrey),
+            ('FONT',(0,0),(-1,0),'Helvetica-Bold'),
+            ('FONT',(0,1),(-1,-1),'Helvetica'),
+            ('ROWBACKGROUNDS',(0,1),(-1,-1), [colors.whitesmoke, colors.lightgrey]),
+        ])
+        self._separador = Separador(self.ancho, 0.15*cm, colors.lightgrey)
+        # Alto de una fila de la tabla de datos (todas son de una línea): define cuántas entran por página
+        self.alto_fila = Table([["x"], ["x"]], style=self.estilo_datos).wrap(self.ancho, self.H)[1] / 2
+        self._imagenes = {}   # (id del reader, ancho, alto) -> (reader, flowable)
+        self._lock = threading.Lock()
+
+    def separador(self) -> Flowable:
+        return copy.copy(self._separador)
+
+    def imagen(self, reader: ImageReader, max_w, max_h) -> Optional[Flowable]:
+        """Imagen ajustada a (max_w, max_h); se ajusta una vez por versión del asset."""
+        clave = (id(reader), max_w, max_h)
+        with self._lock:
+            ent = self._imagenes.get(clave)
+            if ent is None or ent[0] is not reader:
+                if len(self._imagenes) > 8:
+                    self._imagenes.clear()
+                ent = self._imagenes[clave] = (reader, _fit_image(reader, max_w, max_h))
+        return copy.copy(ent[1]) if ent[1] is not None else None
+
+    def encabezado_pie(self, canvas, doc):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.setFillColor(colors.grey)
+        canvas.setStrokeColor(colors.lightgrey)
+        canvas.setLineWidth(0.3)
+        canvas.line(1.5*cm, self.H-1.0*cm, self.W-1.5*cm, self.H-1.0*cm)
+        canvas.drawString(1.5*cm, 0.9*cm, "Dashboard Evolución App Heaven")
+        canvas.drawRightString(self.W-1.5*cm, 0.9*cm, f"Página {doc.page}")
+        canvas.restoreState()
+
+PLANTILLA_PDF = PlantillaPDF()
+
+class TablaPaginada(Flowable):
+    """Tabla de datos de cualquier largo, de a una página: al partirse arma solo las filas que
+    entran (con el encabezado repetido) y deja el resto como otra TablaPaginada. Las filas se
+    formatean recién al armar su página."""
+    def __init__(self, tabla_df: pd.DataFrame, plantilla: PlantillaPDF, desde: int = 0):
+        super().__init__()
+        self.df, self.plantilla, self.desde = tabla_df, plantilla, desde
+        self._tabla = None
+
+    def _armar(self, hasta) -> Table:
+        body = self.df.iloc[self.desde:hasta].copy()
+        for c in METRICAS:
+            if c in body.columns:
+                body[c] = body[c].apply(_thousands)
+        head = list(self.df.columns)
+        return Table([head] + body.astype(str).values.tolist(), repeatRows=1,
+                     colWidths=[self.plantilla.ancho/len(head)]*len(head), style=self.plantilla.estilo_datos)
+
+    def wrap(self, availWidth, availHeight):
+        alto = (len(self.df) - self.desde + 1) * self.plantilla.alto_fila
+        if alto > availHeight:
+            return availWidth, alto   # no entra: el frame la parte con split
+        self._tabla = self._armar(len(self.df))
+        return self._tabla.wrap(availWidth, availHeight)
+
+    def split(self, availWidth, availHeight):
+        n = int(availHeight // self.plantilla.alto_fila) - 1
+        if n < 1:
+            return []   # ni una fila: pasa a la página siguiente
+        hasta = min(len(self.df), self.desde + n)
+        t = self._armar(hasta)
+        while hasta > self.desde + 1 and t.wrap(availWidth, availHeight)[1] > availHeight:
+            hasta -= 1
+            t = self._armar(hasta)
+        return [t] + ([TablaPaginada(self.df, self.plantilla, hasta)] if hasta < len(self.df) else [])
+
+    def draw(self):
+        self._tabla.drawOn(self.canv, 0, 0)
+
+def build_pdf(
+    logo_url: str,
+    titulo: str,
+    subtitulo: str,
+    kpis: Dict[str, float],
+    figuras_png: List[bytes],
+    tabla_df: pd.DataFrame,
+    extra_image: Optional[Union[bytes, ImageReader]] = None,
+    yoy_block: Optional[Dict] = None,
+    resumen_texto: Optional[str] = None,
+    deltas: Optional[Dict[str, float]] = None,        # {"imp","dwn","lnc","conv","uso"}
+    deltas_yoy: Optional[Dict[str, float]] = None,    # no usado visualmente, pero previsto
+    filas_tabla: Optional[int] = PDF_FILAS_TABLA,     # None = tabla completa (paginada)
+):
+    """Genera PDF con portada, imagen destacada, KPIs, gráficos, YoY y tabla."""
+    p = PLANTILLA_PDF
+    W, H, styles = p.W, p.H, p.estilos
+
+    # ----- Doc -----
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4,
+                            topMargin=1.2*cm, bottomMargin=1.2*cm,
+                            leftMargin=1.5*cm, rightMargin=1.5*cm)
+    story = []
+
+    # ----- Portada -----
+    logo = imagen_asset(logo_url)
+    story.append(Spacer(1, 0.4*cm))
+    if logo is not None:
+        logo_img = p.imagen(logo, max_w=3.8*cm, max_h=3.0*cm)
+        if logo_img: story.append(logo_img)
+        story.append(Spacer(1, 0.2*cm))
+    story.append(Paragraph(titulo, styles["TituloReporte"]))
+    story.append(Paragraph(subtitulo, styles["SubtituloReporte"]))
+    story.append(p.separador())
+    story.append(Spacer(1, 0.3*cm))
+
+    # Imagen destacada (del repo)
+    if extra_image is not None:
+        big = (p.imagen(extra_image, max_w=W-3*cm, max_h=H/2) if isinstance(extra_image, ImageReader)
+               else _fit_image(extra_image, max_w=W-3*cm, max_h=H/2))
+        if big:
+            story.append(Paragraph("Imagen destacada", styles["Heading2"]))
+            story.append(big)
+            story.append(Spacer(1, 0.2*cm))
+
+    if resumen_texto:
+        story.append(Paragraph("Resumen ejecutivo", styles["Heading2"]))
+        story.append(Paragraph(resumen_texto, styles["BodySmall"]))
+        story.append(Spacer(1, 0.2*cm))
+    story.append(PageBreak())
+
+    # ----- KPIs en tarjetas -----
+    def _kpi_card(nombre, valor, delta=None):
+        lbl = Paragraph(nombre, styles["KPIHead"])
+        val = Paragraph(_thousands(valor), styles["KPIValue"])
+        if delta is None or (isinstance(delta, float) and pd.isna(delta)):
+            sub = Paragraph("&nbsp;", styles["KPISub"])
+        else:
+            col = colors.green if delta >= 0 else colors.red
+            sub = Paragraph(f"<font color='{col.rgb()}'>({_delta_chip(delta)})</font>", styles["KPISub"])
+        return Table([[lbl],[val],[sub]], colWidths=[(W-3*cm)/5], style=p.estilo_kpi)
+
+    cards = [
+        _kpi_card("👀 Impresiones", kpis["imp"], (deltas or {}).get("imp")),
+        _kpi_card("📥 Descargas",   kpis["dwn"], (deltas or {}).get("dwn")),
+        _kpi_card("🚀 Lanzamientos",kpis["lnc"], (deltas or {}).get("lnc")),
+        _kpi_card("📈 Conversión (%)", kpis["conv"], (deltas or {}).get("conv")),
+        _kpi_card("🧭 Uso/instalación", kpis["uso"], (deltas or {}).get("uso")),
+    ]
+    story.append(Table([cards], colWidths=[(W-3*cm)/5]*5, hAlign='CENTER', spaceBefore=6, spaceAfter=6))
+    story.append(PageBreak())
+
+    # ----- Gráficos (2 por página) -----
+    if figuras_png:
+        story.append(Paragraph("Gráficos", styles["Heading2"]))
+        for i in range(0, len(figuras_png), 2):
+            row = []
+            for j in range(i, min(i+2, len(figuras_png))):
+                img = _fit_image(figuras_png[j], max_w=(W-3*cm)/2 - 0.5*cm, max_h=H-6*cm)
+                if img is None:
+                    img = Image(io.BytesIO(figuras_png[j]), width=(W-3*cm)/2 - 0.5*cm, height=(H-6*cm)/2)
+                row.append(img)
+            story.append(Table([row], colWidths=[(W-3*cm)/2 - 0.5*cm]*len(row)))
+            story.append(Spacer(1, 0.3*cm))
+        story.append(PageBreak())
+
+    # ----- Tabla YoY -----
+    if yoy_block:
+        ini_y, fin_y = yoy_block["RangoYoY"]
+        story.append(Paragraph(
+            f"Comparativo YoY (mismo período del año anterior): "
+            f"{fmt_fecha_es(pd.to_datetime(ini_y))} – {fmt_fecha_es(pd.to_datetime(fin_y))}",
+            styles["Heading2"])
+        )
+        filas = [["Métrica", "Actual", "YoY", "Δ%"]]
+        for nombre, actual, yoy, delta in yoy_block["Filas"]:
+            filas.append([nombre, _thousands(actual), _thousands(yoy), _delta_chip(delta)])
+        story.append(Table(filas, repeatRows=1, colWidths=[6*cm, 3*cm, 3*cm, 3*cm], style=p.estilo_yoy))
+        story.append(PageBreak())
+
+    # ----- Tabla de datos (primeros registros o completa, paginada) -----
+    if filas_tabla is None:
+        story.append(Paragraph(f"Datos agregados ({len(tabla_df):,} registros)", styles["Heading2"]))
+    else:
+        tabla_df = tabla_df.head(filas_tabla)
+        story.append(Paragraph(f"Datos agregados (primeros {filas_tabla} registros)", styles["Heading2"]))
+    story.append(TablaPaginada(tabla_df, p))
+
+    doc.build(story, onFirstPage=p.encabezado_pie, onLaterPages=p.encabezado_pie)
+    return buf.getvalue()
+
+# =========================
+# Figuras
+# =========================
+# Series diarias largas: eje de fechas real (el zoom es del lado del navegador), reducción a
+# un presupuesto de puntos ligado al ancho del gráfico (LTTB) y trazas WebGL por encima de
+# un umbral. Los rangos cortos mantienen el gráfico por categorías.
+SERIE_LARGA = 120           # días a partir de los cuales se usa el modo de serie larga
+ANCHO_GRAFICO_PX = 1400     # ancho típico del gráfico en layout "wide"
+PUNTOS_POR_PX = 1.0
+WEBGL_UMBRAL = 1000         # puntos por traza a partir de los cuales se usa Scattergl
+
+def presupuesto_puntos(ancho_px=ANCHO_GRAFICO_PX):
+    return int(ancho_px * PUNTOS_POR_PX)
+
+def es_serie_larga(agg_local, gran):
+    return gran == "Día" and len(agg_local) > SERIE_LARGA
+
+def figura_serie_larga(agg_local, titulo=None, puntos_max=None, webgl=True):
+    fechas = agg_local["Fecha"].to_numpy(dtype="datetime64[ns]")
+    x = fechas.astype(np.int64).astype(np.float64)
+    dias = np.datetime_as_string(fechas, unit="D")   # "AAAA-MM-DD": payload más corto que ISO con hora
+    f = go.Figure()
+    for m in METRICAS:
+        y = agg_local[m].to_numpy()
+        idx = lttb(x, y, puntos_max) if puntos_max else np.arange(len(y))
+        traza = go.Scattergl if webgl and len(idx) > WEBGL_UMBRAL else go.Scatter
+        f.add_trace(traza(x=dias[idx], y=y[idx], name=m, mode="lines",
+                          hovertemplate=f"{m}=%{{y:,}}<extra></extra>"))
+    f.update_xaxes(type="date")
+    f.update_layout(title=titulo, xaxis_title="", yaxis_title="value", legend_title="")
+    return f
+
+def figura_evolucion(agg_local, gran, titulo=None, puntos_max=None, webgl=True):
+    """puntos_max / webgl solo aplican a series diarias largas (ver es_serie_larga)."""
+    if es_serie_larga(agg_local, gran):
+        return figura_serie_larga(agg_local, titulo, puntos_max, webgl)
+    if gran in ["Día","Semana"]:
+        f = px.line(agg_local, x="Etiqueta", y=METRICAS, markers=True, title=titulo)
+    else:
+        f = px.bar(agg_local, x="Etiqueta", y=METRICAS, barmode="group", title=titulo)
+    f.update_xaxes(type="category"); f.update_layout(xaxis_title="", legend_title="")
+    return f
+
+def figuras_reporte(ds: Dataset, ini_r, fin_r, gran, yoy_block=None):
+    agg_r = ds.cubo.rango(gran, ini_r, fin_r)
+
+    # Figuras base (evolución del período actual)
+    figs = [figura_evolucion(agg_r, gran, f"Evolución por {gran.lower()}", puntos_max=presupuesto_puntos(1100), webgl=False)]
+
+    # Gráficos YoY por métrica (si está activo): cada cubeta contra la misma del año
+    # anterior, alineadas por calendario (core.comparativo)
+    if yoy_block:
+        comp = comparativo(ds, gran, ini_r, fin_r)
+        for m in METRICAS:
+            comb = pd.DataFrame({"Etiqueta": comp["Etiqueta"], "Actual": comp[m], "YoY": comp[f"{m} YoY"]})
+            figm = px.bar(comb, x="Etiqueta", y=["Actual","YoY"], barmode="group", title=f"Comparativo YoY • {m}")
+            figm.update_xaxes(type="category"); figm.update_layout(xaxis_title="", legend_title="")
+            figs.append(figm)
+    else:
+        fig2 = px.bar(agg_r, x="Etiqueta", y=METRICAS, barmode="group", title="Comparativa")
+        fig2.update_xaxes(type="category"); fig2.update_layout(xaxis_title="", legend_title="")
+        figs.append(fig2)
+    return figs
+
+# =========================
+# Rasterización (PNG con kaleido)
+# =========================
+# Cada renderer de kaleido es un Chromium en un subproceso que atiende un pedido a la vez,
+# así que se mantiene un pool de renderers ya arrancados (uno por hilo) y los lotes de
+# figuras se reparten entre ellos. Los PNG se guardan por hash de la especificación de la
+# figura (JSON + tamaño + escala) en memoria y en disco: un reporte repetido sobre el mismo
+# rango no vuelve a renderizar.
+RASTER_HILOS = int(os.environ.get("HEAVEN_RASTER_HILOS", min(4, os.cpu_count() or 1)))
+RASTER_CACHE_MAX = 128        # PNG en memoria
+RASTER_DISCO_MAX = 2000       # PNG en disco (se podan los más viejos)
+
+class Rasterizador:
+    def __init__(self, hilos=RASTER_HILOS):
+        self.hilos = max(1, hilos)
+        self.carpeta = CACHE_DIR / "png"
+        self.mem = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.lock = threading.Lock()
+        self._scopes = queue.Queue()
+        self._creados = 0
+        self._calentado = False
+        self._pool = None
+        self._escrituras = 0
+
+    def clave(self, fig, w, h, scale) -> str:
+        spec = f"{plotly.__version__}|{w}|{h}|{scale}|{fig.to_json()}"
+        return hashlib.blake2b(spec.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _scope(self):
+        try:
+            return self._scopes.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            crear = self._creados < self.hilos
+            if crear: self._creados += 1
+        if not crear:
+            return self._scopes.get()
+        # Misma configuración (plotly.js incluido, MathJax) que el renderer por defecto de plotly
+        import plotly.io as pio
+        from kaleido.scopes.plotly import PlotlyScope
+        base = pio.kaleido.scope
+        return PlotlyScope(plotlyjs=base.plotlyjs, mathjax=base.mathjax, topojson=base.topojson)
+
+    def _render(self, fig, w, h, scale) -> bytes:
+        scope = self._scope()
+        try:
+            with RENDIMIENTO.etapa("kaleido"):
+                return scope.transform(fig.to_dict(), format="png", width=w, height=h, scale=scale)
+        finally:
+            self._scopes.put(scope)
+
+    def _leer(self, clave) -> Optional[bytes]:
+        with self.lock:
+            data = self.mem.get(clave)
+            if data is not None:
+                self.mem.move_to_end(clave)
+                return data
+        try:
+            data = (self.carpeta / f"{clave}.png").read_bytes()
+        except OSError:
+            return None
+        self._guardar_mem(clave, data)
+        return data
+
+    def _guardar_mem(self, clave, data):
+        with self.lock:
+            self.mem[clave] = data
+            self.mem.move_to_end(clave)
+            while len(self.mem) > RASTER_CACHE_MAX:
+                self.mem.popitem(last=False)
+
+    def _guardar(self, clave, data):
+        self._guardar_mem(clave, data)
+        try:
+            self.carpeta.mkdir(parents=True, exist_ok=True)
+            tmp = self.carpeta / f"{clave}.tmp{os.getpid()}-{threading.get_ident()}"
+            tmp.write_bytes(data); os.replace(tmp, self.carpeta / f"{clave}.png")
+        except OSError:
+            return
+        with self.lock:
+            self._escrituras += 1
+            podar = self._escrituras % 100 == 0
+        if podar:
+            archivos = sorted(self.carpeta.glob("*.png"), key=lambda p: p.stat().st_mtime)
+            for viejo in archivos[:max(0, len(archivos) - RASTER_DISCO_MAX)]:
+                viejo.unlink(missing_ok=True)
+
+    def png_lote(self, figs, w=1100, h=500, scale=2) -> List[bytes]:
+        """PNG de cada figura: desde la caché o renderizando los faltantes en paralelo."""
+        claves = [self.clave(f, w, h, scale) for f in figs]
+        salida = [self._leer(c) for c in claves]
+        faltan = [i for i, d in enumerate(salida) if d is None]
+        with self.lock:
+            self.aciertos += len(figs) - len(faltan)
+            self.fallos += len(faltan)
+        if len(faltan) == 1:
+            salida[faltan[0]] = self._render(figs[faltan[0]], w, h, scale)
+        elif faltan:
+            with self.lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="kaleido")
+            futuros = {i: self._pool.submit(self._render, figs[i], w, h, scale) for i in faltan}
+            for i, fut in futuros.items():
+                salida[i] = fut.result()
+        for i in faltan:
+            self._guardar(claves[i], salida[i])
+        return salida
+
+    def calentar(self):
+        """Arranca los renderers en segundo plano (una vez por proceso) para que las figuras del
+        reporte no esperen el arranque de cada uno."""
+        with self.lock:
+            if self._calentado or self._creados:
+                return
+            self._calentado = True
+        def _tarea():
+            try:
+                scope = self._scope()
+                try:
+                    scope.transform({"data": [], "layout": {}}, format="png", width=10, height=10)
+                finally:
+                    self._scopes.put(scope)
+            except Exception:
+                pass
+        for _ in range(self.hilos):
+            threading.Thread(target=_tarea, daemon=True).start()
+
+RASTERIZADOR = Rasterizador()
+
+def plot_to_png(fig, w=1100, h=500, scale=2):
+    return RASTERIZADOR.png_lote([fig], w, h, scale)[0]
+
+# =========================
+# Reportes completos
+# =========================
+def contexto_reporte(k: Dict, resumen: Optional[str] = None) -> Dict:
+    """Parámetros de build_pdf que salen de los KPIs del período (core.calcular_kpis)."""
+    t, d, yoy_block = k["tot"], k["deltas"], k["yoy_block"]
+    deltas_yoy = None
+    if yoy_block:
+        deltas_yoy = {c: fila[3] for c, fila in zip(["imp","dwn","lnc","conv","uso"], yoy_block["Filas"])}
+    return {
+        "kpis": {"imp": t["Impresiones"], "dwn": t["Descargas"], "lnc": t["Lanzamientos"], "conv": k["conv"], "uso": k["uso"]},
+        "subtitulo": f"Rango: {fmt_fecha_es(k['fecha_min'])} a {fmt_fecha_es(k['fecha_max'])} • Granularidad: {k['gran']}",
+        "resumen": resumen, "yoy_block": yoy_block,
+        # Deltas para colorear tarjetas en PDF
+        "deltas": dict(d), "deltas_yoy": deltas_yoy,
+    }
+
+Progreso = Callable[[float, str], None]   # (fracción 0–1, mensaje)
+
+def _sin_progreso(fraccion, mensaje):
+    pass
+
+def generar_reporte_pdf(ds: Dataset, k: Dict, periodo_pdf: str, resumen: Optional[str] = None,
+                        tabla_completa: bool = False, progreso: Progreso = _sin_progreso) -> bytes:
+    """Figuras, PNG y PDF de un período ya calculado con core.calcular_kpis. Con
+    tabla_completa, la tabla de datos trae todas las filas del período (paginada)."""
+    with RENDIMIENTO.etapa("reporte_pdf", gran=k["gran"], periodo=periodo_pdf, filas=k["filas"]):
+        progreso(0.05, "Armando gráficos")
+        ctx = contexto_reporte(k, resumen)
+        figs = figuras_reporte(ds, k["ini"], k["fin"], k["gran"], ctx["yoy_block"])
+        progreso(0.2, f"Rasterizando {len(figs)} gráficos")
+        with RENDIMIENTO.etapa("rasterizacion", figuras=len(figs)):
+            pngs = RASTERIZADOR.png_lote(figs)
+
+        # Imagen destacada: usamos la MISMA del repo por defecto (caché local de assets)
+        extra_image = imagen_asset(LOGO_URL)
+
+        tabla = tabla_por_periodo(ds.cubo, periodo_pdf, k["ini"], k["fin"])
+        filas = len(tabla) if tabla_completa else min(len(tabla), PDF_FILAS_TABLA)
+        progreso(0.7, f"Maquetando PDF ({filas:,} filas)")
+        with RENDIMIENTO.etapa("pdf", filas=filas):
+            return build_pdf(
+                LOGO_URL,
+                TITULO,
+                ctx["subtitulo"],
+                ctx["kpis"],
+                pngs,
+                tabla,
+                extra_image=extra_image,  # imagen del repo
+                yoy_block=ctx["yoy_block"],
+                resumen_texto=ctx["resumen"],
+                deltas=ctx["deltas"],
+                deltas_yoy=ctx["deltas_yoy"],
+                filas_tabla=None if tabla_completa else PDF_FILAS_TABLA,
+            )
+
+# =========================
+# Exportación de tablas (Excel / CSV / Parquet)
+# =========================
+# Las tablas salen de los cubos ya agregados y solo se serializan cuando se piden. El Excel
+# se escribe con xlsxwriter en modo constant_memory: cada fila se vuelca a disco al
+# escribirla, así que la memoria no crece con el tamaño de la tabla.
+FORMATOS_EXPORTACION = {
+    "Excel (.xlsx)": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV":           ("csv", "text/csv"),
+    "Parquet":       ("parquet", "application/vnd.apache.parquet"),
+}
+EXPORT_FILAS_BLOQUE = 50_000
+
+def _valores_excel(serie: pd.Series) -> list:
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return [None if pd.isna(v) else v.to_pydatetime() for v in serie]
+    if pd.api.types.is_float_dtype(serie):
+        return [None if np.isnan(v) else v for v in serie.tolist()]
+    return serie.tolist()
+
+def excel_bytes(tablas: Union[pd.DataFrame, Dict[str, pd.DataFrame]], progreso: Progreso = _sin_progreso) -> bytes:
+    """xlsx con una hoja por tabla ("Datos" si es una sola), escrito fila a fila."""
+    import xlsxwriter
+    if isinstance(tablas, pd.DataFrame):
+        tablas = {"Datos": tablas}
+    out = io.BytesIO()
+    with RENDIMIENTO.etapa("excel", filas=sum(len(t) for t in tablas.values())):
+        wb = xlsxwriter.Workbook(out, {"constant_memory": True, "in_memory": False})
+        # Mismo estilo que pandas.to_excel: encabezado en negrita con borde, fechas con hora
+        f_enc = wb.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        f_fecha = wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        for n, (hoja, tabla) in enumerate(tablas.items()):
+            progreso(n / len(tablas), f"Hoja {hoja} ({len(tabla):,} filas)")
+            ws = wb.add_worksheet(hoja[:31])
+            ws.write_row(0, 0, [str(c) for c in tabla.columns], f_enc)
+            formatos = [f_fecha if pd.api.types.is_datetime64_any_dtype(tabla[c]) else None for c in tabla.columns]
+            # De a EXPORT_FILAS_BLOQUE filas: solo un bloque convertido a valores de Python a la vez
+            for desde in range(0, len(tabla), EXPORT_FILAS_BLOQUE):
+                bloque = tabla.iloc[desde:desde + EXPORT_FILAS_BLOQUE]
+                columnas = [_valores_excel(bloque[c]) for c in bloque.columns]
+                for fila, valores in enumerate(zip(*columnas), start=desde + 1):
+                    for col, v in enumerate(valores):
+                        if v is not None:
+                            ws.write(fila, col, v, formatos[col])
+        wb.close()
+    return out.getvalue()
+
+def csv_bytes(tabla: pd.DataFrame) -> bytes:
+    out = io.BytesIO()
+    with RENDIMIENTO.etapa("csv", filas=len(tabla)):
+        tabla.to_csv(out, index=False, chunksize=EXPORT_FILAS_BLOQUE)
+    return out.getvalue()
+
+def parquet_bytes(tabla: pd.DataFrame) -> bytes:
+    """Parquet (pyarrow, que ya viene con Streamlit); "Etiqueta" se guarda como diccionario."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    out = io.BytesIO()
+    with RENDIMIENTO.etapa("parquet", filas=len(tabla)):
+        t = pa.Table.from_pandas(tabla, preserve_index=False)
+        pq.write_table(t, out, compression="snappy", use_dictionary=["Etiqueta"] if "Etiqueta" in tabla.columns else True,
+                       row_group_size=EXPORT_FILAS_BLOQUE)
+    return out.getvalue()
+
+def exportar(cubo_local, periodos: List[str], ini, fin, formato: str, progreso: Progreso = _sin_progreso) -> bytes:
+    """Bytes del archivo para los periodos pedidos (Diario/Semanal/Mensual/Anual) en
+    formato "xlsx", "csv" o "parquet". Varios periodos: una hoja por periodo en Excel, o
+    una sola tabla con columna "Periodo" en CSV / Parquet."""
+    progreso(0.05, "Agregando tablas")
+    tablas = {p: tabla_por_periodo(cubo_local, p, ini, fin) for p in periodos}
+    if formato == "xlsx":
+        return excel_bytes(tablas, lambda f, m: progreso(0.1 + 0.9 * f, m))
+    if len(periodos) == 1:
+        tabla = tablas[periodos[0]]
+    else:
+        tabla = pd.concat([t.assign(Periodo=p) for p, t in tablas.items()], ignore_index=True)
+        for c in ["MesNum", "Semana"]:
+            if c in tabla.columns: tabla[c] = tabla[c].astype("Int64")   # ausente en algunos periodos
+        claves = ["Periodo"] + [c for c in ["Año","MesNum","Semana","Fecha","Etiqueta"] if c in tabla.columns]
+        tabla = tabla[claves + [c for c in tabla.columns if c not in claves]]
+    progreso(0.3, f"Escribiendo {formato.upper()} ({len(tabla):,} filas)")
+    return csv_bytes(tabla) if formato == "csv" else parquet_bytes(tabla)
+
+# =========================
+# Cola de reportes (segundo plano)
+# =========================
+# PDF y exportaciones corren en un pool acotado de hilos, fuera del hilo del script: la
+# sesión sigue respondiendo y muestra el progreso mientras tanto. Cada trabajo se identifica
+# por la clave de sus parámetros (datos, rango, formato...): un pedido igual a uno en curso
+# se suma a ese trabajo, y uno igual a uno terminado devuelve el resultado guardado mientras
+# no venza (REPORTES_TTL). Los trabajos con error no se guardan: se reintentan al pedirlos.
+REPORTES_HILOS = int(os.environ.get("HEAVEN_REPORTES_HILOS", 2))
+REPORTES_TTL = float(os.environ.get("HEAVEN_REPORTES_TTL_S", 3600))
+REPORTES_MAX = 64             # resultados terminados en memoria
+
+class Trabajo:
+    def __init__(self, clave, descripcion=""):
+        self.clave = clave
+        self.descripcion = descripcion
+        self.estado = "en_cola"       # en_cola | en_curso | listo | error
+        self.progreso = 0.0
+        self.mensaje = "En cola"
+        self.resultado: Optional[bytes] = None
+        self.error: Optional[str] = None
+        self.creado = time.time()
+        self.terminado: Optional[float] = None
+
+    @property
+    def activo(self) -> bool:
+        return self.estado in ("en_cola", "en_curso")
+
+    def avanzar(self, fraccion, mensaje):
+        self.progreso = min(max(float(fraccion), self.progreso), 1.0)
+        self.mensaje = mensaje
+
+class ColaReportes:
+    def __init__(self, hilos=REPORTES_HILOS, ttl=REPORTES_TTL, max_resultados=REPORTES_MAX):
+        self.hilos = max(1, hilos)
+        self.ttl = ttl
+        self.max_resultados = max_resultados
+        self.trabajos = OrderedDict()   # clave -> Trabajo
+        self.reusados = 0
+        self.lock = threading.Lock()
+        self._pool = None
+
+    def enviar(self, clave, fn, *args, descripcion="", **kwargs) -> Trabajo:
+        """Encola fn(*args, progreso=..., **kwargs) -> bytes, o devuelve el trabajo con la misma clave."""
+        with self.lock:
+            self._podar()
+            t = self.trabajos.get(clave)
+            if t is not None and t.estado != "error":
+                self.trabajos.move_to_end(clave)
+                self.reusados += 1
+                return t
+            t = self.trabajos[clave] = Trabajo(clave, descripcion)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="reportes")
+        self._pool.submit(self._correr, t, fn, args, kwargs)
+        return t
+
+    def obtener(self, clave) -> Optional[Trabajo]:
+        with self.lock:
+            self._podar()
+            return self.trabajos.get(clave)
+
+    def _correr(self, t, fn, args, kwargs):
+        inicio = time.time()
+        RENDIMIENTO.registrar("cola_espera", inicio - t.creado)
+        t.estado, t.mensaje = "en_curso", "Generando"
+        try:
+            t.resultado = fn(*args, progreso=t.avanzar, **kwargs)
+            t.avanzar(1.0, "Listo")
+        except Exception as e:
+            t.error = f"{type(e).__name__}: {e}"
+        t.terminado = time.time()   # antes del estado: _podar lee terminado de los que ya no están activos
+        t.estado = "error" if t.error else "listo"
+        RENDIMIENTO.registrar("trabajo_reporte", t.terminado - inicio, descripcion=t.descripcion, estado=t.estado)
+
+    def _podar(self):
+        """Descarta resultados vencidos y, si sobran, los terminados más viejos."""
+        ahora = time.time()
+        terminados = [c for c, t in self.trabajos.items() if not t.activo]
+        for c in terminados:
+            if ahora - self.trabajos[c].terminado > self.ttl:
+                del self.trabajos[c]
+        terminados = [c for c in terminados if c in self.trabajos]
+        for c in terminados[:max(0, len(terminados) - self.max_resultados)]:
+            del self.trabajos[c]
+
+COLA_REPORTES = ColaReportes()
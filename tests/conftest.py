@@ -0,0 +1,72 @@
+# tests/conftest.py
+#   python -m pytest -q        (desde la raíz del repositorio)
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+# Caché aislada (snapshots, PNG, estado de rendimiento): core la resuelve al importarse
+os.environ["HEAVEN_CACHE_DIR"] = tempfile.mkdtemp(prefix="heaven-tests-")
+os.environ["HEAVEN_APPS"] = str(Path(os.environ["HEAVEN_CACHE_DIR"]) / "apps.json")
+
+PLATAFORMAS = ["ios", "android", "roku"]
+
+def escribir_fuentes(carpeta, fechas, semilla=0):
+    """Los tres CSV (date,total,plataformas...) con conteos chicos: se compactan a uint8."""
+    from core import FUENTES_REPO
+    rng = np.random.default_rng(semilla)
+    fuentes = {}
+    for metrica, archivo in FUENTES_REPO.items():
+        df = pd.DataFrame(rng.integers(0, 80, size=(len(fechas), len(PLATAFORMAS))), columns=PLATAFORMAS)
+        df.insert(0, "total", df.sum(axis=1))
+        df.insert(0, "date", pd.DatetimeIndex(fechas).strftime("%Y-%m-%d"))
+        df.to_csv(Path(carpeta) / archivo, index=False)
+        fuentes[metrica] = str(Path(carpeta) / archivo)
+    return fuentes
+
+@pytest.fixture
+def fuentes(tmp_path):
+    """Dos años y un trimestre (incluye el 29 de febrero de 2020) con algunos días sin datos."""
+    fechas = pd.date_range("2019-01-01", "2021-03-31", freq="D")
+    fechas = fechas[~fechas.isin(pd.to_datetime(["2019-03-10", "2020-02-28", "2020-07-01", "2020-12-31"]))]
+    return escribir_fuentes(tmp_path, fechas)
+
+@pytest.fixture
+def ds(fuentes):
+    from core import construir_dataset
+    return construir_dataset(fuentes)
+
+# Rangos de prueba sobre el fixture `fuentes`
+RANGOS = [("2019-01-01", "2021-03-31"),   # todo
+          ("2019-03-10", "2020-03-01"),   # bordes a mitad de semana / mes, arranca en un día sin datos
+          ("2020-02-20", "2020-03-05"),   # 29 de febrero adentro
+          ("2020-06-29", "2020-07-01")]   # termina en un día sin datos
+
+# =========================
+# Referencias: cuentas directas sobre los frames
+# =========================
+def filtrar(df, ini, fin):
+    return df[(df["Fecha"] >= pd.Timestamp(ini)) & (df["Fecha"] <= pd.Timestamp(fin))]
+
+def suma(df, ini, fin):
+    """({métrica: total}, filas) de df_all en [ini, fin]; sin filas si el tramo es NaT."""
+    from core import METRICAS
+    if pd.isna(ini):
+        return dict.fromkeys(METRICAS, 0), 0
+    d = filtrar(df, ini, fin)
+    return {m: int(d[m].astype(np.int64).sum()) for m in METRICAS}, len(d)
+
+def agrupar(df, nivel, cols):
+    """Agregado de referencia: groupby directo con las claves del nivel, en el orden de los cubos."""
+    from core import NIVELES, ORDEN
+    by, lab = NIVELES[nivel]
+    g = (df.astype({c: np.int64 for c in cols}).groupby(by, observed=True)[cols].sum()
+           .reset_index().rename(columns={lab: "Etiqueta"}))
+    g["Etiqueta"] = g["Etiqueta"].astype(str)
+    return g.sort_values([c for c in ORDEN if c in g.columns] + ["Etiqueta"], kind="stable", ignore_index=True)
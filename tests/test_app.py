@@ -0,0 +1,61 @@
+# tests/test_app.py
+# app.py con AppTest: las descargas viven en el rerun completo y sobreviven a los widgets
+# de las pestañas (fragmentos).
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from conftest import RAIZ
+from report import COLA_REPORTES
+
+APP = str(RAIZ / "app.py")
+DESCARGA_EXCEL = "📥 Descargar Excel (.xlsx)"
+DESCARGA_PDF = "📥 Descargar PDF"
+
+def _descargas(at):
+    return sorted(e.proto.label for e in at.get("download_button"))
+
+def _selectbox(at, etiqueta):
+    return next(w for w in at.selectbox if w.label == etiqueta)
+
+def _pedir(at, boton, pestaña, timeout=180):
+    """Clic en el botón de la pestaña, espera el trabajo en la cola y vuelve a correr (en la app
+    lo hace el fragmento de progreso; AppTest no corre los run_every)."""
+    next(b for b in at.button if boton in b.label).click().run()
+    assert not at.exception
+    clave = at.session_state["reportes_pedidos"][pestaña][1]
+    t0 = time.time()
+    while COLA_REPORTES.obtener(clave).activo:
+        assert time.time() - t0 < timeout, f"el trabajo {pestaña} no terminó"
+        time.sleep(0.1)
+    at.run()
+    assert not at.exception
+
+def test_descargas_sobreviven_a_widgets_de_otras_pestañas():
+    at = AppTest.from_file(APP, default_timeout=300).run()
+    assert not at.exception and _descargas(at) == []
+
+    _pedir(at, "Preparar descarga", "exportacion")
+    assert _descargas(at) == [DESCARGA_EXCEL]
+
+    # Widgets de otras pestañas y de la propia: la descarga del último pedido sigue
+    _selectbox(at, "Periodo de tabla PDF").select_index(2).run()
+    assert _descargas(at) == [DESCARGA_EXCEL]
+    _selectbox(at, "Métrica para segmentar").select_index(0).run()
+    assert _descargas(at) == [DESCARGA_EXCEL]
+    _selectbox(at, "Periodo de tabla").select_index(3).run()
+    assert _descargas(at) == [DESCARGA_EXCEL]
+
+    _pedir(at, "Generar PDF", "pdf")
+    assert _descargas(at) == sorted([DESCARGA_EXCEL, DESCARGA_PDF])
+    _selectbox(at, "Periodo de tabla").select_index(0).run()
+    assert _descargas(at) == sorted([DESCARGA_EXCEL, DESCARGA_PDF])
+
+def test_pedido_se_descarta_al_cambiar_el_rango():
+    at = AppTest.from_file(APP, default_timeout=300).run()
+    _pedir(at, "Preparar descarga", "exportacion")
+    assert _descargas(at) == [DESCARGA_EXCEL]
+    anio = _selectbox(at, "Año")
+    anio.select_index((anio.index + len(anio.options) - 1) % len(anio.options)).run()
+    assert _descargas(at) == []
+    assert "exportacion" not in at.session_state["reportes_pedidos"]
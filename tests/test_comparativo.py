@@ -0,0 +1,85 @@
+# tests/test_comparativo.py
+# comparativo (período anterior / YoY de cada cubeta) contra ventanas armadas fecha a fecha,
+# y el bloque YoY de calcular_kpis contra comparativo.
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core import METRICAS, NIVELES, calcular_kpis, comparativo
+from conftest import RANGOS, filtrar, suma
+
+def _anterior(a, b, gran):
+    """Período anterior según las reglas del dashboard, escrito fecha a fecha."""
+    if gran == "Año":
+        return pd.Timestamp(a.year - 1, 1, 1), pd.Timestamp(a.year - 1, 12, 31)
+    if gran == "Mes":
+        fin = a.replace(day=1) - pd.Timedelta(days=1)
+        return fin.replace(day=1), fin
+    if gran == "Semana":
+        return a - pd.Timedelta(days=7), b - pd.Timedelta(days=7)
+    dur = b - a + pd.Timedelta(days=1)
+    return a - dur, b - dur
+
+def _yoy(a, b, gran):
+    """Mismo período un año antes; en Semana, la misma semana ISO y días del año ISO anterior."""
+    if gran != "Semana":
+        return a - pd.DateOffset(years=1), b - pd.DateOffset(years=1)
+    anio, sem, _ = a.isocalendar()
+    try:
+        return (pd.Timestamp(date.fromisocalendar(anio - 1, sem, a.isoweekday())),
+                pd.Timestamp(date.fromisocalendar(anio - 1, sem, b.isoweekday())))
+    except ValueError:   # el año ISO anterior no tiene semana 53
+        return pd.NaT, pd.NaT
+
+def _pct(a, b):
+    return (a - b) / b * 100.0 if b > 0 else np.nan
+
+@pytest.mark.parametrize("gran", list(NIVELES))
+@pytest.mark.parametrize("ini, fin", RANGOS)
+def test_comparativo_igual_a_fuerza_bruta(ds, gran, ini, fin):
+    # Tramo de cada cubeta: del primer al último día con datos de la cubeta, recortado al rango
+    by, lab = NIVELES[gran]
+    extension = ds.df_all.groupby(by, observed=True)["Fecha"].agg(["min", "max"])
+    en_rango = filtrar(ds.df_all, ini, fin).groupby(by, observed=True).size().index
+    t = comparativo(ds, gran, ini, fin)
+    assert len(t) == len(en_rango)
+    for _, fila in t.iterrows():
+        a, b = extension.loc[tuple(fila[c if c != lab else "Etiqueta"] for c in by)]
+        a, b = max(a, pd.Timestamp(ini)), min(b, pd.Timestamp(fin))
+        actual, _ = suma(ds.df_all, a, b)
+        ant, n_ant = suma(ds.df_all, *_anterior(a, b, gran))
+        ya, n_ya = suma(ds.df_all, *_yoy(a, b, gran))
+        for m in METRICAS:
+            esperado = {m: actual[m],
+                        f"{m} anterior": ant[m] if n_ant else np.nan, f"Δ% {m}": _pct(actual[m], ant[m]) if n_ant else np.nan,
+                        f"{m} YoY": ya[m] if n_ya else np.nan, f"Δ% {m} YoY": _pct(actual[m], ya[m]) if n_ya else np.nan}
+            np.testing.assert_allclose(fila[list(esperado)].astype(float).to_numpy(), list(esperado.values()),
+                                       err_msg=f"{gran} {a.date()}–{b.date()} {m}")
+
+def test_comparativo_29_de_febrero(ds):
+    df = ds.df_all.set_index("Fecha")
+    dia = comparativo(ds, "Día", "2020-02-29", "2020-02-29").iloc[0]
+    assert dia["Impresiones YoY"] == df.loc["2019-02-28", "Impresiones"]   # DateOffset: al 28 de febrero
+    assert np.isnan(dia["Impresiones anterior"])                           # el 28/02/2020 no tiene datos
+    mes = comparativo(ds, "Mes", "2020-02-01", "2020-02-29").iloc[0]
+    assert mes["Impresiones YoY"] == df.loc["2019-02-01":"2019-02-28", "Impresiones"].astype(np.int64).sum()
+    marzo = comparativo(ds, "Mes", "2020-03-01", "2020-03-31").iloc[0]
+    assert marzo["Impresiones anterior"] == df.loc["2020-02-01":"2020-02-29", "Impresiones"].astype(np.int64).sum()
+    assert np.isnan(comparativo(ds, "Día", "2021-02-28", "2021-02-28").iloc[0]["Impresiones YoY"])
+
+@pytest.mark.parametrize("gran, ini, fin", [("Semana", "2020-06-08", "2020-06-14"),
+                                            ("Mes", "2020-02-01", "2020-02-29"),
+                                            ("Día", "2020-02-29", "2020-02-29")])
+def test_kpis_yoy_igual_a_comparativo(ds, gran, ini, fin):
+    """Un rango de una sola cubeta: el bloque YoY de los KPI y la fila de comparativo hablan del mismo año anterior."""
+    k = calcular_kpis(ds, pd.Timestamp(ini).date(), pd.Timestamp(fin).date(), gran, cmp_yoy=True)
+    fila = comparativo(ds, gran, ini, fin).iloc[0]
+    for nombre, actual, yoy, _ in k["yoy_block"]["Filas"][:len(METRICAS)]:
+        assert (actual, yoy) == (fila[nombre], fila[f"{nombre} YoY"]), nombre
+
+def test_kpis_sin_semana_53_el_año_anterior(ds):
+    k = calcular_kpis(ds, date(2020, 12, 28), date(2021, 1, 3), "Semana", cmp_yoy=True)
+    assert k["yoy_block"] is None
+    assert np.isnan(comparativo(ds, "Semana", "2020-12-28", "2021-01-03")["Impresiones YoY"]).all()
@@ -0,0 +1,30 @@
+# tests/test_cubos.py
+# Cubos de agregación (CuboRollup) y de plataformas (CuboPlataformas) contra un groupby directo.
+import pandas as pd
+import pytest
+
+from core import METRICAS, NIVELES
+from conftest import RANGOS, agrupar, filtrar
+
+@pytest.mark.parametrize("nivel", list(NIVELES))
+@pytest.mark.parametrize("ini, fin", RANGOS)
+def test_cubo_rollup_igual_a_groupby(ds, nivel, ini, fin):
+    esperado = agrupar(filtrar(ds.df_all, ini, fin), nivel, METRICAS)
+    pd.testing.assert_frame_equal(ds.cubo.rango(nivel, ini, fin), esperado, check_dtype=False)
+
+@pytest.mark.parametrize("nivel", list(NIVELES))
+@pytest.mark.parametrize("ini, fin", RANGOS)
+def test_cubo_plataformas_igual_a_groupby(ds, nivel, ini, fin):
+    by, lab = NIVELES[nivel]
+    claves = ds.df_all[["Fecha"] + by].loc[:, lambda d: ~d.columns.duplicated()]
+    for m in ds.plataformas.metricas:
+        plat = ds.plat[m]
+        cols = [c for c in plat.columns if c != "Fecha"]
+        d = filtrar(plat, ini, fin).merge(claves, on="Fecha")
+        esperado = agrupar(d, nivel, cols)
+        pd.testing.assert_frame_equal(ds.plataformas.rango(m, nivel, ini, fin), esperado, check_dtype=False)
+        # Último período: la cubeta del último día con datos (no la última fila de la tabla ordenada)
+        ultima = d.sort_values("Fecha").iloc[-1]
+        clave = tuple(str(ultima[c]) if c == lab else ultima[c] for c in by)
+        fila = esperado.set_index([c if c != lab else "Etiqueta" for c in by]).loc[clave, cols]
+        assert ds.plataformas.ultimo(m, nivel, ini, fin).tolist() == fila.tolist()
@@ -0,0 +1,37 @@
+# tests/test_exportacion.py
+# Lo exportado no hereda los tipos compactos de memoria (int8/int16/uint8): claves y conteos en int64.
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from core import PERIODOS, construir_dataset, tabla_por_periodo
+from report import exportar
+
+@pytest.fixture
+def ds(fuentes):
+    return construir_dataset(fuentes)
+
+def test_dataset_en_memoria_es_compacto(ds):
+    assert ds.df_all["Año"].dtype == np.int16 and ds.df_all["Impresiones"].dtype == np.uint8
+
+@pytest.mark.parametrize("periodo", list(PERIODOS))
+def test_tabla_por_periodo_en_int64(ds, periodo):
+    tabla = tabla_por_periodo(ds.cubo, periodo, ds.data_min, ds.data_max)
+    enteros = [c for c in ["Año", "MesNum", "Semana", "Impresiones", "Descargas", "Lanzamientos"] if c in tabla.columns]
+    assert {c: str(tabla[c].dtype) for c in enteros} == {c: "int64" for c in enteros}
+
+@pytest.mark.parametrize("periodos", [["Mensual"], ["Diario", "Semanal", "Anual"]])
+def test_parquet_exportado_en_int64(ds, periodos):
+    t = pq.read_table(io.BytesIO(exportar(ds.cubo, periodos, ds.data_min, ds.data_max, "parquet")))
+    tipos = {f.name: str(f.type) for f in t.schema}
+    for c in ["Año", "MesNum", "Semana", "Impresiones", "Descargas", "Lanzamientos"]:
+        if c in tipos:
+            assert tipos[c] == "int64", (c, tipos[c])
+
+def test_csv_exportado_coincide_con_la_tabla(ds):
+    csv = pd.read_csv(io.BytesIO(exportar(ds.cubo, ["Semanal"], ds.data_min, ds.data_max, "csv")))
+    tabla = tabla_por_periodo(ds.cubo, "Semanal", ds.data_min, ds.data_max)
+    pd.testing.assert_frame_equal(csv, tabla.astype({"Etiqueta": object}))
@@ -0,0 +1,73 @@
+# tests/test_filtros.py
+# IndiceFiltros (opciones de los selectores de año / semana / día) contra recorrer df_all,
+# y la semana que resuelve rango_inteligente con el índice.
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from core import construir_dataset, rango_inteligente
+from conftest import escribir_fuentes
+
+@pytest.fixture
+def ds_bordes(tmp_path):
+    """Semanas repetidas en un mismo año: en 2022 la 52 (1-2 ene. son de la 52 de 2021) y en
+    2024 la 1 (la semana ISO 1 de 2025 empieza el lunes 30 de diciembre de 2024)."""
+    fechas = pd.date_range("2021-12-01", "2025-02-15", freq="D")
+    return construir_dataset(escribir_fuentes(tmp_path, fechas[fechas != "2024-12-31"]))
+
+def _lunes_por_scan(df, anio, semana):
+    """Lunes de la semana `semana` entre las filas de `anio`; si aparece al inicio y al final
+    del año, el de la que pertenece al año ISO `anio`."""
+    filas = df[(df["Año"] == anio) & (df["Semana"] == semana)]["Fecha"]
+    propias = filas[filas.dt.isocalendar()["year"] == anio]
+    filas = propias if len(propias) else filas
+    lunes = set((filas - pd.to_timedelta(filas.dt.weekday, unit="D")).dt.date)
+    assert len(lunes) == 1
+    return lunes.pop()
+
+@pytest.mark.parametrize("caso", ["ds", "ds_bordes"])
+def test_indice_filtros_igual_a_recorrer_df_all(caso, request):
+    ds = request.getfixturevalue(caso)
+    df, filtros = ds.df_all, ds.filtros
+    assert filtros.anios == sorted(int(a) for a in df["Año"].unique())
+    for a in filtros.anios:
+        del_anio = df[df["Año"] == a]
+        assert filtros.dias[a] == sorted(del_anio["Fecha"].dt.strftime("%Y-%m-%d"))
+        assert list(filtros.semanas[a]) == sorted(int(s) for s in del_anio["Semana"].unique())
+        for s in filtros.semanas[a]:
+            assert filtros.lunes(a, s) == _lunes_por_scan(df, a, s), (a, s)
+    assert filtros.lunes(filtros.anios[0], 60) is None
+
+def test_semana_53_de_2020_vista_desde_2021(ds):
+    f = ds.filtros
+    assert f.lunes(2020, 53) == date(2020, 12, 28)
+    assert f.lunes(2021, 53) == date(2020, 12, 28)   # 1 a 3 de enero de 2021 son de la semana 53 de 2020
+    assert f.semanas[2021][1] == date(2021, 1, 4)
+    assert "2020-12-31" not in f.dias[2020] and "2021-01-01" in f.dias[2021]
+
+def test_semanas_repetidas_en_un_año(ds_bordes):
+    f = ds_bordes.filtros
+    assert f.lunes(2022, 52) == date(2022, 12, 26)    # no la del 1-2 ene., que es de 2021
+    assert f.lunes(2022, 1) == date(2022, 1, 3)
+    assert f.lunes(2024, 1) == date(2024, 1, 1)       # no la del 30-31 dic., que es de 2025
+    assert f.lunes(2024, 52) == date(2024, 12, 23)
+    assert f.lunes(2025, 1) == date(2024, 12, 30)
+    assert "2024-12-30" in f.dias[2024] and "2024-12-31" not in f.dias[2024]
+
+@pytest.mark.parametrize("caso", ["ds", "ds_bordes"])
+def test_rango_inteligente_con_filtros(caso, request):
+    ds = request.getfixturevalue(caso)
+    f = ds.filtros
+    for a in f.anios:
+        for s, lunes in f.semanas[a].items():
+            ini, fin = rango_inteligente(a, semana=s, data_min=ds.data_min, data_max=ds.data_max, filtros=f)
+            assert (ini, fin) == (max(lunes, ds.data_min), min(lunes + timedelta(days=6), ds.data_max)), (a, s)
+
+def test_rango_inteligente_semanas_de_borde(ds, ds_bordes):
+    assert rango_inteligente(2021, semana=53, filtros=ds.filtros) == (date(2020, 12, 28), date(2021, 1, 3))
+    assert rango_inteligente(2024, semana=1, filtros=ds_bordes.filtros) == (date(2024, 1, 1), date(2024, 1, 7))
+    assert rango_inteligente(2025, semana=1, filtros=ds_bordes.filtros) == (date(2024, 12, 30), date(2025, 1, 5))
+    # Sin índice, la semana es la ISO del año pedido
+    assert rango_inteligente(2025, semana=1) == (date(2024, 12, 30), date(2025, 1, 5))
+    assert rango_inteligente(2020, semana=1) == (date(2019, 12, 30), date(2020, 1, 5))
@@ -0,0 +1,12 @@
+# tests/test_indice_rango.py
+# IndiceRango (sumas acumuladas) contra filtrar y sumar df_all.
+import pandas as pd
+
+from conftest import suma
+
+def test_indice_rango_igual_a_filtrar_y_sumar(ds):
+    fechas = pd.date_range("2018-12-25", "2021-04-05", freq="9D")
+    for ini in fechas[::3]:
+        for fin in fechas:
+            tot, n = ds.idx.sumar(ini, fin)
+            assert (tot, n) == suma(ds.df_all, ini, fin), (ini, fin)
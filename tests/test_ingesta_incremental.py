@@ -0,0 +1,109 @@
+# tests/test_ingesta_incremental.py
+# refrescar_incremental (anexo al final de los CSV) contra reconstruir el dataset completo.
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import core
+from core import METRICAS, NIVELES, construir_dataset, obtener_dataset, refrescar_incremental
+from conftest import RANGOS, escribir_fuentes
+
+def _sin_categorias(df):
+    return df.astype({c: str for c in df.select_dtypes("category")})
+
+def test_refrescar_incremental_igual_a_reconstruir(tmp_path):
+    fechas = pd.date_range("2019-01-01", "2021-03-31", freq="D")
+    fechas = fechas[fechas != "2020-07-01"]
+    corte = fechas.searchsorted(pd.Timestamp("2021-02-17"))   # miércoles: semana y mes quedan abiertos
+    (tmp_path / "completo").mkdir()
+    completas = escribir_fuentes(tmp_path / "completo", fechas)
+    fuentes = escribir_fuentes(tmp_path, fechas[:corte])
+    obtener_dataset(fuentes)
+    for m, f in fuentes.items():   # el refresco diario: las filas que faltan, al final de cada CSV
+        pd.read_csv(completas[m]).iloc[corte:].to_csv(f, mode="a", header=False, index=False)
+
+    inc = refrescar_incremental(fuentes)
+    assert inc is not None, "el anexo debió extender el dataset anterior"
+    ref = construir_dataset(fuentes)
+    pd.testing.assert_frame_equal(_sin_categorias(inc.df_all), _sin_categorias(ref.df_all), check_dtype=False)
+    for c in METRICAS:
+        np.testing.assert_array_equal(inc.idx.acum[c], ref.idx.acum[c])
+    for nivel in NIVELES:
+        for ini, fin in RANGOS:
+            pd.testing.assert_frame_equal(inc.cubo.rango(nivel, ini, fin), ref.cubo.rango(nivel, ini, fin))
+            for m in ref.plataformas.metricas:
+                pd.testing.assert_frame_equal(inc.plataformas.rango(m, nivel, ini, fin),
+                                              ref.plataformas.rango(m, nivel, ini, fin))
+
+def _anexar(fuentes, completas, desde, hasta):
+    for m, f in fuentes.items():
+        pd.read_csv(completas[m]).iloc[desde:hasta].to_csv(f, mode="a", header=False, index=False)
+
+class _Lecturas:
+    """open() que cuenta los bytes leídos de cada archivo."""
+    def __init__(self):
+        self.bytes = 0
+
+    def __call__(self, *args, **kwargs):
+        fh = open(*args, **kwargs)
+        lecturas = self
+        class Archivo:
+            def __enter__(self):
+                return self
+            def __exit__(self, *exc):
+                fh.close()
+            def read(self, *a):
+                b = fh.read(*a); lecturas.bytes += len(b); return b
+            def readline(self, *a):
+                b = fh.readline(*a); lecturas.bytes += len(b); return b
+            def seek(self, *a):
+                return fh.seek(*a)
+        return Archivo()
+
+def test_anexos_sucesivos_extienden_el_cubo_de_plataformas(tmp_path, monkeypatch):
+    fechas = pd.date_range("2019-01-01", "2021-03-31", freq="D")
+    cortes = [fechas.searchsorted(pd.Timestamp(d)) for d in ("2020-12-30", "2021-01-13", "2021-02-17")]
+    (tmp_path / "completo").mkdir()
+    completas = escribir_fuentes(tmp_path / "completo", fechas)
+    fuentes = escribir_fuentes(tmp_path, fechas[:cortes[0]])
+    monkeypatch.setattr(core, "INGESTA_COLA_BYTES", 256)   # menor que los CSV de prueba
+    ds = obtener_dataset(fuentes)
+    ds.plataformas   # ya armado: el refresco lo extiende en vez de dejarlo para reconstruir
+
+    for i, (desde, hasta) in enumerate(zip(cortes, cortes[1:] + [len(fechas)])):
+        antes = sum(Path(f).stat().st_size for f in fuentes.values())
+        _anexar(fuentes, completas, desde, hasta)
+        lecturas = _Lecturas()
+        with monkeypatch.context() as mp:
+            mp.setattr(core, "open", lecturas, raising=False)
+            inc = refrescar_incremental(fuentes)
+        assert inc is not None and inc._plataformas is not None
+        if i:   # con el estado del hash de la marca solo se leen encabezado, cola y bytes nuevos
+            anexado = sum(Path(f).stat().st_size for f in fuentes.values()) - antes
+            assert lecturas.bytes <= anexado + 3 * (256 + 100)
+        ref = construir_dataset(fuentes)
+        contenido = {m: hashlib.blake2b(Path(f).read_bytes(), digest_size=16).hexdigest() for m, f in fuentes.items()}
+        assert inc.huella == core._clave_dataset(contenido)
+        for nivel in NIVELES:
+            for ini, fin in RANGOS:
+                for m in ref.plataformas.metricas:
+                    pd.testing.assert_frame_equal(inc.plataformas.rango(m, nivel, ini, fin),
+                                                  ref.plataformas.rango(m, nivel, ini, fin))
+                    u_inc, u_ref = inc.plataformas.ultimo(m, nivel, ini, fin), ref.plataformas.ultimo(m, nivel, ini, fin)
+                    assert (u_inc is None) == (u_ref is None)
+                    if u_ref is not None:
+                        pd.testing.assert_series_equal(u_inc, u_ref)
+
+def test_cambio_al_final_del_prefijo_no_es_anexo(tmp_path):
+    fechas = pd.date_range("2020-01-01", "2020-12-31", freq="D")
+    (tmp_path / "completo").mkdir()
+    completas = escribir_fuentes(tmp_path / "completo", fechas)
+    fuentes = escribir_fuentes(tmp_path, fechas[:200])
+    obtener_dataset(fuentes)
+    f = Path(fuentes[METRICAS[0]])
+    datos = f.read_bytes()
+    f.write_bytes(datos[:-3] + (b"9" if datos[-3:-2] != b"9" else b"8") + datos[-2:])   # reescribe la última fila
+    _anexar(fuentes, completas, 200, len(fechas))
+    assert refrescar_incremental(fuentes) is None
@@ -0,0 +1,47 @@
+# tests/test_snapshot.py
+# Snapshot del dataset combinado: el segundo armado sale de columnas mapeadas y es igual al primero.
+import mmap
+
+import numpy as np
+import pandas as pd
+
+from core import METRICAS, NIVELES, construir_dataset
+from conftest import RANGOS
+
+def _mapeada(a):
+    while a is not None:
+        if isinstance(a, (np.memmap, mmap.mmap)):
+            return True
+        a = getattr(a, "base", None)
+    return False
+
+def test_dataset_desde_snapshot_igual_y_mapeado(fuentes):
+    ref = construir_dataset(fuentes)   # parsea y guarda el snapshot
+    ds = construir_dataset(fuentes)
+    pd.testing.assert_frame_equal(ds.df_all, ref.df_all)
+    pd.testing.assert_frame_equal(ds.cal, ref.cal)
+    for m in METRICAS:
+        pd.testing.assert_frame_equal(ds.plat[m], ref.plat[m])
+        assert ds.marcas[m]["marca"] == ref.marcas[m]["marca"]
+        assert ds.marcas[m]["huella"] == ref.marcas[m]["huella"]
+    for c in ds.df_all.columns:
+        serie = ds.df_all[c]
+        valores = serie.array.codes if isinstance(serie.dtype, pd.CategoricalDtype) else serie.to_numpy()
+        assert _mapeada(valores), c
+    assert not any(_mapeada(ref.df_all[c].to_numpy()) for c in METRICAS)
+    for nivel in NIVELES:
+        for ini, fin in RANGOS:
+            pd.testing.assert_frame_equal(ds.cubo.rango(nivel, ini, fin), ref.cubo.rango(nivel, ini, fin))
+            for m in METRICAS:
+                pd.testing.assert_frame_equal(ds.plataformas.rango(m, nivel, ini, fin),
+                                              ref.plataformas.rango(m, nivel, ini, fin))
+
+def test_snapshot_del_dataset_se_invalida_si_cambia_una_fuente(fuentes):
+    construir_dataset(fuentes)
+    f = fuentes[METRICAS[1]]
+    df = pd.read_csv(f)
+    df.loc[0, df.columns[1:]] += 1
+    df.to_csv(f, index=False)
+    ds = construir_dataset(fuentes)
+    assert not _mapeada(ds.df_all[METRICAS[1]].to_numpy())
+    assert ds.df_all[METRICAS[1]].iloc[0] == df.iloc[0, 1]